@@ -0,0 +1,90 @@
+"""
+Micro-benchmark for prompt assembly.
+
+Compares the compiled templates in prompts/loader.py against the previous approach
+(read the template from disk on every call + one str.replace pass per variable)
+for the prompts built once per chunk: the four specialists, fed with the full
+general-analysis text, and the head coach aggregation.
+
+Usage: python3 bench_prompts.py [--sizes 2000,20000,200000] [--iterations 200]
+"""
+import argparse
+import statistics
+import time
+
+from prompts import loader
+from prompts.loader import (
+    SPECIALIST_ROLES,
+    generate_specialist_prompt,
+    generate_head_coach_aggregation_prompt,
+)
+
+ROLES = ["striking", "grappling", "submission", "movement"]
+
+def legacy_specialist_prompt(role: str, general_analysis_text: str) -> str:
+    """Versión anterior: lectura de disco + cinco str.replace secuenciales"""
+    role_data = SPECIALIST_ROLES[role]
+    prompt = loader.load_template("specialist_base_prompt")
+    replacements = {
+        "{role_name}": role_data["name"],
+        "{role_desc}": role_data["desc"],
+        "{role_emphasis}": role_data["emphasis"],
+        "{role_actions}": role_data["actions"],
+        "{general_analysis_text}": general_analysis_text
+    }
+    for placeholder, value in replacements.items():
+        prompt = prompt.replace(placeholder, value)
+    return prompt
+
+def legacy_head_coach_prompt(specialist_analyses: dict) -> str:
+    specialist_text = "\n\n".join([
+        f"**{role.upper()}:**\n{analysis}"
+        for role, analysis in specialist_analyses.items()
+    ])
+    return loader.load_template("head_coach_aggregation").replace("{specialist_text}", specialist_text)
+
+def make_analysis_text(size: int) -> str:
+    """Tabla tipo general_analyst de ~size caracteres"""
+    row = "| 00:12 | Peleador A | Jab al cuerpo | Conectado | Rompe distancia tras finta |\n"
+    return ("| Tiempo | Peleador | Acción | Resultado | Nota |\n" + row * (size // len(row) + 1))[:size]
+
+def time_per_call(fn, iterations: int) -> float:
+    """Mediana en microsegundos de `iterations` llamadas"""
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1e6)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="2000,20000,200000", help="general analysis sizes in characters")
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'case':<28}{'size':>10}{'legacy us':>12}{'compiled us':>13}{'speedup':>9}")
+    for size in (int(s) for s in args.sizes.split(",")):
+        analysis = make_analysis_text(size)
+        specialist_analyses = {role: analysis for role in ROLES}
+
+        # Same output in both paths before timing anything
+        for role in ROLES:
+            assert legacy_specialist_prompt(role, analysis) == generate_specialist_prompt(role, analysis)
+        assert legacy_head_coach_prompt(specialist_analyses) == generate_head_coach_aggregation_prompt(specialist_analyses)
+
+        cases = [
+            ("specialists (4 roles)",
+             lambda: [legacy_specialist_prompt(role, analysis) for role in ROLES],
+             lambda: [generate_specialist_prompt(role, analysis) for role in ROLES]),
+            ("head coach aggregation",
+             lambda: legacy_head_coach_prompt(specialist_analyses),
+             lambda: generate_head_coach_aggregation_prompt(specialist_analyses)),
+        ]
+        for label, legacy, compiled in cases:
+            legacy_us = time_per_call(legacy, args.iterations)
+            compiled_us = time_per_call(compiled, args.iterations)
+            print(f"{label:<28}{size:>10}{legacy_us:>12.1f}{compiled_us:>13.1f}{legacy_us / compiled_us:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -3,13 +3,27 @@ import os
 
 load_dotenv()
 # print(os.environ)
-from fastapi import FastAPI, UploadFile, File, BackgroundTasks, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request, Response, Query, Header
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 import uuid
-import shutil
-from services.video_service import video_service, JOBS, save_jobs
-from services.chat_service import call_agent as chat_agent
-from models.schemas import UploadResponse, SplitProgress, AnalysisProgress
+import json
+import hashlib
+import math
+import time
+from services.video_service import get_job_fields, get_chunk_analyses, probe_duration, cancel_job, TASK_ANALYZE_VIDEO, CHUNK_WINDOW_S
+from services.job_store import job_store
+from services.media_store import media_store, MediaSweeper
+from services.media_http import media_response, hls_playlist, fmp4_layout
+from services.thumbnails import sprite_geometry, sprite_path, still_path, highlight_second
+from services.work_queue import work_queue
+from services.work_queue import DEFAULT_TENANT
+from services import scheduler
+from worker import create_pool, API_WORKER_THREADS
+from services.chat_service import acall_agent as chat_agent, astream_agent
+from services.answer_cache import answer_cache, context_version
+from models.schemas import UploadResponse, SplitProgress, AnalysisProgress, JobProgress, ChunkAnalysisPage
 from typing import List, Optional, Dict, Any
 from pydantic import BaseModel
 
@@ -23,24 +37,55 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Jobs are processed by queue workers: a pool of API_WORKER_THREADS in this process
+# (0 for an API-only process), plus any `python worker.py` sharing the job store
+worker_pool = create_pool(API_WORKER_THREADS)
+# Media retention (TTLs, disk quota); see services/media_store.py
+media_sweeper = MediaSweeper(media_store)
+
+@app.on_event("startup")
+def _start_workers():
+    worker_pool.start()
+    media_sweeper.start()
+
+@app.on_event("shutdown")
+def _stop_workers():
+    worker_pool.shutdown()
+    media_sweeper.shutdown()
+
+def _etag_response(request: Request, payload: dict) -> Response:
+    """JSON response with a strong ETag; answers If-None-Match with 304"""
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if "*" in candidates or etag in candidates:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=payload, headers=headers)
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Video Analysis API"}
 
 @app.post("/upload", response_model=UploadResponse)
-async def upload_video(background_tasks: BackgroundTasks, file: UploadFile = File(...)):
+async def upload_video(file: UploadFile = File(...), x_tenant_id: str = Header(DEFAULT_TENANT),
+                       media_ttl_s: Optional[int] = Query(None, ge=0, description="How long the video is kept after the analysis")):
     if not file.filename.endswith(('.mp4', '.mov', '.webm')):
         raise HTTPException(status_code=400, detail="Invalid file format. Allowed: .mp4, .mov, .webm")
+
+    # Backpressure: refuse before reading the upload when the queue is saturated
+    retry_after = await run_in_threadpool(scheduler.admit, x_tenant_id)
+    if retry_after is not None:
+        raise HTTPException(status_code=429, detail="Too many videos waiting to be processed", headers={"Retry-After": str(retry_after)})
     
     job_id = str(uuid.uuid4())
-    file_path = os.path.join(video_service.uploads_dir, f"{job_id}_{file.filename}")
-    
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stored once per distinct video (content hash); the job holds a reference to it
+    media_digest, file_path = await run_in_threadpool(media_store.save_upload, file.file, file.filename, job_id, media_ttl_s)
         
     # Initialize job
-    JOBS[job_id] = {
-        "job_id": job_id,
+    await run_in_threadpool(job_store.create, job_id, {
         "split_status": "pending",
         "total_chunks": 0,
         "completed_chunks": 0,
@@ -49,30 +94,176 @@ async def upload_video(background_tasks: BackgroundTasks, file: UploadFile = Fil
         "analysis_status": "pending",
         "analyzed_chunks": 0,
         "analysis_pct": 0.0,
-        "chunk_analyses": []
-    }
-    save_jobs()
-    
-    background_tasks.add_task(video_service.split_video_background, job_id, file_path, file.filename)
+        "chunk_analyses": [],
+        "tenant_id": x_tenant_id,
+        "media_digest": media_digest,
+        "media_path": file_path
+    })
+
+    try:
+        duration = await run_in_threadpool(probe_duration, file_path)
+    except Exception:
+        duration = None
+    await run_in_threadpool(
+        work_queue.enqueue,
+        TASK_ANALYZE_VIDEO,
+        {"job_id": job_id, "video_path": file_path, "original_filename": file.filename, "media_digest": media_digest},
+        tenant=x_tenant_id, priority=scheduler.job_priority(duration)
+    )
     
     return UploadResponse(job_id=job_id, message="Video uploaded and processing started", status="processing")
 
+@app.delete("/jobs/{job_id}", status_code=202)
+def delete_job(job_id: str):
+    """Stop a job: queued work is dropped, running LLM work stops at the next step"""
+    cancelled = cancel_job(job_id)
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if cancelled is False:
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return {"job_id": job_id, "status": "cancelled"}
+
+@app.get("/queue/metrics")
+def get_queue_metrics():
+    """Queue depth per tenant, throughput, rejections (429) and worker pool usage"""
+    return scheduler.get_metrics(worker_pool)
+
+@app.get("/media/metrics")
+def get_media_metrics():
+    """Disk usage of uploads and chunks against the quota, and bytes reclaimed by retention"""
+    return media_store.stats()
+
+# Media files are content-addressed (named by the hash of the upload), so their URLs
+# can be cached forever; ETag/Last-Modified still let a client revalidate
+MEDIA_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+def _media_url(path: str) -> str:
+    return "/media/files/" + media_store.relative_path(path)
+
+def _serve_media(request: Request, path: str) -> Response:
+    # Playback starts at byte 0; seeks within the file don't write to the index
+    if request.headers.get("range", "bytes=0-").startswith("bytes=0-"):
+        media_store.touch(path)
+    try:
+        return media_response(request, path, cache_control=MEDIA_CACHE_CONTROL)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Media not found")
+
+@app.api_route("/media/files/{path:path}", methods=["GET", "HEAD"])
+def get_media_file(path: str, request: Request):
+    """An upload or chunk under media/, with Range (206) and conditional (304) requests"""
+    full_path = media_store.resolve(path)
+    if full_path is None:
+        raise HTTPException(status_code=404, detail="Media not found")
+    return _serve_media(request, full_path)
+
+@app.api_route("/jobs/{job_id}/video", methods=["GET", "HEAD"])
+def get_job_video(job_id: str, request: Request):
+    """The original upload of a job"""
+    job = get_job_fields(job_id, ["media_path"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if "media_path" not in job:
+        raise HTTPException(status_code=404, detail="No media for this job")
+    return _serve_media(request, job["media_path"])
+
+@app.get("/jobs/{job_id}/thumbnails")
+def get_job_thumbnails(job_id: str, request: Request):
+    """
+    Sprite sheet and highlight stills of each analyzed chunk. Image URLs never change
+    content (immutable caching); this index grows as chunks are analyzed.
+    """
+    job = get_job_fields(job_id, ["media_digest", "structured_segments"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if "media_digest" not in job:
+        raise HTTPException(status_code=404, detail="No media for this job")
+    digest = job["media_digest"]
+
+    def url(path):
+        return _media_url(path) if os.path.exists(path) else None
+
+    chunks = []
+    for segment in sorted(job.get("structured_segments", []), key=lambda s: s.get("segment_index", 0)):
+        index = segment.get("segment_index", 0)
+        stills = []
+        for highlight in segment.get("highlights") or []:
+            second = highlight_second(highlight.get("timestamp"))
+            still_url = url(still_path(digest, index, second)) if second is not None else None
+            if still_url:
+                stills.append({"timestamp": highlight.get("timestamp"), "url": still_url})
+        chunks.append({"chunk_index": index, "start_s": segment.get("start_s"), "sprite": url(sprite_path(digest, index)), "stills": stills})
+    return _etag_response(request, {"job_id": job_id, "sprite": sprite_geometry(CHUNK_WINDOW_S), "chunks": chunks})
+
+@app.get("/jobs/{job_id}/playlist.m3u8")
+def get_job_playlist(job_id: str, request: Request):
+    """
+    HLS playlist over the job's 30s chunks (fragmented MP4, each its own segment), so a
+    player fetches only the chunks around the playhead. Grows while the split runs.
+    """
+    job = get_job_fields(job_id, ["media_digest", "split_status", "completed_chunks", "chunk_durations_s"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if "media_digest" not in job:
+        raise HTTPException(status_code=404, detail="No media for this job")
+    complete = job.get("split_status") == "completed"
+    durations = job.get("chunk_durations_s") or []
+    segments = []
+    for i in range(job.get("completed_chunks", 0)):
+        path = media_store.chunk_path(job["media_digest"], i)
+        try:
+            layout = fmp4_layout(path) if i < len(durations) and media_store.has_chunk(job["media_digest"], i) else None
+        except FileNotFoundError:
+            layout = None
+        if layout is None:
+            # Evicted, or split before chunks were fragmented MP4 (not playable as HLS segments)
+            raise HTTPException(status_code=410, detail=f"Chunks are not available, play /jobs/{job_id}/video instead")
+        segments.append((_media_url(path), durations[i], *layout))
+    body = hls_playlist(segments, complete, min_target_duration_s=math.ceil(CHUNK_WINDOW_S))
+
+    etag = '"' + hashlib.sha256(body.encode("utf-8")).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag in [tag.strip().removeprefix("W/") for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/vnd.apple.mpegurl", headers=headers)
+
+# Job reads go to the job store (a SQLite or Redis round trip), so these endpoints
+# are sync: FastAPI runs them in its threadpool instead of on the event loop
 @app.get("/split/{job_id}", response_model=SplitProgress)
-async def get_split_progress(job_id: str):
-    if job_id not in JOBS:
+def get_split_progress(job_id: str, request: Request):
+    job = get_job_fields(job_id, SplitProgress.model_fields)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job = JOBS[job_id]
-    return SplitProgress(**job)
+    return _etag_response(request, SplitProgress(**job).model_dump(mode="json"))
 
 @app.get("/analysis/{job_id}", response_model=AnalysisProgress)
-async def get_analysis_progress(job_id: str):
-    if job_id not in JOBS:
+def get_analysis_progress(job_id: str):
+    job = job_store.get(job_id)
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
     
-    job = JOBS[job_id]
     return AnalysisProgress(**job)
 
+@app.get("/analysis/{job_id}/progress", response_model=JobProgress)
+def get_job_progress(job_id: str, request: Request):
+    """Counters and status only, cheap enough to poll"""
+    job = get_job_fields(job_id, JobProgress.model_fields)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return _etag_response(request, JobProgress(**job).model_dump(mode="json"))
+
+@app.get("/analysis/{job_id}/chunks", response_model=ChunkAnalysisPage)
+def get_chunk_analyses_page(job_id: str, request: Request, since_chunk: int = -1, limit: int = Query(20, ge=1, le=100)):
+    result = get_chunk_analyses(job_id, since_chunk=since_chunk, limit=limit)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    analyses, next_since_chunk = result
+    page = ChunkAnalysisPage(job_id=job_id, chunk_analyses=analyses, next_since_chunk=next_since_chunk)
+    return _etag_response(request, page.model_dump(mode="json"))
+
 class StructuredAnalysisResponse(BaseModel):
     job_id: str
     segments: List[Dict[str, Any]]
@@ -80,19 +271,102 @@ class StructuredAnalysisResponse(BaseModel):
     status: str
 
 @app.get("/analysis/{job_id}/structured", response_model=StructuredAnalysisResponse)
-async def get_structured_analysis(job_id: str):
-    if job_id not in JOBS:
+def get_structured_analysis(job_id: str):
+    job = get_job_fields(job_id, ["structured_segments", "tactical_summary", "analysis_status"])
+    if job is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    job = JOBS[job_id]
     segments = job.get("structured_segments", [])
     tactical = job.get("tactical_summary")
     status = job.get("analysis_status", "pending")
     return StructuredAnalysisResponse(job_id=job_id, segments=segments, tactical_summary=tactical, status=status)
 
+def _job_digest(job_id: str) -> str:
+    """Precomputed digest of the job, the default chat context (empty without job_id)"""
+    if not job_id:
+        return ""
+    job = get_job_fields(job_id, ["analysis_status", "context_digest"])
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if "context_digest" not in job and job.get("analysis_status") in ("completed", "partial", "failed"):
+        # Jobs analyzed before digests existed
+        from services.context_digest import build_context_digest
+        job = get_job_fields(job_id, ["structured_segments", "tactical_summary", "total_chunks", "analysis_status"])
+        job["context_digest"] = build_context_digest(
+            job.get("structured_segments", []), job.get("tactical_summary"), job.get("total_chunks"), job["analysis_status"]
+        )
+        job_store.update(job_id, context_digest=job["context_digest"])
+    return job.get("context_digest", "")
+
 @app.get("/agent/")
-async def call_agent(question: str):
-    response = chat_agent(question)
-    return {"response": response}
+async def call_agent(question: str, thread_id: str = "", job_id: str = ""):
+    # Same thread_id = same conversation (kept by the bounded checkpointer, see services/chat_memory.py)
+    context, version, cached = await run_in_threadpool(_cached_answer, question, thread_id, job_id)
+    if cached:
+        return {"response": cached["answer"], "cache": _cache_info(cached)}
+
+    start = time.perf_counter()
+    response = await chat_agent(question, context, thread_id=thread_id, job_id=job_id)
+    await run_in_threadpool(_store_answer, job_id, question, version, response, _elapsed_ms(start))
+    return {"response": response, "cache": _cache_info(None)}
+
+def _sse_response(events) -> StreamingResponse:
+    """Server-Sent Events: one `event: <type>` + JSON `data:` per agent event"""
+    async def body():
+        async for event in events:
+            yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/agent/stream")
+async def stream_agent(question: str, thread_id: str = "", job_id: str = ""):
+    context, version, cached = await run_in_threadpool(_cached_answer, question, thread_id, job_id)
+
+    async def events():
+        if cached:
+            yield {"type": "cache", **_cache_info(cached)}
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "done", "response": cached["answer"]}
+            return
+        start = time.perf_counter()
+        async for event in astream_agent(question, context, thread_id=thread_id, job_id=job_id):
+            if event["type"] == "done":
+                await run_in_threadpool(_store_answer, job_id, question, version, event["response"], _elapsed_ms(start))
+            yield event
+    return _sse_response(events())
+
+@app.get("/agent/cache/{job_id}")
+def get_answer_cache_stats(job_id: str):
+    """Hit rate and latency saved by the answer cache of a job"""
+    if not job_store.exists(job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return answer_cache.get_stats(job_id)
+
+def _answer_cache_version(job_id: str, thread_id: str, context: str):
+    # Only stateless questions over a finished job's digest are cached: a conversation
+    # depends on its history, and the digest of a running job keeps changing
+    if not job_id or thread_id or not context:
+        return None
+    if get_job_fields(job_id, ["analysis_status"]).get("analysis_status") not in ("completed", "partial", "failed"):
+        return None
+    return context_version(context)
+
+def _cached_answer(question: str, thread_id: str, job_id: str):
+    """(context, cache version, cached answer or None) of a question; reads the job store, so run it off the event loop"""
+    context = _job_digest(job_id)
+    version = _answer_cache_version(job_id, thread_id, context)
+    cached = answer_cache.lookup(job_id, question, version) if version else None
+    return context, version, cached
+
+def _elapsed_ms(start: float) -> int:
+    return int((time.perf_counter() - start) * 1000)
+
+def _store_answer(job_id: str, question: str, version, answer: str, latency_ms: int):
+    if version and answer:
+        answer_cache.store(job_id, question, version, answer, latency_ms)
+
+def _cache_info(cached) -> dict:
+    if not cached:
+        return {"hit": False}
+    return {"hit": True, "similarity": cached["similarity"], "latency_saved_ms": cached["latency_ms"]}
 
 if __name__ == "__main__":
     import uvicorn
@@ -29,12 +29,29 @@ class ChunkAnalysis(BaseModel):
 class AnalysisProgress(BaseModel):
     job_id: str
     split_status: str
-    analysis_status: str  # "pending", "processing", "completed", "partial", "failed"
+    analysis_status: str  # "pending", "processing", "completed", "partial", "failed", "cancelled"
     total_chunks: int
     analyzed_chunks: int
     analysis_pct: float
     chunk_analyses: List[ChunkAnalysis] = []
 
+class JobProgress(BaseModel):
+    """Contadores y estados del job, sin textos de análisis (polling liviano)"""
+    job_id: str
+    split_status: str
+    analysis_status: str
+    total_chunks: int
+    completed_chunks: int
+    analyzed_chunks: int
+    split_pct: float
+    analysis_pct: float
+
+class ChunkAnalysisPage(BaseModel):
+    """Página de análisis por chunk con chunk_index > since_chunk"""
+    job_id: str
+    chunk_analyses: List[ChunkAnalysis] = []
+    next_since_chunk: Optional[int] = None  # None cuando no quedan más resultados
+
 # Coach Response - To be Used Later
 
 class Disciplina(str, Enum):
@@ -1,11 +1,112 @@
 import os
+import re
 from pathlib import Path
-from typing import Dict
+from typing import Dict, Iterable, List, Tuple
 
 def _get_templates_dir() -> Path:
     """Obtiene la ruta del directorio de templates"""
     return Path(__file__).parent / "templates"
 
+class CompiledTemplate:
+    """
+    Template parseado una sola vez en segmentos: literals[0] field[0] literals[1] ... field[n-1] literals[n].
+    render() arma el prompt en una sola pasada ("".join) en vez de un str.replace por variable.
+    """
+    __slots__ = ("literals", "fields")
+
+    def __init__(self, literals: List[str], fields: List[str]):
+        self.literals = literals
+        self.fields = fields
+
+    @classmethod
+    def compile(cls, text: str, fields: Iterable[str]) -> "CompiledTemplate":
+        """Solo los placeholders de `fields` son variables; cualquier otra llave queda literal"""
+        fields = sorted(set(fields))
+        if not fields:
+            return cls([text], [])
+        pattern = re.compile("|".join(re.escape("{" + field + "}") for field in fields))
+        literals, names, pos = [], [], 0
+        for match in pattern.finditer(text):
+            literals.append(text[pos:match.start()])
+            names.append(match.group(0)[1:-1])
+            pos = match.end()
+        literals.append(text[pos:])
+        return cls(literals, names)
+
+    def bind(self, **values: str) -> "CompiledTemplate":
+        """Fija algunas variables y devuelve un template con menos segmentos"""
+        literals, names = [self.literals[0]], []
+        for field, literal in zip(self.fields, self.literals[1:]):
+            if field in values:
+                literals[-1] += values[field] + literal
+            else:
+                names.append(field)
+                literals.append(literal)
+        return CompiledTemplate(literals, names)
+
+    def render(self, **values: str) -> str:
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            parts.append(values[field])
+            parts.append(literal)
+        return "".join(parts)
+
+# Variables que acepta cada template
+TEMPLATE_FIELDS = {
+    "general_analyst": (),
+    "specialist_base_prompt": ("role_name", "role_desc", "role_emphasis", "role_actions", "general_analysis_text"),
+    "head_coach_aggregation": ("specialist_text",),
+}
+
+SPECIALIST_ROLES = {
+    "striking": {
+        "name": "Striking Offense/Defense Analyst",
+        "desc": "Análisis enfocado en el intercambio de golpes de pie (Boxeo y Muay Thai).",
+        "emphasis": "**posicionamiento** (footwork, ángulo de ataque) y la **conexión efectiva** de golpes.",
+        "actions": "Jab/Cross Conectado, Patada (al cuerpo, pierna, cabeza), Knockdown, KO/TKO, Esquive Exitoso, Uso de Finta."
+    },
+    "grappling": {
+        "name": "Grappling Analyst",
+        "desc": "Análisis enfocado en el clinch, controles contra la jaula, derribos y trabajo de piso.",
+        "emphasis": "**control posicional**, **pases de guardia**, **derribos**, y **defensa de derribo**.",
+        "actions": "Takedown efectivo, Defensa de takedown, Control en clinch, Pase de guardia, Ground and pound."
+    },
+    "submission": {
+        "name": "Submission Specialist",
+        "desc": "Análisis enfocado en intentos de sumisión, transiciones y defensa.",
+        "emphasis": "**intentos de sumisión**, **transiciones entre posiciones**, **escapes**.",
+        "actions": "Intento de estrangulación, Intento de palanca, Escape de sumisión, Defensa de sumisión."
+    },
+    "movement": {
+        "name": "Movement Specialist",
+        "desc": "Análisis enfocado en footwork, posicionamiento, manejo de distancia y ángulos.",
+        "emphasis": "**footwork**, **posicionamiento**, **manejo de distancia**, **cambios de ángulo**.",
+        "actions": "Cierre de distancia, Ajuste de ángulo, Footwork defensivo, Manejo de espacio, Cambio de guardia."
+    }
+}
+
+# name -> (mtime_ns, CompiledTemplate). El mtime se revisa en cada uso para
+# recargar los templates editados durante desarrollo sin reiniciar el servidor.
+_compiled_cache: Dict[str, Tuple[int, CompiledTemplate]] = {}
+# role -> (CompiledTemplate base, CompiledTemplate con las variables del rol fijadas)
+_specialist_cache: Dict[str, Tuple[CompiledTemplate, CompiledTemplate]] = {}
+
+def get_compiled_template(template_name: str) -> CompiledTemplate:
+    """Devuelve el template compilado, recompilándolo solo si el archivo cambió"""
+    template_path = _get_templates_dir() / f"{template_name}.txt"
+    try:
+        mtime_ns = template_path.stat().st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Template not found: {template_path}") from None
+    cached = _compiled_cache.get(template_name)
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+    compiled = CompiledTemplate.compile(
+        template_path.read_text(encoding="utf-8"), TEMPLATE_FIELDS.get(template_name, ())
+    )
+    _compiled_cache[template_name] = (mtime_ns, compiled)
+    return compiled
+
 def load_template(template_name: str) -> str:
     """Carga un template desde archivo"""
     template_path = _get_templates_dir() / f"{template_name}.txt"
@@ -15,7 +116,23 @@ def load_template(template_name: str) -> str:
 
 def generate_general_analyst_prompt() -> str:
     """Genera el prompt del analista general"""
-    return load_template("general_analyst")
+    return get_compiled_template("general_analyst").render()
+
+def _specialist_template(role_key: str) -> CompiledTemplate:
+    """Template del especialista con las variables del rol ya fijadas; solo falta general_analysis_text"""
+    base = get_compiled_template("specialist_base_prompt")
+    cached = _specialist_cache.get(role_key)
+    if cached is not None and cached[0] is base:
+        return cached[1]
+    role_data = SPECIALIST_ROLES[role_key]
+    bound = base.bind(
+        role_name=role_data["name"],
+        role_desc=role_data["desc"],
+        role_emphasis=role_data["emphasis"],
+        role_actions=role_data["actions"],
+    )
+    _specialist_cache[role_key] = (base, bound)
+    return bound
 
 def generate_specialist_prompt(role: str, general_analysis_text: str) -> str:
     """
@@ -28,57 +145,11 @@ def generate_specialist_prompt(role: str, general_analysis_text: str) -> str:
     Returns:
         El prompt completo con todas las variables reemplazadas
     """
-    roles = {
-        "striking": {
-            "name": "Striking Offense/Defense Analyst",
-            "desc": "Análisis enfocado en el intercambio de golpes de pie (Boxeo y Muay Thai).",
-            "emphasis": "**posicionamiento** (footwork, ángulo de ataque) y la **conexión efectiva** de golpes.",
-            "actions": "Jab/Cross Conectado, Patada (al cuerpo, pierna, cabeza), Knockdown, KO/TKO, Esquive Exitoso, Uso de Finta."
-        },
-        "grappling": {
-            "name": "Grappling Analyst",
-            "desc": "Análisis enfocado en el clinch, controles contra la jaula, derribos y trabajo de piso.",
-            "emphasis": "**control posicional**, **pases de guardia**, **derribos**, y **defensa de derribo**.",
-            "actions": "Takedown efectivo, Defensa de takedown, Control en clinch, Pase de guardia, Ground and pound."
-        },
-        "submission": {
-            "name": "Submission Specialist",
-            "desc": "Análisis enfocado en intentos de sumisión, transiciones y defensa.",
-            "emphasis": "**intentos de sumisión**, **transiciones entre posiciones**, **escapes**.",
-            "actions": "Intento de estrangulación, Intento de palanca, Escape de sumisión, Defensa de sumisión."
-        },
-        "movement": {
-            "name": "Movement Specialist",
-            "desc": "Análisis enfocado en footwork, posicionamiento, manejo de distancia y ángulos.",
-            "emphasis": "**footwork**, **posicionamiento**, **manejo de distancia**, **cambios de ángulo**.",
-            "actions": "Cierre de distancia, Ajuste de ángulo, Footwork defensivo, Manejo de espacio, Cambio de guardia."
-        }
-    }
-    
     role_key = role.lower()
-    if role_key not in roles:
-        raise ValueError(f"Rol '{role}' no soportado. Opciones: {list(roles.keys())}")
-    
-    # Cargar el template base
-    template = load_template("specialist_base_prompt")
-    
-    # Obtener datos del rol
-    role_data = roles[role_key]
+    if role_key not in SPECIALIST_ROLES:
+        raise ValueError(f"Rol '{role}' no soportado. Opciones: {list(SPECIALIST_ROLES.keys())}")
     
-    # Reemplazar todas las variables
-    replacements = {
-        "{role_name}": role_data["name"],
-        "{role_desc}": role_data["desc"],
-        "{role_emphasis}": role_data["emphasis"],
-        "{role_actions}": role_data["actions"],
-        "{general_analysis_text}": general_analysis_text
-    }
-    
-    prompt = template
-    for placeholder, value in replacements.items():
-        prompt = prompt.replace(placeholder, value)
-    
-    return prompt
+    return _specialist_template(role_key).render(general_analysis_text=general_analysis_text)
 
 def generate_head_coach_aggregation_prompt(specialist_analyses: Dict[str, str]) -> str:
     """
@@ -97,10 +168,4 @@ def generate_head_coach_aggregation_prompt(specialist_analyses: Dict[str, str])
         for role, analysis in specialist_analyses.items()
     ])
     
-    # Cargar el template
-    template = load_template("head_coach_aggregation")
-    
-    # Reemplazar la variable
-    prompt = template.replace("{specialist_text}", specialist_text)
-    
-    return prompt
\ No newline at end of file
+    return get_compiled_template("head_coach_aggregation").render(specialist_text=specialist_text)
\ No newline at end of file
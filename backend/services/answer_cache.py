@@ -0,0 +1,147 @@
+import hashlib
+import os
+import re
+import time
+import unicodedata
+import logging
+from services.job_store import job_store
+
+logger = logging.getLogger(__name__)
+
+# Per-job cache of agent answers (same matching as backend_aws/shared/answer_cache.py).
+# Questions are normalized (case, accents, punctuation, filler words) and
+# fingerprinted (word order included) for exact hits; near-duplicates match by
+# character-trigram Jaccard similarity, but only when their numbers and single-letter
+# names are the same and their shared words keep the same order ("round 1" is not
+# "round 2", "did A submit B" is not "did B submit A"). An entry is only valid for the
+# context version it was answered with, and invalidate(job_id) drops a job's answers
+# when its analysis changes.
+# Answers and hit/miss counters are fields of the job in the job store (like the
+# DynamoDB job items of backend_aws), so every API process shares them.
+
+ANSWER_CACHE_TTL_S = int(os.getenv("ANSWER_CACHE_TTL_S", str(24 * 3600)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+# Answers kept per job; the oldest are dropped first
+ANSWER_CACHE_MAX_PER_JOB = int(os.getenv("ANSWER_CACHE_MAX_PER_JOB", "200"))
+
+FILLER_WORDS = {
+    # es
+    "el", "la", "los", "las", "un", "una", "de", "del", "en", "que", "me", "por", "favor", "puedes",
+    "podrias", "dime", "cual", "cuales", "fue", "fueron", "es", "son", "hay", "al", "lo", "se", "su", "sus",
+    # en
+    "the", "an", "of", "in", "and", "please", "can", "could", "you", "tell", "me", "what", "which",
+    "was", "were", "is", "are", "there", "to", "his", "her", "their",
+}
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = [w for w in re.findall(r"[a-z0-9]+", text) if w not in FILLER_WORDS]
+    return " ".join(words)
+
+def question_fingerprint(normalized: str) -> str:
+    # Word order matters: "did a submit b" is not "did b submit a"
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+def context_version(context: str) -> str:
+    return hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+
+def _trigrams(normalized: str) -> set:
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the character trigrams of two normalized questions"""
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0.0
+
+def key_tokens(normalized: str) -> list:
+    """Numbers and single letters (round 2, fighter B), in order: they must match exactly"""
+    return [w for w in normalized.split() if w.isdigit() or len(w) == 1]
+
+def same_order(a: str, b: str) -> bool:
+    """Whether the words two questions share appear in the same order in both (names not swapped)"""
+    words_a, words_b = a.split(), b.split()
+    shared = set(words_a) & set(words_b)
+    return [w for w in words_a if w in shared] == [w for w in words_b if w in shared]
+
+def best_match(normalized: str, entries: list, threshold: float = ANSWER_CACHE_SIMILARITY):
+    """(entry, score) of the most similar cached question at or above the threshold, else (None, 0)"""
+    fingerprint = question_fingerprint(normalized)
+    keys = key_tokens(normalized)
+    best, best_score = None, 0.0
+    for entry in entries:
+        if entry["fingerprint"] == fingerprint:
+            score = 1.0
+        elif key_tokens(entry["question"]) != keys or not same_order(normalized, entry["question"]):
+            continue
+        else:
+            score = similarity(normalized, entry["question"])
+        if score > best_score:
+            best, best_score = entry, score
+    return (best, best_score) if best_score >= threshold else (None, 0.0)
+
+class AnswerCache:
+    # Job fields: {fingerprint: entry} (oldest first) and the counters
+    ENTRIES_FIELD = "answer_cache"
+    COUNTER_FIELDS = ("answer_cache_hits", "answer_cache_misses", "answer_cache_saved_ms")
+
+    def __init__(self, store, ttl_s: int = ANSWER_CACHE_TTL_S, max_per_job: int = ANSWER_CACHE_MAX_PER_JOB):
+        self.jobs = store
+        self.ttl_s = ttl_s
+        self.max_per_job = max_per_job
+
+    def _entries(self, job_id: str) -> dict:
+        return (self.jobs.get_fields(job_id, [self.ENTRIES_FIELD]) or {}).get(self.ENTRIES_FIELD, {})
+
+    def lookup(self, job_id: str, question: str, version: str):
+        """Cached answer entry for a question (exact or near-duplicate), or None. Counts the hit/miss."""
+        now = time.time()
+        entries = [e for e in self._entries(job_id).values() if e["expires_at"] > now and e["version"] == version]
+        entry, score = best_match(normalize_question(question), entries)
+        if entry is None:
+            self.jobs.increment(job_id, answer_cache_misses=1)
+            return None
+        self.jobs.increment(job_id, answer_cache_hits=1, answer_cache_saved_ms=entry["latency_ms"])
+        logger.info(f"Answer cache hit for job {job_id} (similarity {score:.2f}): '{question}' ~ '{entry['question']}'")
+        return {**entry, "similarity": round(score, 3)}
+
+    def store(self, job_id: str, question: str, version: str, answer: str, latency_ms: int):
+        normalized = normalize_question(question)
+        if not normalized:
+            return
+        fingerprint = question_fingerprint(normalized)
+        now = time.time()
+        # Read-modify-write: two answers stored at the same moment may keep only one,
+        # which costs a cache miss later, never a wrong answer
+        entries = {f: e for f, e in self._entries(job_id).items() if e["expires_at"] > now and e["version"] == version}
+        entries.pop(fingerprint, None)
+        entries[fingerprint] = {
+            "fingerprint": fingerprint,
+            "question": normalized,
+            "answer": answer,
+            "version": version,
+            "latency_ms": int(latency_ms),
+            "expires_at": now + self.ttl_s,
+        }
+        while len(entries) > self.max_per_job:
+            del entries[next(iter(entries))]
+        self.jobs.update(job_id, **{self.ENTRIES_FIELD: entries})
+
+    def invalidate(self, job_id: str):
+        self.jobs.update(job_id, **{self.ENTRIES_FIELD: {}})
+
+    def get_stats(self, job_id: str) -> dict:
+        fields = self.jobs.get_fields(job_id, [*self.COUNTER_FIELDS, self.ENTRIES_FIELD]) or {}
+        hits, misses, saved_ms = (fields.get(field, 0) for field in self.COUNTER_FIELDS)
+        total = hits + misses
+        return {
+            "job_id": job_id,
+            "hits": hits,
+            "misses": misses,
+            "latency_saved_ms": saved_ms,
+            "hit_rate": round(hits / total, 3) if total else 0.0,
+            "cached_answers": len(fields.get(self.ENTRIES_FIELD, {})),
+        }
+
+answer_cache = AnswerCache(job_store)
@@ -0,0 +1,307 @@
+import os
+import re
+import sqlite3
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+
+from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage, SystemMessage
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, ChannelVersions, Checkpoint, CheckpointMetadata, CheckpointTuple
+from langgraph.checkpoint.memory import InMemorySaver
+from langgraph.graph.message import REMOVE_ALL_MESSAGES
+
+logger = logging.getLogger(__name__)
+
+CHAT_MEMORY_DB = os.getenv("CHAT_MEMORY_DB", "chat_memory.sqlite")
+# Threads kept in memory; the least recently used ones are spilled to SQLite
+CHAT_MAX_HOT_THREADS = int(os.getenv("CHAT_MAX_HOT_THREADS", "200"))
+# Threads not used for this long are deleted (memory and SQLite)
+CHAT_THREAD_TTL_S = int(os.getenv("CHAT_THREAD_TTL_S", str(7 * 24 * 3600)))
+# Every step of a run stores a checkpoint; past this many per thread only the latest is kept
+CHAT_MAX_CHECKPOINTS_PER_THREAD = int(os.getenv("CHAT_MAX_CHECKPOINTS_PER_THREAD", "50"))
+# Non-system messages kept in the thread state; older turns are folded into a summary
+CHAT_MAX_HISTORY_MESSAGES = int(os.getenv("CHAT_MAX_HISTORY_MESSAGES", "20"))
+CHAT_SUMMARY_MAX_LINES = 20
+SWEEP_INTERVAL_S = 300
+
+HISTORY_SUMMARY_ID = "history-summary"
+
+
+class BoundedCheckpointer(BaseCheckpointSaver):
+    """
+    LangGraph checkpointer with bounded memory:
+    - at most max_hot_threads threads live in an InMemorySaver (LRU order);
+    - evicted threads are spilled to SQLite (latest checkpoint only) and promoted back on access,
+      so conversations also survive a restart;
+    - threads idle for more than ttl_s are deleted;
+    - a thread keeps at most max_checkpoints checkpoints in memory.
+    """
+
+    def __init__(
+        self,
+        db_path: str = CHAT_MEMORY_DB,
+        max_hot_threads: int = CHAT_MAX_HOT_THREADS,
+        ttl_s: int = CHAT_THREAD_TTL_S,
+        max_checkpoints: int = CHAT_MAX_CHECKPOINTS_PER_THREAD,
+    ):
+        super().__init__()
+        self.hot = InMemorySaver(serde=self.serde)
+        self.max_hot_threads = max_hot_threads
+        self.ttl_s = ttl_s
+        self.max_checkpoints = max_checkpoints
+        # thread_id -> [last_access, checkpoints stored since the last compaction]
+        self._threads = OrderedDict()
+        self._lock = threading.RLock()
+        self._last_sweep = time.time()
+        self._db = sqlite3.connect(db_path, check_same_thread=False)
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS spilled_checkpoints (
+                thread_id TEXT NOT NULL,
+                checkpoint_ns TEXT NOT NULL,
+                last_access REAL NOT NULL,
+                parent_checkpoint_id TEXT,
+                checkpoint_type TEXT, checkpoint BLOB,
+                metadata_type TEXT, metadata BLOB,
+                writes_type TEXT, writes BLOB,
+                PRIMARY KEY (thread_id, checkpoint_ns)
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS spilled_last_access ON spilled_checkpoints (last_access)")
+        self._db.commit()
+
+    # -- thread bookkeeping -------------------------------------------------
+
+    def _touch(self, thread_id: str):
+        """Mark the thread as used, promoting it from SQLite and evicting the LRU thread if needed"""
+        now = time.time()
+        entry = self._threads.get(thread_id)
+        if entry is not None:
+            entry[0] = now
+            self._threads.move_to_end(thread_id)
+            return
+        self._threads[thread_id] = [now, 0]
+        self._promote(thread_id)
+        while len(self._threads) > self.max_hot_threads:
+            oldest = next(iter(self._threads))
+            self._spill(oldest)
+
+    def _snapshot(self, thread_id: str) -> list:
+        """Latest checkpoint (+ pending writes) of each namespace of the thread"""
+        latest = {}
+        for saved in self.hot.list({"configurable": {"thread_id": thread_id}}):
+            latest.setdefault(saved.config["configurable"]["checkpoint_ns"], saved)
+        return list(latest.values())
+
+    def _restore(self, thread_id: str, saved: CheckpointTuple):
+        checkpoint_ns = saved.config["configurable"]["checkpoint_ns"]
+        parent_id = saved.parent_config["configurable"]["checkpoint_id"] if saved.parent_config else None
+        config = self.hot.put(
+            {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}},
+            saved.checkpoint,
+            saved.metadata,
+            saved.checkpoint["channel_versions"],
+        )
+        writes_by_task = {}
+        for task_id, channel, value in saved.pending_writes or []:
+            writes_by_task.setdefault(task_id, []).append((channel, value))
+        for task_id, writes in writes_by_task.items():
+            self.hot.put_writes(config, writes, task_id)
+
+    def _spill(self, thread_id: str):
+        last_access, _ = self._threads.pop(thread_id)
+        rows = []
+        for saved in self._snapshot(thread_id):
+            parent_id = saved.parent_config["configurable"]["checkpoint_id"] if saved.parent_config else None
+            rows.append((
+                thread_id, saved.config["configurable"]["checkpoint_ns"], last_access, parent_id,
+                *self.serde.dumps_typed(saved.checkpoint),
+                *self.serde.dumps_typed(saved.metadata),
+                *self.serde.dumps_typed(list(saved.pending_writes or [])),
+            ))
+        self._db.executemany("INSERT OR REPLACE INTO spilled_checkpoints VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self._db.commit()
+        self.hot.delete_thread(thread_id)
+
+    def _promote(self, thread_id: str):
+        rows = self._db.execute(
+            "SELECT checkpoint_ns, last_access, parent_checkpoint_id, checkpoint_type, checkpoint, "
+            "metadata_type, metadata, writes_type, writes FROM spilled_checkpoints WHERE thread_id = ?",
+            (thread_id,)
+        ).fetchall()
+        if not rows:
+            return
+        self._db.execute("DELETE FROM spilled_checkpoints WHERE thread_id = ?", (thread_id,))
+        self._db.commit()
+        if rows[0][1] < time.time() - self.ttl_s:
+            return
+        for checkpoint_ns, _, parent_id, c_type, c_blob, m_type, m_blob, w_type, w_blob in rows:
+            checkpoint = self.serde.loads_typed((c_type, c_blob))
+            config = {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": checkpoint["id"]}}
+            parent_config = (
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns, "checkpoint_id": parent_id}}
+                if parent_id else None
+            )
+            self._restore(thread_id, CheckpointTuple(
+                config, checkpoint, self.serde.loads_typed((m_type, m_blob)), parent_config,
+                [tuple(write) for write in self.serde.loads_typed((w_type, w_blob))]
+            ))
+
+    def _after_put(self, thread_id: str):
+        entry = self._threads[thread_id]
+        entry[1] += 1
+        if entry[1] > self.max_checkpoints:
+            # Compact: keep only the latest checkpoint of the thread
+            snapshot = self._snapshot(thread_id)
+            self.hot.delete_thread(thread_id)
+            for saved in snapshot:
+                self._restore(thread_id, saved)
+            entry[1] = len(snapshot)
+        if time.time() - self._last_sweep >= SWEEP_INTERVAL_S:
+            self._sweep()
+
+    def _sweep(self):
+        """Delete threads idle for longer than the TTL"""
+        self._last_sweep = time.time()
+        cutoff = self._last_sweep - self.ttl_s
+        expired = [thread_id for thread_id, (last_access, _) in self._threads.items() if last_access < cutoff]
+        for thread_id in expired:
+            self._threads.pop(thread_id)
+            self.hot.delete_thread(thread_id)
+        deleted = self._db.execute("DELETE FROM spilled_checkpoints WHERE last_access < ?", (cutoff,)).rowcount
+        self._db.commit()
+        if expired or deleted:
+            logger.info(f"Chat memory sweep: {len(expired)} in-memory and {deleted} spilled checkpoints expired")
+
+    def stats(self) -> dict:
+        with self._lock:
+            spilled = self._db.execute("SELECT COUNT(DISTINCT thread_id) FROM spilled_checkpoints").fetchone()[0]
+            return {"hot_threads": len(self._threads), "spilled_threads": spilled}
+
+    # -- BaseCheckpointSaver ------------------------------------------------
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            return self.hot.get_tuple(config)
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        # Without a config only the in-memory threads are listed
+        with self._lock:
+            if config:
+                self._touch(config["configurable"]["thread_id"])
+            saved = list(self.hot.list(config, filter=filter, before=before, limit=limit))
+        yield from saved
+
+    def put(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        with self._lock:
+            self._touch(thread_id)
+            saved_config = self.hot.put(config, checkpoint, metadata, new_versions)
+            self._after_put(thread_id)
+            return saved_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        with self._lock:
+            self._touch(config["configurable"]["thread_id"])
+            self.hot.put_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        with self._lock:
+            self._threads.pop(thread_id, None)
+            self.hot.delete_thread(thread_id)
+            self._db.execute("DELETE FROM spilled_checkpoints WHERE thread_id = ?", (thread_id,))
+            self._db.commit()
+
+    def get_next_version(self, current, channel):
+        return self.hot.get_next_version(current, channel)
+
+    # Same as InMemorySaver: the async API runs the sync methods (all local, no network I/O)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.get_tuple(config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        for item in self.list(config, filter=filter, before=before, limit=limit):
+            yield item
+
+    async def aput(
+        self,
+        config: RunnableConfig,
+        checkpoint: Checkpoint,
+        metadata: CheckpointMetadata,
+        new_versions: ChannelVersions,
+    ) -> RunnableConfig:
+        return self.put(config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        return self.put_writes(config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        return self.delete_thread(thread_id)
+
+
+# -----------------------------------------------------------------------------
+# Message history truncation (pre_model_hook of the react agent)
+# -----------------------------------------------------------------------------
+
+def _summary_line(message) -> Optional[str]:
+    content = message.content if isinstance(message.content, str) else ""
+    if isinstance(message, HumanMessage):
+        # Only the question, not the whole video context of the prompt template
+        match = re.search(r"<user_query>(.*?)</user_query>", content, flags=re.DOTALL)
+        text, who = (match.group(1) if match else content), "Usuario"
+    elif isinstance(message, AIMessage) and not message.tool_calls:
+        text, who = re.sub(r"<thinking>.*?</thinking>", "", content, flags=re.DOTALL), "Agente"
+    else:
+        return None
+    text = " ".join(text.split())
+    return f"- {who}: {text[:200]}" if text else None
+
+
+def trim_history(state: dict) -> dict:
+    """
+    Keep the latest system prompt and the last CHAT_MAX_HISTORY_MESSAGES messages
+    (cut at a user turn, so tool calls stay with their results); older turns are
+    folded into a short summary message. Rewrites the stored state so threads don't grow.
+    """
+    messages = state["messages"]
+    system = [m for m in messages if isinstance(m, SystemMessage) and m.id != HISTORY_SUMMARY_ID]
+    summary = next((m for m in messages if m.id == HISTORY_SUMMARY_ID), None)
+    rest = [m for m in messages if not isinstance(m, SystemMessage)]
+    if len(rest) <= CHAT_MAX_HISTORY_MESSAGES and len(system) <= 1:
+        return {"llm_input_messages": messages}
+
+    human_turns = [i for i, m in enumerate(rest) if isinstance(m, HumanMessage)]
+    start = next((i for i in human_turns if len(rest) - i <= CHAT_MAX_HISTORY_MESSAGES), human_turns[-1] if human_turns else 0)
+    dropped, kept = rest[:start], rest[start:]
+
+    lines = summary.content.splitlines()[1:] if summary else []
+    lines += [line for line in map(_summary_line, dropped) if line]
+    new_messages = system[-1:]
+    if lines:
+        lines = lines[-CHAT_SUMMARY_MAX_LINES:]
+        new_messages.append(SystemMessage(content="Conversación anterior (resumen):\n" + "\n".join(lines), id=HISTORY_SUMMARY_ID))
+    return {"messages": [RemoveMessage(id=REMOVE_ALL_MESSAGES), *new_messages, *kept]}
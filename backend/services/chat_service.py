@@ -1,6 +1,7 @@
 from langchain.chat_models import init_chat_model
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
@@ -8,15 +9,19 @@ from langchain_core.messages import (
     message_to_dict, messages_to_dict, messages_from_dict
 )
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import create_react_agent
 from dotenv import load_dotenv
 from langgraph.checkpoint.memory import InMemorySaver, MemorySaver
+from services.chat_memory import BoundedCheckpointer, trim_history
 from langgraph.store.memory import InMemoryStore
 from langchain_core.prompts import ChatPromptTemplate
 from datetime import datetime
 import os, uuid, re
 from pathlib import Path
+import hashlib
 import random
+import threading
 
 load_dotenv()
 
@@ -53,33 +58,34 @@ llm_light = init_chat_model(
 # Specialists exploration
 # -----------------------------------------------------------------------------
 
+PROMPTS_FOLDER = Path(__file__).parent.parent / "prompts"
+SPECIALIST_EXTENSIONS = (".txt", ".md")
+
+# In-memory specialist catalog, see get_specialist_catalog()
+_catalog_lock = threading.Lock()
+_specialist_catalog = None
+
 @tool
 def get_availables_specialists() -> str:
     """List all the available specialists for video analysis."""
-    prompts_folder = Path(__file__).parent.parent / "prompts"
-    
-    if not prompts_folder.exists():
+    if not PROMPTS_FOLDER.exists():
         return "No specialists available. Prompts folder not found."
     
-    specialists = []
-    for file_path in prompts_folder.rglob("*.[tm][xd]*"):
-        specialists.append(file_path.stem)
-    
+    specialists = get_specialist_catalog()
     if not specialists:
         return "No specialist prompts found in the prompts folder."
     
-    return f"Available specialists: {', '.join(sorted(set(specialists)))}"
+    return f"Available specialists: {', '.join(sorted(specialists))}"
 
 
 @tool
 def explain_specialist_analysis(specialist_name: str, video_context: str) -> str:
     """Explain the analysis made by the specialist based on the video context."""
-    specialist_file = _find_specialist_file(specialist_name)
-    if not specialist_file:
+    specialist = get_specialist_catalog().get(specialist_name)
+    if not specialist:
         return f"Specialist '{specialist_name}' not found."
     
-    with open(specialist_file, 'r', encoding='utf-8') as f:
-        specialist_prompt = f.read()
+    specialist_prompt = specialist["content"]
     
     explanation_prompt = f"""Based on this specialist prompt:
 {specialist_prompt}
@@ -96,12 +102,11 @@ Explain what kind of analysis this specialist would provide and what insights th
 @tool
 def consult_specialist(specialist_name: str, question: str, video_context: str) -> str:
     """Consult the specialist with the question provided."""
-    specialist_file = _find_specialist_file(specialist_name)
-    if not specialist_file:
+    specialist = get_specialist_catalog().get(specialist_name)
+    if not specialist:
         return f"Specialist '{specialist_name}' not found."
     
-    with open(specialist_file, 'r', encoding='utf-8') as f:
-        specialist_prompt = f.read()
+    specialist_prompt = specialist["content"]
     
     full_prompt = f"""{specialist_prompt}
 
@@ -114,6 +119,27 @@ Provide a detailed analysis based on your expertise."""
     return response.content
 
 
+# -----------------------------------------------------------------------------
+# Drill-down into the current video (job_id comes from the run config)
+# -----------------------------------------------------------------------------
+
+@tool
+def get_chunk_analysis(chunk_index: int, config: RunnableConfig) -> str:
+    """Get the full analysis (every specialist) of one chunk of the current video, by chunk index."""
+    job_id = config.get("configurable", {}).get("job_id")
+    if not job_id:
+        return "No video is selected in this conversation."
+    from services.job_store import job_store
+    chunk = next((c for c in job_store.get_list(job_id, "chunk_analyses") if c["chunk_index"] == chunk_index), None)
+    if chunk is None:
+        return f"Chunk {chunk_index} not found."
+    if chunk.get("status") != "completed":
+        return f"Chunk {chunk_index} has no analysis ({chunk.get('status')}: {chunk.get('error')})."
+    return "\n\n".join(
+        f"{role}: {chunk[role]}" for role in ("general_analyst", "striking", "grappling", "submission") if chunk.get(role)
+    )
+
+
 # -----------------------------------------------------------------------------
 # New prompt creation
 # -----------------------------------------------------------------------------
@@ -137,13 +163,11 @@ Generate a comprehensive prompt that defines:
 @tool
 def create_specialist_prompt(specialist_name: str, question: str, video_context: str = "") -> str:
     """Create a prompt for a specific specialist using a random existing prompt as template."""
-    prompts_folder = Path(__file__).parent.parent / "prompts"
-    template_files = list(prompts_folder.rglob("*.[tm][xd]*"))
+    specialists = list(get_specialist_catalog().values())
     
     template_content = ""
-    if template_files:
-        with open(random.choice(template_files), 'r', encoding='utf-8') as f:
-            template_content = f.read()
+    if specialists:
+        template_content = random.choice(specialists)["content"]
     
     creation_prompt = f"""Create a specialist prompt for: {specialist_name}
 
@@ -162,12 +186,13 @@ Generate a prompt with: expertise definition, analysis points, output format, an
 @tool
 def save_specialist_prompt(specialist_name: str, prompt_content: str) -> str:
     """Save the specialist prompt to the prompts/templates folder."""
-    prompts_folder = Path(__file__).parent.parent / "prompts" / "templates"
+    prompts_folder = PROMPTS_FOLDER / "templates"
     prompts_folder.mkdir(parents=True, exist_ok=True)
     
     specialist_file = prompts_folder / f"{specialist_name}.txt"
     with open(specialist_file, 'w', encoding='utf-8') as f:
         f.write(prompt_content)
+    invalidate_specialist_catalog()
     
     return f"Specialist prompt '{specialist_name}' saved successfully."
 
@@ -176,20 +201,45 @@ def save_specialist_prompt(specialist_name: str, prompt_content: str) -> str:
 # Helper functions
 # -----------------------------------------------------------------------------
 
-def _find_specialist_file(specialist_name: str):
-    """Find specialist prompt file by name."""
-    prompts_folder = Path(__file__).parent.parent / "prompts"
-    
-    for ext in ['.txt', '.md']:
-        potential_path = prompts_folder / f"{specialist_name}{ext}"
-        if potential_path.exists():
-            return potential_path
-    
-    for file_path in prompts_folder.rglob(f"{specialist_name}.*"):
-        if file_path.suffix in ['.txt', '.md']:
-            return file_path
+def get_specialist_catalog() -> dict:
+    """
+    name -> {"path", "content", "hash"} for every specialist prompt, read from disk once
+    and kept in memory until invalidate_specialist_catalog() is called.
+    """
+    global _specialist_catalog
+    with _catalog_lock:
+        if _specialist_catalog is None:
+            _specialist_catalog = _load_specialist_catalog()
+        return _specialist_catalog
+
+
+def invalidate_specialist_catalog():
+    """Drop the cached catalog; the next lookup re-reads the prompts folder."""
+    global _specialist_catalog
+    with _catalog_lock:
+        _specialist_catalog = None
+
+
+def _load_specialist_catalog() -> dict:
+    catalog = {}
+    if not PROMPTS_FOLDER.exists():
+        return catalog
     
-    return None
+    # Top-level files win over nested ones and .txt over .md (same precedence as the old per-call lookup)
+    files = sorted(
+        (p for p in PROMPTS_FOLDER.rglob("*") if p.is_file() and p.suffix in SPECIALIST_EXTENSIONS),
+        key=lambda p: (len(p.relative_to(PROMPTS_FOLDER).parts), SPECIALIST_EXTENSIONS.index(p.suffix), str(p))
+    )
+    for file_path in files:
+        if file_path.stem in catalog:
+            continue
+        content = file_path.read_text(encoding="utf-8")
+        catalog[file_path.stem] = {
+            "path": file_path,
+            "content": content,
+            "hash": hashlib.sha256(content.encode("utf-8")).hexdigest(),
+        }
+    return catalog
 
 # -----------------------------------------------------------------------------
 # Agent setup
@@ -217,6 +267,9 @@ prompt_template = ChatPromptTemplate.from_messages(
     [("system", SYSTEM_PROMPT_TEMPLATE), ("user", USER_MESSAGE_TEMPLATE)]
 )
 
+# LRU of in-memory threads with SQLite spill and TTL, see services/chat_memory.py
+chat_memory = BoundedCheckpointer()
+
 react_agent = create_react_agent(
     model=llm_orchestrator,
     tools=[
@@ -225,30 +278,175 @@ react_agent = create_react_agent(
         explain_specialist_analysis,
         create_prompt_for_other_topic, 
         create_specialist_prompt, 
-        save_specialist_prompt
+        save_specialist_prompt,
+        get_chunk_analysis
     ],
     debug=False,
     # response_format=,     # PyDantic Class
-    checkpointer=InMemorySaver(),
+    # Keeps the thread state short (older turns summarized) so checkpoints don't grow per turn
+    pre_model_hook=trim_history,
+    checkpointer=chat_memory,
     store=InMemoryStore(),
 )
 
 
-def call_agent(user_query: str, video_context_analysis: str = "", thread_id: str = ""):
+THINKING_RE = re.compile(r'<thinking>.*?</thinking>', flags=re.DOTALL)
+
+
+def _agent_run(user_query: str, video_context_analysis: str, thread_id: str, job_id: str = ""):
     """
-    thread_id: Unique identifier for the interaction thread (video_path or user session)
+    (input, config, ephemeral) for one agent run. Runs without thread_id use a throwaway
+    thread that is deleted afterwards, so one-off questions don't accumulate in memory.
     """
-    if not thread_id:
+    ephemeral = not thread_id
+    if ephemeral:
         thread_id = str(uuid.uuid4())
-    config = {"configurable": {"thread_id": thread_id}, "recursion_limit": 10, "max_tokens": 256}
-
-    ai_response = react_agent.invoke(input=prompt_template.invoke({
+    # job_id is read by the drill-down tools
+    config = {"configurable": {"thread_id": thread_id, "job_id": job_id}, "recursion_limit": 10, "max_tokens": 256}
+    agent_input = prompt_template.invoke({
         "video_context_analysis": video_context_analysis, "user_query": user_query
-    }), config=config,)['messages'][-1].content
+    })
+    return agent_input, config, ephemeral
 
-    ai_response = re.sub(r'<thinking>.*?</thinking>', '', ai_response, flags=re.DOTALL).strip()
-    
-    return ai_response
+
+def _end_run(config: dict, ephemeral: bool):
+    if ephemeral:
+        chat_memory.delete_thread(config["configurable"]["thread_id"])
+
+
+def call_agent(user_query: str, video_context_analysis: str = "", thread_id: str = "", job_id: str = ""):
+    """
+    thread_id: Unique identifier for the interaction thread (video_path or user session)
+    job_id: Job whose chunks the agent can drill into
+    """
+    agent_input, config, ephemeral = _agent_run(user_query, video_context_analysis, thread_id, job_id)
+    try:
+        ai_response = react_agent.invoke(input=agent_input, config=config)['messages'][-1].content
+    finally:
+        _end_run(config, ephemeral)
+
+    return THINKING_RE.sub('', ai_response).strip()
+
+
+async def acall_agent(user_query: str, video_context_analysis: str = "", thread_id: str = "", job_id: str = ""):
+    """Same as call_agent without blocking the event loop (sync tools run in a thread pool)"""
+    agent_input, config, ephemeral = _agent_run(user_query, video_context_analysis, thread_id, job_id)
+    try:
+        result = await react_agent.ainvoke(input=agent_input, config=config)
+    finally:
+        _end_run(config, ephemeral)
+
+    return THINKING_RE.sub('', result['messages'][-1].content).strip()
+
+
+class ThinkingStripper:
+    """
+    Incremental THINKING_RE.sub('', text).strip() for streamed text: feed() returns the
+    part that is safe to emit, holding back partial tags, thinking blocks and trailing spaces.
+    """
+    OPEN, CLOSE = "<thinking>", "</thinking>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._inside = False
+        self._started = False
+        self._pending_space = ""
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        out = []
+        while self._buffer:
+            if self._inside:
+                end = self._buffer.find(self.CLOSE)
+                if end < 0:
+                    break
+                self._buffer = self._buffer[end + len(self.CLOSE):]
+                self._inside = False
+            else:
+                start = self._buffer.find(self.OPEN)
+                if start >= 0:
+                    out.append(self._buffer[:start])
+                    self._buffer = self._buffer[start + len(self.OPEN):]
+                    self._inside = True
+                    continue
+                # Keep a suffix that could be the beginning of "<thinking>"
+                keep = next((n for n in range(len(self.OPEN) - 1, 0, -1) if self._buffer.endswith(self.OPEN[:n])), 0)
+                out.append(self._buffer[:len(self._buffer) - keep])
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                break
+        return self._emit("".join(out))
+
+    def flush(self) -> str:
+        # An unterminated block is not a match for the regex, so it is kept
+        rest = (self.OPEN if self._inside else "") + self._buffer
+        self._buffer, self._inside = "", False
+        return self._emit(rest, final=True)
+
+    def _emit(self, text: str, final: bool = False) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        text = self._pending_space + text
+        stripped = text.rstrip()
+        self._pending_space = "" if final else text[len(stripped):]
+        return stripped
+
+
+def _message_text(content) -> str:
+    """Text of a message chunk (Bedrock Converse sends a list of content blocks)"""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict) and block.get("type") == "text")
+
+
+async def astream_agent(user_query: str, video_context_analysis: str = "", thread_id: str = "", job_id: str = ""):
+    """
+    Run the agent and yield events as they happen:
+      {"type": "token", "text"}                 orchestrator tokens, <thinking> blocks removed
+      {"type": "tool_call", "name", "args"}     when the orchestrator decides to call a tool
+      {"type": "tool_result", "name", "content"}
+      {"type": "done", "response"}              final answer, same as acall_agent
+    """
+    agent_input, config, ephemeral = _agent_run(user_query, video_context_analysis, thread_id, job_id)
+    try:
+        strippers = {}
+        final_content = ""
+
+        async for mode, payload in react_agent.astream(agent_input, config=config, stream_mode=["messages", "updates"]):
+            if mode == "messages":
+                chunk, metadata = payload
+                # Tokens of the LLMs used inside tools are not part of the answer
+                if metadata.get("langgraph_node") != "agent" or not isinstance(chunk, AIMessageChunk):
+                    continue
+                stripper = strippers.setdefault(chunk.id, ThinkingStripper())
+                text = stripper.feed(_message_text(chunk.content))
+                if text:
+                    yield {"type": "token", "text": text}
+                continue
+
+            for node, update in payload.items():
+                # pre_model_hook updates re-send the kept history; only new agent/tool messages matter
+                if node not in ("agent", "tools"):
+                    continue
+                for message in (update or {}).get("messages", []):
+                    if isinstance(message, AIMessage):
+                        stripper = strippers.pop(message.id, None)
+                        text = stripper.flush() if stripper else ""
+                        if text:
+                            yield {"type": "token", "text": text}
+                        for tool_call in message.tool_calls:
+                            yield {"type": "tool_call", "name": tool_call["name"], "args": tool_call["args"]}
+                        final_content = _message_text(message.content)
+                    elif isinstance(message, ToolMessage):
+                        yield {"type": "tool_result", "name": message.name, "content": _message_text(message.content)}
+
+        for stripper in strippers.values():
+            text = stripper.flush()
+            if text:
+                yield {"type": "token", "text": text}
+    finally:
+        _end_run(config, ephemeral)
+    yield {"type": "done", "response": THINKING_RE.sub('', final_content).strip()}
 
 
 if __name__ == "__main__":
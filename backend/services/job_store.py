@@ -0,0 +1,322 @@
+import os
+import json
+import sqlite3
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Job state shared by every API and worker process (it used to be a module-global
+# JOBS dict saved to jobs.json, so each uvicorn worker had its own view of the jobs).
+# A job is a set of fields stored separately, like the DynamoDB items of backend_aws:
+# writers update only the fields they change and readers fetch only the fields they
+# need. LIST_FIELDS grow one item at a time (append) instead of being rewritten.
+#
+# JOB_STORE_URL picks the backend:
+#   sqlite:///jobs.db        one host, any number of processes (default)
+#   redis://host:6379/0      several hosts (needs the redis package)
+#   memory://                in-process Redis stand-in (services/local_redis.py), for tests
+
+JOB_STORE_URL = os.getenv("JOB_STORE_URL", "sqlite:///jobs.db")
+LIST_FIELDS = ("chunk_analyses", "structured_segments")
+SQLITE_BUSY_TIMEOUT_S = 30
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    # WAL: readers (progress polls) don't block the writer (the worker)
+    conn = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT_S, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+_redis_clients = {}
+_redis_lock = threading.Lock()
+
+def connect_redis(url: str):
+    """(client, WatchError) for a redis:// URL, or the in-process stand-in for memory://"""
+    with _redis_lock:
+        if url not in _redis_clients:
+            if url.startswith("memory://"):
+                from services.local_redis import LocalRedis, WatchError
+                _redis_clients[url] = (LocalRedis(), WatchError)
+            else:
+                try:
+                    import redis
+                except ImportError:
+                    raise RuntimeError(f"JOB_STORE_URL={url} needs the redis package (pip install redis)")
+                _redis_clients[url] = (redis.Redis.from_url(url, decode_responses=True), redis.exceptions.WatchError)
+        return _redis_clients[url]
+
+
+class SQLiteJobStore:
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS job_fields (
+                job_id TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL,
+                PRIMARY KEY (job_id, field)
+            );
+            CREATE TABLE IF NOT EXISTS job_items (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                field TEXT NOT NULL,
+                value TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS job_items_by_job ON job_items (job_id, field, seq);
+        """)
+
+    def _conn(self) -> sqlite3.Connection:
+        # One connection per thread (sqlite3 connections are not thread-safe)
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def create(self, job_id: str, job: dict) -> bool:
+        """Store a new job; False (and nothing written) if job_id already exists"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("SELECT 1 FROM job_fields WHERE job_id = ? AND field = 'job_id'", (job_id,)).fetchone():
+                return False
+            self._write(conn, job_id, {**job, "job_id": job_id})
+        return True
+
+    def exists(self, job_id: str) -> bool:
+        return self._conn().execute("SELECT 1 FROM job_fields WHERE job_id = ? AND field = 'job_id'", (job_id,)).fetchone() is not None
+
+    def get_fields(self, job_id: str, fields):
+        """Requested fields of a job (missing ones are left out), or None if the job doesn't exist"""
+        fields = list(fields)
+        scalar = [f for f in fields if f not in LIST_FIELDS]
+        conn = self._conn()
+        with conn:
+            # One read transaction, so the fields are consistent with each other
+            conn.execute("BEGIN")
+            rows = conn.execute(
+                f"SELECT field, value FROM job_fields WHERE job_id = ? AND field IN ({','.join('?' * (len(scalar) + 1))})",
+                (job_id, "job_id", *scalar)
+            ).fetchall()
+            values = {field: json.loads(value) for field, value in rows}
+            if "job_id" not in values:
+                return None
+            for field in fields:
+                if field in LIST_FIELDS:
+                    values[field] = self._list(conn, job_id, field)
+        return {field: values[field] for field in fields if field in values}
+
+    def get(self, job_id: str):
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN")
+            rows = conn.execute("SELECT field, value FROM job_fields WHERE job_id = ?", (job_id,)).fetchall()
+            if not rows:
+                return None
+            job = {field: json.loads(value) for field, value in rows}
+            for field in LIST_FIELDS:
+                job[field] = self._list(conn, job_id, field)
+        return job
+
+    def get_list(self, job_id: str, field: str) -> list:
+        return self._list(self._conn(), job_id, field)
+
+    def update(self, job_id: str, **fields):
+        """Set fields of a job (a list field given here replaces the whole list)"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            self._write(conn, job_id, fields)
+
+    def update_if(self, job_id: str, field: str, not_in, **fields):
+        """
+        Set fields of a job only if the current value of field is not in not_in (compare
+        and set). Returns None if the job doesn't exist, False if the value didn't allow it.
+        """
+        conn = self._conn()
+        with conn:
+            # The write lock is held from the check to the write
+            conn.execute("BEGIN IMMEDIATE")
+            rows = dict(conn.execute(
+                "SELECT field, value FROM job_fields WHERE job_id = ? AND field IN ('job_id', ?)", (job_id, field)
+            ).fetchall())
+            if "job_id" not in rows:
+                return None
+            if field in rows and json.loads(rows[field]) in not_in:
+                return False
+            self._write(conn, job_id, fields)
+        return True
+
+    def increment(self, job_id: str, **amounts):
+        """Add to integer fields of a job (a missing field counts from 0)"""
+        conn = self._conn()
+        with conn:
+            conn.executemany(
+                "INSERT INTO job_fields (job_id, field, value) VALUES (?, ?, ?) "
+                "ON CONFLICT(job_id, field) DO UPDATE SET value = CAST(value AS INTEGER) + CAST(excluded.value AS INTEGER)",
+                [(job_id, field, json.dumps(int(amount))) for field, amount in amounts.items()]
+            )
+
+    def append(self, job_id: str, field: str, value):
+        conn = self._conn()
+        with conn:
+            conn.execute("INSERT INTO job_items (job_id, field, value) VALUES (?, ?, ?)", (job_id, field, json.dumps(value)))
+
+    def _list(self, conn, job_id: str, field: str) -> list:
+        rows = conn.execute("SELECT value FROM job_items WHERE job_id = ? AND field = ? ORDER BY seq", (job_id, field)).fetchall()
+        return [json.loads(value) for value, in rows]
+
+    def _write(self, conn, job_id: str, fields: dict):
+        for field, value in fields.items():
+            if field in LIST_FIELDS:
+                conn.execute("DELETE FROM job_items WHERE job_id = ? AND field = ?", (job_id, field))
+                conn.executemany(
+                    "INSERT INTO job_items (job_id, field, value) VALUES (?, ?, ?)",
+                    [(job_id, field, json.dumps(item)) for item in value or []]
+                )
+            else:
+                conn.execute(
+                    "INSERT OR REPLACE INTO job_fields (job_id, field, value) VALUES (?, ?, ?)",
+                    (job_id, field, json.dumps(value))
+                )
+
+
+class RedisJobStore:
+    """
+    A job is the hash job:{id} (field -> JSON value) plus one list job:{id}:{field}
+    per list field. Works with any Redis-protocol server, or the in-process stand-in.
+    """
+
+    def __init__(self, url: str):
+        self.client, self.WatchError = connect_redis(url)
+
+    @staticmethod
+    def _key(job_id: str, field: str = None) -> str:
+        return f"job:{job_id}" if field is None else f"job:{job_id}:{field}"
+
+    def create(self, job_id: str, job: dict) -> bool:
+        key = self._key(job_id)
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                if pipe.exists(key):
+                    return False
+                pipe.multi()
+                self._write(pipe, job_id, {**job, "job_id": job_id})
+                pipe.execute()
+            except self.WatchError:
+                # Created concurrently by someone else
+                return False
+        return True
+
+    def exists(self, job_id: str) -> bool:
+        return bool(self.client.exists(self._key(job_id)))
+
+    def get_fields(self, job_id: str, fields):
+        fields = list(fields)
+        scalar = [f for f in fields if f not in LIST_FIELDS]
+        with self.client.pipeline() as pipe:
+            pipe.hmget(self._key(job_id), ["job_id", *scalar])
+            for field in fields:
+                if field in LIST_FIELDS:
+                    pipe.lrange(self._key(job_id, field), 0, -1)
+            results = pipe.execute()
+        if results[0][0] is None:
+            return None
+        values = {field: json.loads(value) for field, value in zip(scalar, results[0][1:]) if value is not None}
+        lists = iter(results[1:])
+        for field in fields:
+            if field in LIST_FIELDS:
+                values[field] = [json.loads(item) for item in next(lists)]
+        return {field: values[field] for field in fields if field in values}
+
+    def get(self, job_id: str):
+        with self.client.pipeline() as pipe:
+            pipe.hgetall(self._key(job_id))
+            for field in LIST_FIELDS:
+                pipe.lrange(self._key(job_id, field), 0, -1)
+            results = pipe.execute()
+        if not results[0]:
+            return None
+        job = {field: json.loads(value) for field, value in results[0].items()}
+        for field, items in zip(LIST_FIELDS, results[1:]):
+            job[field] = [json.loads(item) for item in items]
+        return job
+
+    def get_list(self, job_id: str, field: str) -> list:
+        return [json.loads(item) for item in self.client.lrange(self._key(job_id, field), 0, -1)]
+
+    def update(self, job_id: str, **fields):
+        with self.client.pipeline() as pipe:
+            self._write(pipe, job_id, fields)
+            pipe.execute()
+
+    def update_if(self, job_id: str, field: str, not_in, **fields):
+        key = self._key(job_id)
+        with self.client.pipeline() as pipe:
+            while True:
+                try:
+                    pipe.watch(key)
+                    exists, value = pipe.hmget(key, ["job_id", field])
+                    if exists is None:
+                        return None
+                    if value is not None and json.loads(value) in not_in:
+                        return False
+                    pipe.multi()
+                    self._write(pipe, job_id, fields)
+                    pipe.execute()
+                    return True
+                except self.WatchError:
+                    # The job changed between the check and the write: check again
+                    continue
+
+    def increment(self, job_id: str, **amounts):
+        # Integer JSON values are plain numbers, so HINCRBY works on them
+        with self.client.pipeline() as pipe:
+            for field, amount in amounts.items():
+                pipe.hincrby(self._key(job_id), field, int(amount))
+            pipe.execute()
+
+    def append(self, job_id: str, field: str, value):
+        self.client.rpush(self._key(job_id, field), json.dumps(value))
+
+    def _write(self, pipe, job_id: str, fields: dict):
+        scalar = {field: json.dumps(value) for field, value in fields.items() if field not in LIST_FIELDS}
+        if scalar:
+            pipe.hset(self._key(job_id), mapping=scalar)
+        for field in LIST_FIELDS:
+            if field in fields:
+                pipe.delete(self._key(job_id, field))
+                if fields[field]:
+                    pipe.rpush(self._key(job_id, field), *(json.dumps(item) for item in fields[field]))
+
+
+def open_job_store(url: str = JOB_STORE_URL):
+    if url.startswith("sqlite:///"):
+        return SQLiteJobStore(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://", "memory://")):
+        return RedisJobStore(url)
+    raise ValueError(f"Unsupported JOB_STORE_URL: {url}")
+
+
+def import_jobs_file(store, path: str):
+    """One-off import of a legacy jobs.json; jobs already in the store are left alone"""
+    if not os.path.exists(path):
+        return
+    try:
+        with open(path, "r") as f:
+            jobs = json.load(f)
+        imported = sum(1 for job_id, job in jobs.items() if store.create(job_id, job))
+        os.replace(path, path + ".imported")
+        logger.info(f"Imported {imported} of {len(jobs)} jobs from {path}")
+    except FileNotFoundError:
+        # Imported by another process meanwhile
+        pass
+    except Exception as e:
+        logger.error(f"Error importing {path}: {e}")
+
+
+job_store = open_job_store()
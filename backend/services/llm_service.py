@@ -1,6 +1,7 @@
 import os
 import time
 import logging
+import threading
 from typing import Dict, Optional
 import json
 from google import genai
@@ -20,6 +21,20 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class AnalysisCancelled(Exception):
+    """Raised at a step boundary when the caller asked the analysis to stop"""
+
+def _pause(seconds: float, cancel_event: Optional[threading.Event]):
+    """Sleep that wakes up (and aborts the analysis) as soon as cancel_event is set"""
+    if cancel_event is None:
+        time.sleep(seconds)
+    elif cancel_event.wait(seconds):
+        raise AnalysisCancelled("Analysis cancelled")
+
+def _check_cancelled(cancel_event: Optional[threading.Event]):
+    if cancel_event is not None and cancel_event.is_set():
+        raise AnalysisCancelled("Analysis cancelled")
+
 class LLMService:
     def __init__(self):
         self.api_key = os.getenv("GEMINI_API_KEY")
@@ -39,9 +54,17 @@ class LLMService:
             "seed": 42
         }
 
-    def upload_file(self, file_path, max_retries=3):
+    def _delete_remote_file(self, myfile):
+        """Best-effort removal of a Gemini file that won't be used"""
+        try:
+            self.client.files.delete(name=myfile.name)
+        except Exception as e:
+            logger.warning(f"Could not delete remote file {myfile.name}: {e}")
+
+    def upload_file(self, file_path, max_retries=3, cancel_event: Optional[threading.Event] = None):
         """Upload file to Gemini with retry logic and timeout"""
         for attempt in range(max_retries):
+            myfile = None
             try:
                 logger.info(f"[{datetime.now().isoformat()}] Uploading file (attempt {attempt + 1}/{max_retries}): {file_path}")
                 myfile = self.client.files.upload(file=file_path)
@@ -56,7 +79,7 @@ class LLMService:
                         raise TimeoutError(f"File processing timeout after {timeout}s")
                     
                     logger.info(f"Processing video... ({int(elapsed)}s elapsed)")
-                    time.sleep(5)
+                    _pause(5, cancel_event)
                     myfile = self.client.files.get(name=myfile.name)
                     
                 if myfile.state.name == "FAILED":
@@ -65,17 +88,22 @@ class LLMService:
                 logger.info(f"[{datetime.now().isoformat()}] File uploaded and processed: {myfile.name}")
                 return myfile
                 
+            except AnalysisCancelled:
+                if myfile is not None:
+                    self._delete_remote_file(myfile)
+                raise
             except Exception as e:
                 logger.error(f"Upload attempt {attempt + 1} failed: {e}")
                 if attempt < max_retries - 1:
                     # Exponential backoff: 2^attempt seconds
                     wait_time = 2 ** attempt
                     logger.info(f"Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
+                    _pause(wait_time, cancel_event)
                 else:
                     raise e
 
-    def analyze_chunk(self, file_path: str, segment_index: int, start_s: int, end_s: int):
+    def analyze_chunk(self, file_path: str, segment_index: int, start_s: int, end_s: int,
+                      cancel_event: Optional[threading.Event] = None):
         """
         Analyze chunk following the workflow from notebook:
         1. General Analyst creates ground truth from video
@@ -84,6 +112,8 @@ class LLMService:
         
         Args:
             file_path: Path to video file
+            cancel_event: When set, the analysis stops at the next step boundary
+                raising AnalysisCancelled (an LLM call already in flight is not interrupted)
         
         Returns:
             Dict with analysis results
@@ -91,12 +121,14 @@ class LLMService:
         if not self.client:
             raise ValueError("GEMINI_API_KEY not set or client initialization failed")
 
+        myfile = None
         try:
-            myfile = self.upload_file(file_path)
+            myfile = self.upload_file(file_path, cancel_event=cancel_event)
             
             results = {}
             
             # Step 1: General Analyst
+            _check_cancelled(cancel_event)
             logger.info(f"[{datetime.now().isoformat()}] Running General Analyst...")
             prompt_general = generate_general_analyst_prompt()
             response_general = self.client.models.generate_content(
@@ -108,6 +140,7 @@ class LLMService:
             results["general_analyst"] = general_analysis
 
             # Structured SegmentSummary JSON generation
+            _check_cancelled(cancel_event)
             try:
                 structured_prompt = generate_structured_segment_prompt(
                     general_analyst_table=general_analysis,
@@ -146,13 +179,14 @@ class LLMService:
             logger.info(f"[{datetime.now().isoformat()}] General Analyst completed")
             
             # Delay between LLM calls to avoid rate limits
-            time.sleep(5)
+            _pause(5, cancel_event)
             
             # Step 2: Specialist Roles
             specialist_roles = ["striking", "grappling", "submission", "movement"]
             specialist_analyses = {}
             
             for role in specialist_roles:
+                _check_cancelled(cancel_event)
                 logger.info(f"[{datetime.now().isoformat()}] Running {role} specialist analysis...")
                 prompt_specialist = generate_specialist_prompt(
                     role=role,
@@ -169,9 +203,10 @@ class LLMService:
                 logger.info(f"[{datetime.now().isoformat()}] {role} specialist analysis completed")
                 
                 # Delay between specialist analyses
-                time.sleep(5)
+                _pause(5, cancel_event)
             
             # Step 3: Head Coach aggregation (text)
+            _check_cancelled(cancel_event)
             logger.info(f"[{datetime.now().isoformat()}] Running Head Coach aggregation...")
             prompt_head_coach = generate_head_coach_aggregation_prompt(specialist_analyses)
             response_coach = self.client.models.generate_content(
@@ -184,6 +219,12 @@ class LLMService:
                 
             return results
             
+        except AnalysisCancelled:
+            logger.warning(f"[{datetime.now().isoformat()}] analyze_chunk cancelled: {file_path}")
+            # Nobody will use the uploaded video any more
+            if myfile is not None:
+                self._delete_remote_file(myfile)
+            raise
         except Exception as e:
             logger.error(f"[{datetime.now().isoformat()}] Error in analyze_chunk: {e}")
             raise e
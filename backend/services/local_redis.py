@@ -0,0 +1,199 @@
+import threading
+from bisect import insort
+
+# In-process stand-in for the subset of the redis-py client used by the Redis job
+# store and work queue (hashes, lists, sorted sets, WATCH/MULTI/EXEC pipelines),
+# with decode_responses=True semantics. It lets JOB_STORE_URL=memory:// exercise the
+# exact Redis code paths in tests and single-process runs without a server.
+
+class WatchError(Exception):
+    pass
+
+class LocalRedis:
+    def __init__(self):
+        self._data = {}
+        # key -> number of writes, so pipelines can detect changes to watched keys
+        self._versions = {}
+        self._lock = threading.RLock()
+
+    def _write(self, key: str, default):
+        self._versions[key] = self._versions.get(key, 0) + 1
+        return self._data.setdefault(key, default)
+
+    # Keys
+    def exists(self, *names) -> int:
+        with self._lock:
+            return sum(1 for name in names if name in self._data)
+
+    def delete(self, *names) -> int:
+        with self._lock:
+            deleted = 0
+            for name in names:
+                if name in self._data:
+                    del self._data[name]
+                    self._versions[name] = self._versions.get(name, 0) + 1
+                    deleted += 1
+            return deleted
+
+    # Hashes
+    def hset(self, name: str, key: str = None, value=None, mapping: dict = None) -> int:
+        items = dict(mapping or {})
+        if key is not None:
+            items[key] = value
+        with self._lock:
+            h = self._write(name, {})
+            added = sum(1 for k in items if k not in h)
+            h.update({k: str(v) for k, v in items.items()})
+            return added
+
+    def hget(self, name: str, key: str):
+        with self._lock:
+            return self._data.get(name, {}).get(key)
+
+    def hmget(self, name: str, keys: list) -> list:
+        with self._lock:
+            h = self._data.get(name, {})
+            return [h.get(k) for k in keys]
+
+    def hgetall(self, name: str) -> dict:
+        with self._lock:
+            return dict(self._data.get(name, {}))
+
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        with self._lock:
+            h = self._write(name, {})
+            h[key] = str(int(h.get(key, 0)) + amount)
+            return int(h[key])
+
+    # Lists
+    def rpush(self, name: str, *values) -> int:
+        with self._lock:
+            items = self._write(name, [])
+            items.extend(str(v) for v in values)
+            return len(items)
+
+    def lrange(self, name: str, start: int, end: int) -> list:
+        with self._lock:
+            items = self._data.get(name, [])
+            return list(items[start:] if end == -1 else items[start:end + 1])
+
+    def llen(self, name: str) -> int:
+        with self._lock:
+            return len(self._data.get(name, []))
+
+    # Sorted sets (kept as a member -> score dict plus a sorted (score, member) list)
+    def zadd(self, name: str, mapping: dict) -> int:
+        with self._lock:
+            zset = self._write(name, {"scores": {}, "order": []})
+            added = 0
+            for member, score in mapping.items():
+                old = zset["scores"].get(member)
+                if old is None:
+                    added += 1
+                else:
+                    zset["order"].remove((old, member))
+                zset["scores"][member] = float(score)
+                insort(zset["order"], (float(score), member))
+            return added
+
+    def zrem(self, name: str, *members) -> int:
+        with self._lock:
+            if name not in self._data:
+                return 0
+            zset = self._write(name, None)
+            removed = 0
+            for member in members:
+                score = zset["scores"].pop(member, None)
+                if score is not None:
+                    zset["order"].remove((score, member))
+                    removed += 1
+            if not zset["scores"]:
+                del self._data[name]
+            return removed
+
+    def zscore(self, name: str, member: str):
+        with self._lock:
+            return self._data.get(name, {"scores": {}})["scores"].get(member)
+
+    def zcard(self, name: str) -> int:
+        with self._lock:
+            return len(self._data.get(name, {"scores": {}})["scores"])
+
+    def zrangebyscore(self, name: str, min, max, start: int = None, num: int = None, withscores: bool = False) -> list:
+        low, high = float(min), float(max)
+        with self._lock:
+            order = self._data.get(name, {"order": []})["order"]
+            matches = [(member, score) for score, member in order if low <= score <= high]
+        if start is not None and num is not None:
+            matches = matches[start:start + num]
+        return matches if withscores else [member for member, _ in matches]
+
+    def pipeline(self, transaction: bool = True):
+        return LocalPipeline(self)
+
+    def ping(self) -> bool:
+        return True
+
+COMMANDS = {
+    "exists", "delete", "hset", "hget", "hmget", "hgetall", "hincrby", "rpush", "lrange", "llen",
+    "zadd", "zrem", "zscore", "zcard", "zrangebyscore",
+}
+
+class LocalPipeline:
+    """
+    redis-py pipeline semantics: commands are queued and run atomically by execute(),
+    except between watch() and multi(), where they run immediately. execute() raises
+    WatchError if a watched key was written since watch().
+    """
+
+    def __init__(self, client: LocalRedis):
+        self._client = client
+        self._watched = {}
+        self._immediate = False
+        self._queue = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+    def __getattr__(self, name):
+        if name not in COMMANDS:
+            raise AttributeError(name)
+        method = getattr(self._client, name)
+        if self._immediate:
+            return method
+
+        def queued(*args, **kwargs):
+            self._queue.append((method, args, kwargs))
+            return self
+        return queued
+
+    def watch(self, *names):
+        with self._client._lock:
+            for name in names:
+                self._watched[name] = self._client._versions.get(name, 0)
+        self._immediate = True
+
+    def unwatch(self):
+        self._watched = {}
+        self._immediate = False
+
+    def multi(self):
+        self._immediate = False
+
+    def execute(self) -> list:
+        with self._client._lock:
+            try:
+                for name, version in self._watched.items():
+                    if self._client._versions.get(name, 0) != version:
+                        raise WatchError(f"Watched key {name} changed")
+                return [method(*args, **kwargs) for method, args, kwargs in self._queue]
+            finally:
+                self.reset()
+
+    def reset(self):
+        self._watched = {}
+        self._immediate = False
+        self._queue = []
@@ -0,0 +1,215 @@
+import os
+import math
+import struct
+import mimetypes
+from stat import S_ISREG
+from email.utils import formatdate, parsedate_to_datetime
+
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+# HTTP serving of media files: single byte ranges (206 / 416), ETag + Last-Modified
+# validators (304) and If-Range. The body goes out through the ASGI zero-copy
+# extension (sendfile) when the server offers it, otherwise in os.pread blocks read
+# off the event loop; either way only the requested range is read.
+
+READ_BLOCK_BYTES = 256 * 1024
+ZEROCOPY = "http.response.zerocopy"
+
+mimetypes.add_type("application/vnd.apple.mpegurl", ".m3u8")
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def file_etag(stat: os.stat_result) -> str:
+    # Strong: a file is only ever replaced as a whole (os.replace), never rewritten in place
+    return f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_range(header: str, size: int):
+    """
+    (start, end) inclusive for a single "bytes=" range, None to serve the whole file
+    (no header, other units, or several ranges). Raises RangeNotSatisfiable.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    first, sep, last = spec.strip().partition("-")
+    if not sep:
+        return None
+    try:
+        if first:
+            start = int(first)
+            end = min(int(last), size - 1) if last else size - 1
+        else:
+            # Suffix range: the last N bytes
+            start, end = max(size - int(last), 0), size - 1
+    except ValueError:
+        return None
+    if start > end or start >= size:
+        raise RangeNotSatisfiable()
+    return start, end
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in candidates or etag in candidates
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def _if_range_matches(request: Request, etag: str, last_modified: str) -> bool:
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+class MediaFileResponse(Response):
+    """Sends bytes [start, end] of an open file; closes it when done"""
+
+    def __init__(self, fd: int, start: int, end: int, status_code: int, headers: dict, media_type: str, send_body: bool = True):
+        super().__init__(status_code=status_code, headers=headers, media_type=media_type)
+        self.fd = fd
+        self.start = start
+        self.count = end - start + 1
+        self.send_body = send_body
+        self.headers["content-length"] = str(self.count)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            if not self.send_body or self.count <= 0:
+                await send({"type": "http.response.body", "body": b""})
+            elif ZEROCOPY in scope.get("extensions", {}):
+                with os.fdopen(os.dup(self.fd), "rb") as file:
+                    await send({"type": ZEROCOPY, "file": file, "offset": self.start, "count": self.count})
+            else:
+                offset, remaining = self.start, self.count
+                while remaining > 0:
+                    block = await run_in_threadpool(os.pread, self.fd, min(READ_BLOCK_BYTES, remaining), offset)
+                    if not block:
+                        # Truncated underneath us: end the response short rather than hang
+                        break
+                    offset += len(block)
+                    remaining -= len(block)
+                    await send({"type": "http.response.body", "body": block, "more_body": remaining > 0})
+                if remaining > 0:
+                    await send({"type": "http.response.body", "body": b""})
+        finally:
+            os.close(self.fd)
+
+
+def media_response(request: Request, path: str, cache_control: str = "no-cache") -> Response:
+    """
+    Response for GET/HEAD of a file: 200, 206 for a satisfiable Range, 304 when the
+    validators match, 416 otherwise. Raises FileNotFoundError if the file is gone
+    or isn't a regular file.
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        # fstat of the open file: the validators describe exactly the bytes we send
+        stat = os.fstat(fd)
+        if not S_ISREG(stat.st_mode):
+            # A directory (or device, fifo): nothing to serve
+            raise FileNotFoundError(path)
+        etag = file_etag(stat)
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+        headers = {"ETag": etag, "Last-Modified": last_modified, "Accept-Ranges": "bytes", "Cache-Control": cache_control}
+        media_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+        if _not_modified(request, etag, stat.st_mtime):
+            os.close(fd)
+            return Response(status_code=304, headers=headers)
+
+        start, end, status_code = 0, stat.st_size - 1, 200
+        range_header = request.headers.get("range")
+        if range_header and _if_range_matches(request, etag, last_modified):
+            try:
+                byte_range = parse_range(range_header, stat.st_size)
+            except RangeNotSatisfiable:
+                os.close(fd)
+                return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+            if byte_range:
+                start, end = byte_range
+                status_code = 206
+                headers["Content-Range"] = f"bytes {start}-{end}/{stat.st_size}"
+
+        return MediaFileResponse(fd, start, end, status_code, headers, media_type, send_body=request.method != "HEAD")
+    except BaseException:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+        raise
+
+
+def _mp4_boxes(file, size: int):
+    """(type, offset, length) of the top-level boxes of an MP4 file"""
+    offset = 0
+    while offset + 8 <= size:
+        file.seek(offset)
+        length, box_type = struct.unpack(">I4s", file.read(8))
+        if length == 1:
+            length = struct.unpack(">Q", file.read(8))[0]
+        elif length == 0:
+            length = size - offset
+        if length < 8:
+            return
+        yield box_type.decode("latin-1"), offset, length
+        offset += length
+
+
+def fmp4_layout(path: str):
+    """
+    (init_end, media_end) of a fragmented MP4 (ftyp + moov, then moof/mdat pairs):
+    bytes [0, init_end) are its HLS init section and [init_end, media_end) its media
+    segment (a trailing mfra index is left out). None if the file isn't fragmented.
+    """
+    init_end = media_end = None
+    with open(path, "rb") as file:
+        for box_type, offset, length in _mp4_boxes(file, os.fstat(file.fileno()).st_size):
+            if box_type == "moof" and init_end is None:
+                init_end = offset
+            if box_type in ("moof", "mdat") and init_end is not None:
+                media_end = offset + length
+    return (init_end, media_end) if init_end else None
+
+
+def hls_playlist(segments, complete: bool, min_target_duration_s: int = 1) -> str:
+    """
+    HLS media playlist over fragmented MP4 segments, (uri, duration_s, init_end,
+    media_end) each: every chunk is a standalone file, so each one brings its own init
+    section (EXT-X-MAP) after a discontinuity, and both are byte ranges of that file.
+    Until complete it is an EVENT playlist without #EXT-X-ENDLIST, so players reload
+    it as new segments appear; min_target_duration_s (the nominal chunk length) keeps
+    its target duration from changing as it grows.
+    """
+    target_duration_s = max([min_target_duration_s] + [math.ceil(duration_s) for _, duration_s, _, _ in segments])
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:7",
+        f"#EXT-X-TARGETDURATION:{target_duration_s}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        f"#EXT-X-PLAYLIST-TYPE:{'VOD' if complete else 'EVENT'}",
+    ]
+    for i, (uri, duration_s, init_end, media_end) in enumerate(segments):
+        if i:
+            lines.append("#EXT-X-DISCONTINUITY")
+        lines += [
+            f'#EXT-X-MAP:URI="{uri}",BYTERANGE="{init_end}@0"',
+            f"#EXTINF:{duration_s:.3f},",
+            f"#EXT-X-BYTERANGE:{media_end - init_end}@{init_end}",
+            uri,
+        ]
+    if complete:
+        lines.append("#EXT-X-ENDLIST")
+    return "\n".join(lines) + "\n"
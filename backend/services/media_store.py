@@ -0,0 +1,414 @@
+import os
+import hashlib
+import shutil
+import threading
+import time
+import uuid
+import logging
+
+from services.job_store import connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+# Retention of uploaded videos, their split chunks and thumbnails (media/uploads,
+# media/splits, media/thumbs).
+#
+# Media is content-addressed: an upload is stored as uploads/{sha256}{ext}, its
+# chunks as splits/{sha256}/chunk_{n}.mp4 and their thumbnails under
+# thumbs/{sha256}/chunk_{n}/, so re-uploading the same video reuses the file and
+# everything already derived from it. Each job holding a video is a reference
+# (media_refs) with its own expiry; a video is deleted once no reference is left.
+#
+# The sweeper (MediaSweeper, started by the API) periodically:
+#   1. drops the references of finished jobs past their TTL, then the unreferenced media
+#   2. evicts files of finished jobs while the media is over MEDIA_QUOTA_BYTES: chunks
+#      first (they can be cut again from the upload), then thumbnails, then the uploads
+#      themselves, least recently used first within each kind (the analyses stay in
+#      the job store)
+#   3. removes files the index doesn't know about (older than MEDIA_ORPHAN_GRACE_S)
+# Jobs also make room with ensure_space before splitting, instead of filling the disk.
+#
+# The index is a SQLite file next to the media (like the files, it belongs to the
+# media directory, whichever hosts share it).
+
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "media"))
+MEDIA_INDEX_PATH = os.getenv("MEDIA_INDEX_PATH", os.path.join(MEDIA_ROOT, "index.db"))
+# Default and maximum time a finished job keeps its media
+MEDIA_TTL_S = int(os.getenv("MEDIA_TTL_S", str(7 * 24 * 3600)))
+MEDIA_MAX_TTL_S = int(os.getenv("MEDIA_MAX_TTL_S", str(30 * 24 * 3600)))
+# Bytes of uploads, chunks and thumbnails kept on disk (0 = no quota)
+MEDIA_QUOTA_BYTES = int(os.getenv("MEDIA_QUOTA_BYTES", str(20 * 1024 ** 3)))
+# Free space always left on the disk for ffmpeg and the job store
+MEDIA_MIN_FREE_BYTES = int(os.getenv("MEDIA_MIN_FREE_BYTES", str(1024 ** 3)))
+MEDIA_SWEEP_INTERVAL_S = int(os.getenv("MEDIA_SWEEP_INTERVAL_S", "300"))
+# Unindexed files younger than this may be uploads or splits still being written
+MEDIA_ORPHAN_GRACE_S = int(os.getenv("MEDIA_ORPHAN_GRACE_S", str(24 * 3600)))
+COPY_BUFFER_BYTES = 1024 * 1024
+
+COUNTERS = (
+    "sweeps", "files_deleted", "dedup_hits", "dedup_bytes_saved",
+    "reclaimed_bytes_expired", "reclaimed_bytes_evicted", "reclaimed_bytes_released", "reclaimed_bytes_orphaned",
+)
+
+
+def hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(COPY_BUFFER_BYTES):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class MediaStore:
+    def __init__(self, root: str = MEDIA_ROOT, index_path: str = MEDIA_INDEX_PATH, quota_bytes: int = MEDIA_QUOTA_BYTES):
+        self.root = root
+        self.uploads_dir = os.path.join(root, "uploads")
+        self.splits_dir = os.path.join(root, "splits")
+        self.thumbs_dir = os.path.join(root, "thumbs")
+        self.quota_bytes = quota_bytes
+        for directory in self.media_dirs:
+            os.makedirs(directory, exist_ok=True)
+        self.index_path = index_path
+        self._local = threading.local()
+        self._conn().executescript("""
+            CREATE TABLE IF NOT EXISTS media_files (
+                path TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                -- upload | chunk | thumb
+                kind TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS media_files_by_digest ON media_files (digest, kind);
+            CREATE INDEX IF NOT EXISTS media_files_lru ON media_files (kind, last_access);
+            CREATE TABLE IF NOT EXISTS media_refs (
+                job_id TEXT PRIMARY KEY,
+                digest TEXT NOT NULL,
+                -- 1 while the job is queued or running: its media is never evicted
+                active INTEGER NOT NULL DEFAULT 1,
+                expires_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS media_refs_by_digest ON media_refs (digest);
+            CREATE TABLE IF NOT EXISTS media_counters (
+                name TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            );
+        """)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.index_path)
+        return conn
+
+    # Paths
+    @property
+    def media_dirs(self):
+        return (self.uploads_dir, self.splits_dir, self.thumbs_dir)
+
+    def upload_path(self, digest: str, ext: str) -> str:
+        return os.path.join(self.uploads_dir, f"{digest}{ext.lower()}")
+
+    def chunk_path(self, digest: str, index: int) -> str:
+        return os.path.join(self.splits_dir, digest, f"chunk_{index + 1}.mp4")
+
+    def thumbs_path(self, digest: str, index: int, filename: str) -> str:
+        return os.path.join(self.thumbs_dir, digest, f"chunk_{index + 1}", filename)
+
+    def resolve(self, relative_path: str):
+        """
+        Absolute path of a file under the media directories given relative to the media
+        root; None outside them, and for files still being written (temp_path, .thumbs-* work dirs)
+        """
+        path = os.path.normpath(os.path.join(self.root, relative_path))
+        if self._is_work_file(path):
+            return None
+        # Checked on the resolved path, so neither ".." nor symlinks lead out of the media
+        real_path = os.path.realpath(path)
+        for directory in self.media_dirs:
+            real_directory = os.path.realpath(directory)
+            if os.path.commonpath([real_path, real_directory]) == real_directory:
+                return path
+        return None
+
+    @staticmethod
+    def _is_work_file(path: str) -> bool:
+        name = os.path.basename(path)
+        if name.endswith(".tmp") or os.path.splitext(name)[0].endswith(".tmp"):
+            return True
+        return any(part.startswith(".thumbs-") for part in path.split(os.sep))
+
+    def relative_path(self, path: str) -> str:
+        return os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def temp_path(self, final_path: str) -> str:
+        """Where to write a file before add_* moves it into place (same directory, same extension)"""
+        base, ext = os.path.splitext(final_path)
+        return f"{base}.{uuid.uuid4().hex}.tmp{ext}"
+
+    # Writes
+    def save_upload(self, fileobj, filename: str, job_id: str, ttl_s: int = None):
+        """
+        Store an uploaded stream for job_id, hashing it while it is written.
+        Returns (digest, path); if the same video is already stored, the new copy is dropped.
+        """
+        ext = os.path.splitext(filename)[1]
+        temp_path = self.temp_path(os.path.join(self.uploads_dir, "upload" + ext))
+        digest = hashlib.sha256()
+        try:
+            with open(temp_path, "wb") as out:
+                while block := fileobj.read(COPY_BUFFER_BYTES):
+                    digest.update(block)
+                    out.write(block)
+        except BaseException:
+            self._remove(temp_path)
+            raise
+        return self.add_upload(temp_path, digest.hexdigest(), ext, job_id, ttl_s)
+
+    def add_upload(self, temp_path: str, digest: str, ext: str, job_id: str, ttl_s: int = None):
+        """Move a written upload into place (or drop it if already stored) and reference it from job_id"""
+        path = self.upload_path(digest, ext)
+        size = os.path.getsize(temp_path)
+        ttl_s = MEDIA_TTL_S if ttl_s is None else min(ttl_s, MEDIA_MAX_TTL_S)
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            stored = conn.execute("SELECT 1 FROM media_files WHERE path = ?", (path,)).fetchone()
+            if stored and os.path.exists(path):
+                self._remove(temp_path)
+                self._count(conn, dedup_hits=1, dedup_bytes_saved=size)
+                logger.info(f"Upload of job {job_id} is a duplicate of media {digest[:12]}")
+            else:
+                os.replace(temp_path, path)
+                conn.execute("INSERT OR REPLACE INTO media_files (path, digest, kind, bytes, last_access) VALUES (?, ?, 'upload', ?, ?)",
+                             (path, digest, size, now))
+            conn.execute("INSERT OR REPLACE INTO media_refs (job_id, digest, active, expires_at) VALUES (?, ?, 1, ?)",
+                         (job_id, digest, now + ttl_s))
+        return digest, path
+
+    def add_chunk(self, temp_path: str, digest: str, index: int) -> str:
+        return self.add_file(temp_path, self.chunk_path(digest, index), digest, "chunk")
+
+    def add_file(self, temp_path: str, path: str, digest: str, kind: str) -> str:
+        """Move a file derived from the media `digest` into place and index it"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            os.replace(temp_path, path)
+            conn.execute("INSERT OR REPLACE INTO media_files (path, digest, kind, bytes, last_access) VALUES (?, ?, ?, ?, ?)",
+                         (path, digest, kind, os.path.getsize(path), time.time()))
+        return path
+
+    def has_chunk(self, digest: str, index: int) -> bool:
+        """Whether the chunk was already cut (by an earlier job on the same video) and is still there"""
+        return self.has_file(self.chunk_path(digest, index))
+
+    def has_file(self, path: str) -> bool:
+        stored = self._conn().execute("SELECT 1 FROM media_files WHERE path = ?", (path,)).fetchone()
+        return stored is not None and os.path.exists(path)
+
+    def touch(self, *paths):
+        """Mark files as used (eviction is least recently used first)"""
+        with self._conn() as conn:
+            conn.executemany("UPDATE media_files SET last_access = ? WHERE path = ?", [(time.time(), path) for path in paths])
+
+    def finish(self, job_id: str):
+        """The job is done with its media: from now on it can be evicted, and expires at its TTL"""
+        with self._conn() as conn:
+            conn.execute("UPDATE media_refs SET active = 0 WHERE job_id = ?", (job_id,))
+
+    def release(self, job_id: str) -> int:
+        """Drop the job's reference now (e.g. cancelled); returns the bytes freed if it was the last one"""
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT digest FROM media_refs WHERE job_id = ?", (job_id,)).fetchone()
+            if row is None:
+                return 0
+            conn.execute("DELETE FROM media_refs WHERE job_id = ?", (job_id,))
+            freed = self._delete_unreferenced(conn, [row[0]])
+            self._count(conn, reclaimed_bytes_released=freed)
+        return freed
+
+    # Space
+    def ensure_space(self, needed_bytes: int) -> bool:
+        """Evict media of finished jobs until needed_bytes fit in the quota and on the disk"""
+        overflow = self._overflow(needed_bytes)
+        if overflow > 0:
+            self.evict(overflow)
+            overflow = self._overflow(needed_bytes)
+        return overflow <= 0
+
+    def _overflow(self, needed_bytes: int) -> int:
+        overflow = needed_bytes + MEDIA_MIN_FREE_BYTES - shutil.disk_usage(self.root).free
+        if self.quota_bytes:
+            overflow = max(overflow, self.total_bytes() + needed_bytes - self.quota_bytes)
+        return overflow
+
+    def total_bytes(self) -> int:
+        return self._conn().execute("SELECT COALESCE(SUM(bytes), 0) FROM media_files").fetchone()[0]
+
+    def evict(self, target_bytes: int) -> int:
+        """
+        Delete files of media no running job holds until target_bytes are freed: chunks,
+        then thumbnails, then uploads, least recently used first within each kind. Every
+        byte counted against the quota can be evicted this way.
+        """
+        conn = self._conn()
+        freed = 0
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute(
+                "SELECT path, digest, bytes FROM media_files f "
+                "WHERE NOT EXISTS (SELECT 1 FROM media_refs r WHERE r.digest = f.digest AND r.active = 1) "
+                "ORDER BY CASE kind WHEN 'chunk' THEN 0 WHEN 'thumb' THEN 1 ELSE 2 END, last_access"
+            )
+            evicted, digests = [], set()
+            for path, digest, size in rows:
+                if freed >= target_bytes:
+                    break
+                evicted.append(path)
+                digests.add(digest)
+                freed += size
+            self._delete_files(conn, evicted)
+            self._count(conn, reclaimed_bytes_evicted=freed)
+        for digest in digests:
+            for directory in (self.splits_dir, self.thumbs_dir):
+                self._remove_empty_dirs(os.path.join(directory, digest))
+        if evicted:
+            logger.info(f"Evicted {len(evicted)} media files ({freed} bytes)")
+        return freed
+
+    # Sweeper
+    def sweep(self) -> dict:
+        """One retention pass; returns the bytes reclaimed by each step"""
+        reclaimed = {"expired": self._expire(), "evicted": 0, "orphaned": self._remove_orphans()}
+        if self.quota_bytes and self.total_bytes() > self.quota_bytes:
+            reclaimed["evicted"] = self.evict(self.total_bytes() - self.quota_bytes)
+        with self._conn() as conn:
+            self._count(conn, sweeps=1)
+            conn.execute("INSERT OR REPLACE INTO media_counters (name, value) VALUES ('last_sweep_at', ?)", (time.time(),))
+        return reclaimed
+
+    def _expire(self) -> int:
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            expired = conn.execute("SELECT job_id, digest FROM media_refs WHERE active = 0 AND expires_at <= ?", (time.time(),)).fetchall()
+            conn.executemany("DELETE FROM media_refs WHERE job_id = ?", [(job_id,) for job_id, _ in expired])
+            freed = self._delete_unreferenced(conn, {digest for _, digest in expired})
+            self._count(conn, reclaimed_bytes_expired=freed)
+        if expired:
+            logger.info(f"Media of {len(expired)} jobs expired ({freed} bytes freed)")
+        return freed
+
+    def _remove_orphans(self) -> int:
+        """Files left by crashes or by the naming scheme before this index existed"""
+        cutoff = time.time() - MEDIA_ORPHAN_GRACE_S
+        known = {path for path, in self._conn().execute("SELECT path FROM media_files")}
+        freed = 0
+        for directory in self.media_dirs:
+            for dirpath, _, filenames in os.walk(directory):
+                for filename in filenames:
+                    path = os.path.join(dirpath, filename)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    if path not in known and stat.st_mtime < cutoff:
+                        self._remove(path)
+                        freed += stat.st_size
+        if freed:
+            with self._conn() as conn:
+                self._count(conn, reclaimed_bytes_orphaned=freed)
+            logger.info(f"Removed {freed} bytes of unindexed media files")
+        return freed
+
+    def _delete_unreferenced(self, conn, digests) -> int:
+        freed = 0
+        for digest in digests:
+            if conn.execute("SELECT 1 FROM media_refs WHERE digest = ?", (digest,)).fetchone():
+                continue
+            rows = conn.execute("SELECT path, bytes FROM media_files WHERE digest = ?", (digest,)).fetchall()
+            self._delete_files(conn, [path for path, _ in rows])
+            freed += sum(size for _, size in rows)
+            for directory in (self.splits_dir, self.thumbs_dir):
+                self._remove_empty_dirs(os.path.join(directory, digest))
+        return freed
+
+    @staticmethod
+    def _remove_empty_dirs(top: str):
+        for dirpath, _, _ in os.walk(top, topdown=False):
+            try:
+                os.rmdir(dirpath)
+            except OSError:
+                pass
+
+    def _delete_files(self, conn, paths):
+        # Inside the caller's write transaction: a concurrent add_* waits, so it can't
+        # register a file that is deleted right after
+        conn.executemany("DELETE FROM media_files WHERE path = ?", [(path,) for path in paths])
+        for path in paths:
+            self._remove(path)
+        self._count(conn, files_deleted=len(paths))
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Could not remove {path}: {e}")
+
+    @staticmethod
+    def _count(conn, **increments):
+        conn.executemany(
+            "INSERT INTO media_counters (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            [(name, amount) for name, amount in increments.items() if amount]
+        )
+
+    def stats(self) -> dict:
+        conn = self._conn()
+        by_kind = {kind: {"files": files, "bytes": size} for kind, files, size in
+                   conn.execute("SELECT kind, COUNT(*), SUM(bytes) FROM media_files GROUP BY kind")}
+        refs = dict(conn.execute("SELECT CASE active WHEN 1 THEN 'active' ELSE 'finished' END, COUNT(*) FROM media_refs GROUP BY active").fetchall())
+        counters = dict(conn.execute("SELECT name, value FROM media_counters").fetchall())
+        usage = shutil.disk_usage(self.root)
+        return {
+            "total_bytes": sum(kind["bytes"] for kind in by_kind.values()),
+            "quota_bytes": self.quota_bytes,
+            "disk_free_bytes": usage.free,
+            "by_kind": by_kind,
+            "media": conn.execute("SELECT COUNT(DISTINCT digest) FROM media_files").fetchone()[0],
+            "jobs": {"active": refs.get("active", 0), "finished": refs.get("finished", 0)},
+            "counters": {name: int(counters.get(name, 0)) for name in COUNTERS},
+            "last_sweep_at": counters.get("last_sweep_at"),
+        }
+
+
+class MediaSweeper:
+    """Background thread running MediaStore.sweep every interval_s"""
+
+    def __init__(self, store: MediaStore, interval_s: int = MEDIA_SWEEP_INTERVAL_S):
+        self.store = store
+        self.interval_s = interval_s
+        self.stop = threading.Event()
+
+    def run(self):
+        while not self.stop.wait(self.interval_s):
+            try:
+                self.store.sweep()
+            except Exception as e:
+                logger.error(f"Media sweep failed: {e}")
+
+    def start(self):
+        if self.interval_s > 0:
+            threading.Thread(target=self.run, name="media-sweeper", daemon=True).start()
+
+    def shutdown(self):
+        self.stop.set()
+
+
+media_store = MediaStore()
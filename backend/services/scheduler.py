@@ -0,0 +1,57 @@
+import os
+import math
+import threading
+import logging
+from services.work_queue import work_queue
+
+logger = logging.getLogger(__name__)
+
+# Admission control for new jobs. The queue is shared (services/work_queue.py), so the
+# limits hold across every API process. When they are exceeded /upload answers 429
+# with a Retry-After estimated from the backlog and recent run times.
+
+# Jobs waiting to start, overall and per tenant
+WORK_MAX_QUEUED = int(os.getenv("WORK_MAX_QUEUED", "20"))
+WORK_MAX_QUEUED_PER_TENANT = int(os.getenv("WORK_MAX_QUEUED_PER_TENANT", "5"))
+# Used for Retry-After until some job has finished
+DEFAULT_RUN_S = 120
+RETRY_AFTER_MIN_S = 5
+RETRY_AFTER_MAX_S = 600
+
+_rejected = {}
+_rejected_lock = threading.Lock()
+
+def job_priority(duration_s) -> float:
+    """Queue priority of a video job: its duration, so short clips run first (unknown -> 1h)"""
+    return float(duration_s) if duration_s else 3600.0
+
+def _retry_after(waiting: int, limit: int, stats: dict) -> int:
+    # Time for the workers to drain the excess: (waiting - limit + 1) jobs, `running` at a time
+    run_s = stats["avg_run_s"] or DEFAULT_RUN_S
+    estimate = (waiting - limit + 1) * run_s / max(stats["running"], 1)
+    return int(min(max(math.ceil(estimate), RETRY_AFTER_MIN_S), RETRY_AFTER_MAX_S))
+
+def admit(tenant: str):
+    """None if a new job of `tenant` can be queued, else the Retry-After seconds"""
+    stats = work_queue.stats()
+    tenant_queued = stats["by_tenant"].get(tenant, {}).get("queued", 0)
+    retry_after = None
+    if WORK_MAX_QUEUED and stats["queued"] >= WORK_MAX_QUEUED:
+        retry_after = _retry_after(stats["queued"], WORK_MAX_QUEUED, stats)
+    elif WORK_MAX_QUEUED_PER_TENANT and tenant_queued >= WORK_MAX_QUEUED_PER_TENANT:
+        retry_after = _retry_after(tenant_queued, WORK_MAX_QUEUED_PER_TENANT, stats)
+    if retry_after is not None:
+        with _rejected_lock:
+            _rejected[tenant] = _rejected.get(tenant, 0) + 1
+        logger.warning(f"Queue saturated ({stats['queued']} queued, tenant {tenant}: {tenant_queued}); retry after {retry_after}s")
+    return retry_after
+
+def get_metrics(pool=None) -> dict:
+    """Queue depth and throughput (shared), plus rejections and worker pool usage of this process"""
+    metrics = work_queue.stats()
+    metrics["limits"] = {"max_queued": WORK_MAX_QUEUED, "max_queued_per_tenant": WORK_MAX_QUEUED_PER_TENANT}
+    with _rejected_lock:
+        metrics["rejected"] = dict(_rejected)
+    if pool is not None:
+        metrics["workers"] = pool.stats()
+    return metrics
@@ -0,0 +1,110 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import logging
+
+from services.media_store import media_store
+
+logger = logging.getLogger(__name__)
+
+# Thumbnails of a chunk, made once its analysis has produced the highlights:
+#   sprite.jpg        frames every THUMB_INTERVAL_S, THUMB_WIDTH x THUMB_HEIGHT each
+#                     (letterboxed), tiled SPRITE_COLUMNS per row, for timeline scrubbing
+#   still_{SS}.jpg    a larger frame at each MomentHighlight timestamp (second SS of the chunk)
+# Both come out of a single ffmpeg decode of the chunk. They are stored with the
+# media (thumbs/{sha256}/chunk_{n}/), named after what they show, so they are reused
+# across jobs on the same video and served with immutable cache headers.
+
+THUMB_INTERVAL_S = int(os.getenv("THUMB_INTERVAL_S", "2"))
+THUMB_WIDTH = 160
+THUMB_HEIGHT = 90
+SPRITE_COLUMNS = 5
+STILL_WIDTH = int(os.getenv("THUMB_STILL_WIDTH", "640"))
+# ffmpeg JPEG quality (2 best - 31 worst)
+JPEG_QUALITY = 5
+
+
+def sprite_geometry(window_s: int) -> dict:
+    """Layout of a chunk's sprite: tile i shows second i * interval_s of the chunk"""
+    frames = -(-window_s // THUMB_INTERVAL_S)
+    return {
+        "interval_s": THUMB_INTERVAL_S,
+        "tile_width": THUMB_WIDTH,
+        "tile_height": THUMB_HEIGHT,
+        "columns": SPRITE_COLUMNS,
+        "rows": -(-frames // SPRITE_COLUMNS),
+    }
+
+
+def highlight_second(timestamp: str):
+    """Second within the chunk of a highlight "MM:SS" timestamp (relative to the segment), or None"""
+    try:
+        minutes, seconds = (timestamp or "").split(":")
+        return int(minutes) * 60 + int(float(seconds))
+    except ValueError:
+        return None
+
+
+def sprite_path(digest: str, chunk_index: int) -> str:
+    return media_store.thumbs_path(digest, chunk_index, "sprite.jpg")
+
+
+def still_path(digest: str, chunk_index: int, second: int) -> str:
+    return media_store.thumbs_path(digest, chunk_index, f"still_{second:02d}.jpg")
+
+
+def _still_select(seconds) -> str:
+    # One frame per timestamp: the first one at or after it
+    terms = ["eq(n\\,0)" if second <= 0 else f"gte(t\\,{second})*lt(prev_pts*TB\\,{second})" for second in seconds]
+    return "+".join(terms)
+
+
+def render_chunk_thumbnails(chunk_path: str, digest: str, chunk_index: int, window_s: int, highlights) -> bool:
+    """
+    Make the sprite and the highlight stills of a chunk, unless they are all on disk
+    already. Returns False if ffmpeg failed (the analysis doesn't depend on them).
+    """
+    seconds = sorted({s for s in (highlight_second(h.get("timestamp")) for h in highlights or []) if s is not None and 0 <= s < window_s})
+    sprite = sprite_path(digest, chunk_index)
+    stills = [still_path(digest, chunk_index, second) for second in seconds]
+    if all(media_store.has_file(path) for path in [sprite, *stills]):
+        return True
+
+    geometry = sprite_geometry(window_s)
+    sprite_filter = (
+        f"fps=1/{THUMB_INTERVAL_S},"
+        f"scale={THUMB_WIDTH}:{THUMB_HEIGHT}:force_original_aspect_ratio=decrease,"
+        f"pad={THUMB_WIDTH}:{THUMB_HEIGHT}:(ow-iw)/2:(oh-ih)/2,"
+        f"tile={geometry['columns']}x{geometry['rows']}"
+    )
+    os.makedirs(os.path.dirname(sprite), exist_ok=True)
+    work_dir = tempfile.mkdtemp(prefix=".thumbs-", dir=os.path.dirname(sprite))
+    try:
+        if seconds:
+            filter_complex = f"[0:v]split=2[s][h];[s]{sprite_filter}[sprite];[h]select='{_still_select(seconds)}',scale={STILL_WIDTH}:-2[stills]"
+            outputs = [
+                "-map", "[sprite]", "-frames:v", "1", "-q:v", str(JPEG_QUALITY), os.path.join(work_dir, "sprite.jpg"),
+                "-map", "[stills]", "-fps_mode", "vfr", "-q:v", str(JPEG_QUALITY), os.path.join(work_dir, "still_%02d.jpg"),
+            ]
+        else:
+            filter_complex = f"[0:v]{sprite_filter}[sprite]"
+            outputs = ["-map", "[sprite]", "-frames:v", "1", "-q:v", str(JPEG_QUALITY), os.path.join(work_dir, "sprite.jpg")]
+        result = subprocess.run(
+            ["ffmpeg", "-y", "-v", "error", "-i", chunk_path, "-filter_complex", filter_complex, *outputs],
+            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+        )
+        if result.returncode != 0:
+            logger.warning(f"Thumbnails failed for chunk {chunk_index + 1} of media {digest[:12]}: {result.stderr[-300:]}")
+            return False
+
+        if os.path.exists(os.path.join(work_dir, "sprite.jpg")):
+            media_store.add_file(os.path.join(work_dir, "sprite.jpg"), sprite, digest, "thumb")
+        # The select filter emits the stills in timestamp order
+        for n, path in enumerate(stills, start=1):
+            produced = os.path.join(work_dir, f"still_{n:02d}.jpg")
+            if os.path.exists(produced):
+                media_store.add_file(produced, path, digest, "thumb")
+        return True
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -1,52 +1,116 @@
 import os
 import re
+import math
 import subprocess
 import json
+import threading
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor
 import logging
+from services.job_store import job_store, import_jobs_file
+from services.media_store import media_store, hash_file
+from services.thumbnails import render_chunk_thumbnails
+from services.media_http import fmp4_layout
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-JOBS = {}
+# Jobs live in the shared job store (services/job_store.py); jobs.json is the old
+# per-process file, imported once
 JOBS_FILE = "jobs.json"
+import_jobs_file(job_store, JOBS_FILE)
 
-def save_jobs():
-    """Save JOBS dict to jobs.json"""
-    try:
-        with open(JOBS_FILE, "w") as f:
-            json.dump(JOBS, f, indent=2)
-        logger.info(f"JOBS saved to {JOBS_FILE}")
-    except Exception as e:
-        logger.error(f"Error saving JOBS: {e}")
-
-def load_jobs():
-    """Load JOBS dict from jobs.json if exists"""
-    global JOBS
-    if os.path.exists(JOBS_FILE):
-        try:
-            with open(JOBS_FILE, "r") as f:
-                JOBS = json.load(f)
-            logger.info(f"JOBS loaded from {JOBS_FILE}")
-        except Exception as e:
-            logger.error(f"Error loading JOBS: {e}")
-            JOBS = {}
-    else:
-        logger.info(f"No existing {JOBS_FILE} found, starting fresh")
+# Work queue task that splits and analyzes an uploaded video (see worker.py)
+TASK_ANALYZE_VIDEO = "analyze_video"
+# Length of the chunks a video is split into (the last one may be shorter)
+CHUNK_WINDOW_S = 30
+# How often a running job checks whether it was cancelled (DELETE /jobs/{job_id})
+CANCEL_POLL_S = 2
+FINISHED_STATUSES = ("completed", "partial", "failed")
+
+class JobStopped(Exception):
+    """The job was cancelled, or another worker took it over (lease lost)"""
+
+def get_job_fields(job_id: str, fields):
+    """Return only the requested fields of a job, or None if the job doesn't exist"""
+    return job_store.get_fields(job_id, fields)
+
+def get_chunk_analyses(job_id: str, since_chunk: int = -1, limit: int = 20):
+    """
+    Return (analyses, next_since_chunk) for chunks with chunk_index > since_chunk,
+    ordered by chunk_index. next_since_chunk is None when nothing is left.
+    """
+    if not job_store.exists(job_id):
+        return None
+    pending = sorted(
+        (a for a in job_store.get_list(job_id, "chunk_analyses") if a["chunk_index"] > since_chunk),
+        key=lambda a: a["chunk_index"]
+    )
+    page = pending[:limit]
+    next_since_chunk = page[-1]["chunk_index"] if len(pending) > limit else None
+    return page, next_since_chunk
+
+def probe_duration(video_path: str) -> float:
+    """Video duration in seconds, via ffprobe (raises if it can't be read)"""
+    result = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", video_path],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True
+    )
+    return float(result.stdout)
+
+def run_analyze_video(payload: dict, lease=None):
+    """Work queue handler for TASK_ANALYZE_VIDEO"""
+    video_service.split_video_background(
+        payload["job_id"], payload["video_path"], payload["original_filename"], lease=lease, media_digest=payload.get("media_digest")
+    )
+
+def is_cancelled(job_id: str) -> bool:
+    return bool((job_store.get_fields(job_id, ["cancelled"]) or {}).get("cancelled"))
+
+def cancel_job(job_id: str):
+    """
+    Mark a job cancelled. Returns None if it doesn't exist, False if it had already
+    finished (or was cancelled before); its worker notices within CANCEL_POLL_S and cleans up, and a job still
+    queued is dropped when a worker picks it up.
+    """
+    # Compare and set: a job finishing at the same moment is never marked cancelled
+    cancelled = job_store.update_if(
+        job_id, "analysis_status", FINISHED_STATUSES + ("cancelled",),
+        cancelled=True, split_status="cancelled", analysis_status="cancelled"
+    )
+    if not cancelled:
+        return cancelled
+    logger.info(f"[{datetime.now().isoformat()}] Job {job_id} cancelled")
+    return True
 
-# Load existing jobs on module import
-load_jobs()
+def finish_job(job_id: str, **fields) -> bool:
+    """
+    Final write of a job (status, results), unless it was cancelled meanwhile: a cancel
+    accepted by DELETE /jobs/{job_id} is never overwritten, and the job's media is
+    released instead of kept for its TTL. Returns whether the write was made.
+    """
+    # Conditioned on the cancelled flag, which only cancel_job sets: analysis_status
+    # itself is rewritten by the worker while it runs
+    if job_store.update_if(job_id, "cancelled", (True,), **fields) is False:
+        logger.info(f"[{datetime.now().isoformat()}] Job {job_id} was cancelled before it finished")
+        job_store.update(job_id, split_status="cancelled", analysis_status="cancelled")
+        media_store.release(job_id)
+        return False
+    media_store.finish(job_id)
+    return True
+
+def fail_analyze_video(payload: dict):
+    """The task ran out of attempts (it kept failing, or its workers kept dying): the job won't finish"""
+    finish_job(payload["job_id"], split_status="failed", analysis_status="failed")
 
 class VideoService:
     def __init__(self):
-        # Define paths relative to this file
-        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-        self.splits_dir = os.path.join(base_dir, "media", "splits")
-        self.uploads_dir = os.path.join(base_dir, "media", "uploads")
-        os.makedirs(self.splits_dir, exist_ok=True)
-        os.makedirs(self.uploads_dir, exist_ok=True)
+        # Files are managed by the media store (services/media_store.py)
+        self.splits_dir = media_store.splits_dir
+        self.uploads_dir = media_store.uploads_dir
 
     def sanitize_filename(self, filename: str) -> str:
         # Remove extension first
@@ -55,85 +119,142 @@ class VideoService:
         sanitized = re.sub(r'[^a-zA-Z0-9]', '_', name)
         return sanitized
 
-    def split_video_background(self, job_id: str, video_path: str, original_filename: str):
+    def _watch_job(self, job_id: str, lease, stop_event: threading.Event, done: threading.Event):
+        """Set stop_event once the job is cancelled or the lease is lost"""
+        while not done.wait(CANCEL_POLL_S):
+            if (lease is not None and lease.lost) or is_cancelled(job_id):
+                stop_event.set()
+                return
+
+    def _adopt_upload(self, job_id: str, video_path: str):
+        """(digest, path) of a job queued before uploads were content-addressed"""
+        job = job_store.get_fields(job_id, ["media_digest", "media_path"]) or {}
+        if "media_digest" not in job:
+            digest, path = media_store.add_upload(video_path, hash_file(video_path), os.path.splitext(video_path)[1], job_id)
+            job = {"media_digest": digest, "media_path": path}
+            job_store.update(job_id, **job)
+        return job["media_digest"], job["media_path"]
+
+    @staticmethod
+    def _streamable_chunk(media_digest: str, index: int) -> bool:
+        # Chunks cut before they were fragmented MP4 are cut again
+        if not media_store.has_chunk(media_digest, index):
+            return False
+        try:
+            return fmp4_layout(media_store.chunk_path(media_digest, index)) is not None
+        except OSError:
+            return False
+
+    def split_video_background(self, job_id: str, video_path: str, original_filename: str, lease=None, media_digest: str = None):
+        chunk_paths = []  # Store full paths for analysis
+        if media_digest is None:
+            media_digest, video_path = self._adopt_upload(job_id, video_path)
+        if is_cancelled(job_id):
+            logger.info(f"[{datetime.now().isoformat()}] Job {job_id} was cancelled before it started")
+            media_store.release(job_id)
+            return
+
+        stop_event = threading.Event()
+        watcher_done = threading.Event()
+        threading.Thread(target=self._watch_job, args=(job_id, lease, stop_event, watcher_done), daemon=True).start()
+
+        def check_stopped():
+            if stop_event.is_set():
+                raise JobStopped()
+
         try:
             logger.info(f"[{datetime.now().isoformat()}] Starting split for job {job_id}")
-            JOBS[job_id]["split_status"] = "processing"
-            save_jobs()
+            # A retried task (its previous worker died) starts over
+            job_store.update(
+                job_id, split_status="processing", completed_chunks=0, split_pct=0.0, chunks=[], chunk_durations_s=[],
+                analysis_status="pending", analyzed_chunks=0, analysis_pct=0.0, chunk_analyses=[], structured_segments=[]
+            )
             
             sanitized_name = self.sanitize_filename(original_filename)
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
             
             # Get duration using ffprobe
             try:
-                result = subprocess.run(
-                    ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "default=noprint_wrappers=1:nokey=1", video_path],
-                    stdout=subprocess.PIPE,
-                    stderr=subprocess.PIPE,
-                    text=True
-                )
-                duration = float(result.stdout)
+                duration = probe_duration(video_path)
             except Exception as e:
                 logger.error(f"Error getting duration: {e}")
-                JOBS[job_id]["split_status"] = "failed"
-                JOBS[job_id]["analysis_status"] = "failed"
-                save_jobs()
+                finish_job(job_id, split_status="failed", analysis_status="failed")
                 return
 
-            window = 30
+            window = CHUNK_WINDOW_S
             total_chunks = int(duration // window) + (1 if duration % window > 0 else 0)
             
-            JOBS[job_id]["total_chunks"] = total_chunks
-            save_jobs()
+            job_store.update(job_id, total_chunks=total_chunks, duration_s=duration)
+            
+            # Chunks cut by an earlier job on the same video are reused; the others take
+            # about as much space as the upload (stream copy). Fail now rather than
+            # letting ffmpeg run out of disk halfway through.
+            missing = [i for i in range(total_chunks) if not self._streamable_chunk(media_digest, i)]
+            needed_bytes = os.path.getsize(video_path) * len(missing) // max(total_chunks, 1)
+            if not media_store.ensure_space(needed_bytes):
+                logger.error(f"Not enough disk space to split job {job_id} ({needed_bytes} bytes needed)")
+                finish_job(job_id, split_status="failed", analysis_status="failed")
+                return
+            os.makedirs(os.path.dirname(media_store.chunk_path(media_digest, 0)), exist_ok=True)
             
             chunks = []
-            chunk_paths = []  # Store full paths for analysis
+            # Real length of each chunk (stream copy cuts at keyframes, not at the window)
+            chunk_durations = []
             
             # Step 1: Split all chunks
             logger.info(f"[{datetime.now().isoformat()}] Splitting video into {total_chunks} chunks...")
             for i in range(total_chunks):
+                check_stopped()
                 start_time = i * window
                 end_time = min((i + 1) * window, duration)
                 
-                chunk_filename = f"{sanitized_name}_{timestamp}_chunk_{i+1}.mp4"
-                chunk_path = os.path.join(self.splits_dir, chunk_filename)
+                chunk_filename = f"{sanitized_name}_chunk_{i+1}.mp4"
+                chunk_path = media_store.chunk_path(media_digest, i)
                 
-                # Use ffmpeg to split
-                cmd = [
-                    "ffmpeg", "-y",
-                    "-ss", str(start_time),
-                    "-to", str(end_time),
-                    "-i", video_path,
-                    "-c", "copy",
-                    chunk_path
-                ]
-                
-                subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                if i in missing:
+                    # Use ffmpeg to split (into a temporary file, moved into place once complete).
+                    # Fragmented MP4, so the chunk is also an HLS segment (see hls_playlist)
+                    temp_path = media_store.temp_path(chunk_path)
+                    cmd = [
+                        "ffmpeg", "-y",
+                        "-ss", str(start_time),
+                        "-to", str(end_time),
+                        "-i", video_path,
+                        "-c", "copy",
+                        "-movflags", "+frag_keyframe+empty_moov+default_base_moof",
+                        temp_path
+                    ]
+                    
+                    subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    if os.path.exists(temp_path):
+                        media_store.add_chunk(temp_path, media_digest, i)
+                    else:
+                        logger.warning(f"ffmpeg produced no output for chunk {i+1} of job {job_id}")
                 
+                try:
+                    chunk_durations.append(round(probe_duration(chunk_path), 3))
+                except Exception:
+                    chunk_durations.append(end_time - start_time)
                 chunks.append(chunk_filename)
                 chunk_paths.append(chunk_path)
-                JOBS[job_id]["completed_chunks"] = i + 1
-                JOBS[job_id]["split_pct"] = ((i + 1) / total_chunks) * 100
+                job_store.update(
+                    job_id, completed_chunks=i + 1, split_pct=((i + 1) / total_chunks) * 100, chunk_durations_s=chunk_durations
+                )
                 
-            JOBS[job_id]["chunks"] = chunks
-            JOBS[job_id]["split_status"] = "completed"
-            logger.info(f"[{datetime.now().isoformat()}] Split completed for job {job_id}")
-            save_jobs()
+            job_store.update(job_id, chunks=chunks, split_status="completed")
+            logger.info(f"[{datetime.now().isoformat()}] Split completed for job {job_id} ({total_chunks - len(missing)} chunks reused)")
             
             # Step 2: Analyze chunks with LLM (sequential analysis)
             logger.info(f"[{datetime.now().isoformat()}] Starting LLM analysis for {total_chunks} chunks...")
-            JOBS[job_id]["analysis_status"] = "processing"
-            save_jobs()
+            job_store.update(job_id, analysis_status="processing")
             
-            from services.llm_service import llm_service
+            from services.llm_service import llm_service, AnalysisCancelled
             
             analyzed_count = 0
             failed_count = 0
-            
-            # Prepare structured storage
-            JOBS[job_id].setdefault("structured_segments", [])
+            structured_segments = []
 
             for i, (chunk_filename, chunk_path) in enumerate(zip(chunks, chunk_paths)):
+                check_stopped()
                 chunk_analysis = {
                     "chunk_index": i,
                     "chunk_filename": chunk_filename,
@@ -144,6 +265,7 @@ class VideoService:
                     "submission": None,
                     "error": None
                 }
+                highlights = []
                 
                 try:
                     logger.info(f"[{datetime.now().isoformat()}] Analyzing chunk {i+1}/{total_chunks}: {chunk_filename}")
@@ -152,12 +274,14 @@ class VideoService:
                     # Calculate absolute time window for structured summary
                     start_s = i * window
                     end_s = min((i + 1) * window, duration)
+                    media_store.touch(chunk_path)
 
                     results = llm_service.analyze_chunk(
                         file_path=chunk_path,
                         segment_index=i,
                         start_s=int(start_s),
                         end_s=int(end_s),
+                        cancel_event=stop_event,
                     )
                     
                     # Store results
@@ -168,40 +292,56 @@ class VideoService:
                     chunk_analysis["status"] = "completed"
                     # Store structured segment if available
                     if results.get("segment_summary"):
-                        JOBS[job_id]["structured_segments"].append(results["segment_summary"])
+                        highlights = results["segment_summary"].get("highlights") or []
+                        structured_segments.append(results["segment_summary"])
+                        job_store.append(job_id, "structured_segments", results["segment_summary"])
                     analyzed_count += 1
                     
                     logger.info(f"[{datetime.now().isoformat()}] Chunk {i+1}/{total_chunks} analysis completed")
                     
+                except AnalysisCancelled:
+                    raise JobStopped()
                 except Exception as e:
                     logger.error(f"[{datetime.now().isoformat()}] Analysis failed for chunk {i+1}: {e}")
                     chunk_analysis["status"] = "failed"
                     chunk_analysis["error"] = str(e)
                     failed_count += 1
                 
+                # Sprite sheet + highlight stills for the review page (a failed chunk still gets its sprite)
+                try:
+                    chunk_s = math.ceil(min((i + 1) * window, duration) - i * window)
+                    render_chunk_thumbnails(chunk_path, media_digest, i, chunk_s, highlights)
+                except Exception as e:
+                    logger.warning(f"Thumbnails skipped for chunk {i+1}: {e}")
+                
                 # Add to chunk_analyses list
-                JOBS[job_id]["chunk_analyses"].append(chunk_analysis)
+                job_store.append(job_id, "chunk_analyses", chunk_analysis)
                 
                 # Update progress
-                JOBS[job_id]["analyzed_chunks"] = analyzed_count + failed_count
-                JOBS[job_id]["analysis_pct"] = ((analyzed_count + failed_count) / total_chunks) * 100
-                save_jobs()
+                job_store.update(
+                    job_id,
+                    analyzed_chunks=analyzed_count + failed_count,
+                    analysis_pct=((analyzed_count + failed_count) / total_chunks) * 100
+                )
             
             # Step 3: Determine final analysis status
             if failed_count == 0:
-                JOBS[job_id]["analysis_status"] = "completed"
+                analysis_status = "completed"
             elif failed_count > total_chunks / 2:
-                JOBS[job_id]["analysis_status"] = "failed"
+                analysis_status = "failed"
             else:
-                JOBS[job_id]["analysis_status"] = "partial"
+                analysis_status = "partial"
+            # Stored with the digest below, so a finished job always has one
+            tactical_summary = None
             
             # Step 4: TacticalCoachSummary structured aggregation if we have segments
+            check_stopped()
             try:
-                if JOBS[job_id].get("structured_segments"):
+                if structured_segments:
                     from prompts import generate_tactical_coach_structured_prompt
                     from models.schemas import TacticalCoachSummary
                     prompt = generate_tactical_coach_structured_prompt(
-                        segment_summaries=JOBS[job_id]["structured_segments"]
+                        segment_summaries=structured_segments
                     )
                     coach_response = llm_service.client.models.generate_content(
                         model=llm_service.model,
@@ -211,7 +351,7 @@ class VideoService:
                     raw_json = coach_response.text.strip()
                     try:
                         tactical = TacticalCoachSummary.model_validate_json(raw_json)
-                        JOBS[job_id]["tactical_summary"] = tactical.model_dump()
+                        tactical_summary = tactical.model_dump()
                     except Exception as e_json:
                         # Attempt correction
                         correction_prompt = prompt + f"\nEl JSON anterior fue inválido ({e_json}). Devuelve SOLO JSON corregido."
@@ -223,20 +363,40 @@ class VideoService:
                         raw_json = coach_response.text.strip()
                         try:
                             tactical = TacticalCoachSummary.model_validate_json(raw_json)
-                            JOBS[job_id]["tactical_summary"] = tactical.model_dump()
+                            tactical_summary = tactical.model_dump()
                         except Exception:
-                            JOBS[job_id]["tactical_summary_error"] = raw_json[:400]
-                save_jobs()
+                            job_store.update(job_id, tactical_summary_error=raw_json[:400])
             except Exception as e:
                 logger.error(f"Failed TacticalCoachSummary aggregation: {e}")
 
+            # Step 5: Compact digest used as the default chat context for this job
+            from services.context_digest import build_context_digest
+            context_digest = build_context_digest(structured_segments, tactical_summary, total_chunks, analysis_status)
+            finished = {"analysis_status": analysis_status, "context_digest": context_digest}
+            if tactical_summary is not None:
+                finished["tactical_summary"] = tactical_summary
+            if not finish_job(job_id, **finished):
+                return
+            # Answers cached over the previous analysis are stale now
+            from services.answer_cache import answer_cache
+            answer_cache.invalidate(job_id)
+
             logger.info(f"[{datetime.now().isoformat()}] Analysis completed for job {job_id}: {analyzed_count} succeeded, {failed_count} failed")
-            save_jobs()
             
+        except JobStopped:
+            if is_cancelled(job_id):
+                # Pending chunks are dropped; the split files and the upload go too unless
+                # another job uses the same video
+                logger.info(f"[{datetime.now().isoformat()}] Job {job_id} stopped after cancellation")
+                job_store.update(job_id, split_status="cancelled", analysis_status="cancelled")
+                media_store.release(job_id)
+            else:
+                # Another worker has taken over the job and will redo it
+                logger.warning(f"[{datetime.now().isoformat()}] Lease lost, abandoning job {job_id}")
         except Exception as e:
             logger.error(f"[{datetime.now().isoformat()}] Error in split_video_background: {e}")
-            JOBS[job_id]["split_status"] = "failed"
-            JOBS[job_id]["analysis_status"] = "failed"
-            save_jobs()
+            finish_job(job_id, split_status="failed", analysis_status="failed")
+        finally:
+            watcher_done.set()
 
 video_service = VideoService()
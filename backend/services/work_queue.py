@@ -0,0 +1,514 @@
+import os
+import json
+import socket
+import threading
+import time
+import uuid
+import logging
+
+from services.job_store import JOB_STORE_URL, connect_redis, connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+# Lease-based work queue on the same backend as the job store (JOB_STORE_URL).
+# A worker claims a task for lease_s seconds and renews the lease (heartbeat) while it
+# runs; if the worker dies the lease expires and another worker claims the task again.
+# Only the current lease owner can renew, complete or fail a task, so a worker that
+# lost its lease (stalled past the expiry) can't overwrite the new owner's outcome.
+# Tasks are retried up to max_attempts times, then dead-lettered.
+#
+# Claim order (pick_task): tenants with fewer running tasks first (fair share), then
+# the lowest priority value (the video duration: short clips before long sessions),
+# aged by the time the task has waited so long videos aren't starved.
+
+WORK_LEASE_S = int(os.getenv("WORK_LEASE_S", "60"))
+WORK_MAX_ATTEMPTS = int(os.getenv("WORK_MAX_ATTEMPTS", "3"))
+WORK_POLL_S = float(os.getenv("WORK_POLL_S", "1.0"))
+# Priority units (seconds of video) a task gains per second waiting
+WORK_PRIORITY_AGING = float(os.getenv("WORK_PRIORITY_AGING", "2.0"))
+# Tasks of one tenant running at the same time (0 = no limit)
+WORK_MAX_RUNNING_PER_TENANT = int(os.getenv("WORK_MAX_RUNNING_PER_TENANT", "0"))
+DEFAULT_TENANT = "default"
+CLAIM_RETRIES = 10
+# Runnable tasks considered per claim by the Redis queue (earliest first)
+CLAIM_SCAN = 200
+
+def _task(task_id: str, kind: str, payload, status: str, attempts: int, owner: str = "", error: str = None,
+          tenant: str = DEFAULT_TENANT, priority: float = 0.0) -> dict:
+    return {
+        "task_id": task_id, "kind": kind, "payload": payload, "status": status, "attempts": attempts,
+        "owner": owner, "error": error, "tenant": tenant, "priority": priority,
+    }
+
+def effective_priority(candidate: dict, now: float, aging: float = WORK_PRIORITY_AGING) -> float:
+    return candidate["priority"] - (now - candidate["created_at"]) * aging
+
+def pick_task(candidates: list, running: dict, now: float, max_running_per_tenant: int = WORK_MAX_RUNNING_PER_TENANT):
+    """
+    Next task to run among runnable candidates (dicts with tenant, priority, created_at),
+    given the running task count per tenant; None if every tenant is at its limit
+    """
+    eligible = [
+        c for c in candidates
+        if not max_running_per_tenant or running.get(c["tenant"], 0) < max_running_per_tenant
+    ]
+    if not eligible:
+        return None
+    return min(eligible, key=lambda c: (running.get(c["tenant"], 0), effective_priority(c, now), c["created_at"]))
+
+
+class SQLiteWorkQueue:
+    def __init__(self, path: str, max_attempts: int = WORK_MAX_ATTEMPTS):
+        self.path = path
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        conn = self._conn()
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS work_tasks (
+                task_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                -- queued | leased | done | dead
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                owner TEXT NOT NULL DEFAULT '',
+                -- queued: when it can run; leased: when the lease expires
+                visible_at REAL NOT NULL,
+                created_at REAL NOT NULL,
+                error TEXT
+            );
+        """)
+        # Columns added after the table was first shipped
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(work_tasks)")}
+        for column, definition in (("tenant", f"TEXT NOT NULL DEFAULT '{DEFAULT_TENANT}'"), ("priority", "REAL NOT NULL DEFAULT 0"),
+                                   ("started_at", "REAL"), ("finished_at", "REAL")):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE work_tasks ADD COLUMN {column} {definition}")
+        conn.execute("CREATE INDEX IF NOT EXISTS work_tasks_ready ON work_tasks (status, visible_at)")
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.path)
+        return conn
+
+    def enqueue(self, kind: str, payload: dict, delay_s: float = 0, tenant: str = DEFAULT_TENANT, priority: float = 0.0) -> str:
+        task_id = str(uuid.uuid4())
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT INTO work_tasks (task_id, kind, payload, status, visible_at, created_at, tenant, priority) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?, ?)",
+                (task_id, kind, json.dumps(payload), now + delay_s, now, tenant, priority)
+            )
+        return task_id
+
+    def claim(self, worker_id: str, lease_s: float = WORK_LEASE_S):
+        """
+        Lease the next runnable task (queued, or leased with an expired lease). A task out
+        of attempts is dead-lettered and returned with status "dead" so the caller can
+        record the failure. None if there is nothing to run.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            now = time.time()
+            # Best runnable task of each tenant, then pick_task across tenants
+            rows = conn.execute(
+                "SELECT task_id, kind, payload, attempts, tenant, priority, created_at FROM ("
+                "  SELECT *, ROW_NUMBER() OVER (PARTITION BY tenant ORDER BY priority - (? - created_at) * ?, created_at) AS rn"
+                "  FROM work_tasks WHERE status IN ('queued', 'leased') AND visible_at <= ?"
+                ") WHERE rn = 1",
+                (now, WORK_PRIORITY_AGING, now)
+            ).fetchall()
+            candidates = [
+                {"task_id": r[0], "kind": r[1], "payload": r[2], "attempts": r[3], "tenant": r[4], "priority": r[5], "created_at": r[6]}
+                for r in rows
+            ]
+            running = dict(conn.execute(
+                "SELECT tenant, COUNT(*) FROM work_tasks WHERE status = 'leased' AND visible_at > ? GROUP BY tenant", (now,)
+            ).fetchall())
+            c = pick_task(candidates, running, now)
+            if c is None:
+                return None
+            if c["attempts"] >= self.max_attempts:
+                conn.execute("UPDATE work_tasks SET status = 'dead', owner = '' WHERE task_id = ?", (c["task_id"],))
+                return _task(c["task_id"], c["kind"], json.loads(c["payload"]), "dead", c["attempts"], tenant=c["tenant"], priority=c["priority"])
+            conn.execute(
+                "UPDATE work_tasks SET status = 'leased', owner = ?, attempts = attempts + 1, visible_at = ?, started_at = ? WHERE task_id = ?",
+                (worker_id, now + lease_s, now, c["task_id"])
+            )
+        return _task(c["task_id"], c["kind"], json.loads(c["payload"]), "leased", c["attempts"] + 1, worker_id, tenant=c["tenant"], priority=c["priority"])
+
+    def heartbeat(self, task_id: str, worker_id: str, lease_s: float = WORK_LEASE_S) -> bool:
+        """Renew the lease; False if the worker no longer owns the task"""
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE work_tasks SET visible_at = ? WHERE task_id = ? AND owner = ? AND status = 'leased'",
+                (time.time() + lease_s, task_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def complete(self, task_id: str, worker_id: str) -> bool:
+        with self._conn() as conn:
+            cursor = conn.execute(
+                "UPDATE work_tasks SET status = 'done', owner = '', finished_at = ? WHERE task_id = ? AND owner = ? AND status = 'leased'",
+                (time.time(), task_id, worker_id)
+            )
+        return cursor.rowcount == 1
+
+    def fail(self, task_id: str, worker_id: str, error: str, retry_delay_s: float = 0):
+        """
+        Release a failed task: back to the queue if it has attempts left, else dead.
+        Returns the new status ("queued" or "dead"), or None if worker_id lost the lease.
+        """
+        conn = self._conn()
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute(
+                "SELECT attempts FROM work_tasks WHERE task_id = ? AND owner = ? AND status = 'leased'", (task_id, worker_id)
+            ).fetchone()
+            if row is None:
+                return None
+            status = "queued" if row[0] < self.max_attempts else "dead"
+            conn.execute(
+                "UPDATE work_tasks SET status = ?, owner = '', visible_at = ?, error = ? WHERE task_id = ?",
+                (status, time.time() + retry_delay_s, error[:1000], task_id)
+            )
+        return status
+
+    def get(self, task_id: str):
+        row = self._conn().execute(
+            "SELECT task_id, kind, payload, status, attempts, owner, error, tenant, priority FROM work_tasks WHERE task_id = ?", (task_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        return _task(row[0], row[1], json.loads(row[2]), *row[3:])
+
+    def stats(self) -> dict:
+        """Queue depth (waiting and running tasks, overall and per tenant) and recent run times"""
+        now = time.time()
+        conn = self._conn()
+        by_tenant = {}
+        for tenant, queued, running in conn.execute(
+            "SELECT tenant, SUM(status = 'queued' OR (status = 'leased' AND visible_at <= ?)), "
+            "SUM(status = 'leased' AND visible_at > ?) FROM work_tasks WHERE status IN ('queued', 'leased') GROUP BY tenant",
+            (now, now)
+        ):
+            by_tenant[tenant] = {"queued": queued, "running": running}
+        oldest, = conn.execute("SELECT MIN(created_at) FROM work_tasks WHERE status = 'queued'").fetchone()
+        counts = dict(conn.execute("SELECT status, COUNT(*) FROM work_tasks WHERE status IN ('done', 'dead') GROUP BY status"))
+        avg_run_s, = conn.execute(
+            "SELECT AVG(finished_at - started_at) FROM (SELECT finished_at, started_at FROM work_tasks "
+            "WHERE status = 'done' AND started_at IS NOT NULL ORDER BY finished_at DESC LIMIT 20)"
+        ).fetchone()
+        return _stats(by_tenant, now - oldest if oldest else None, counts.get("done", 0), counts.get("dead", 0), avg_run_s)
+
+
+def _stats(by_tenant: dict, oldest_queued_s, done: int, dead: int, avg_run_s) -> dict:
+    return {
+        "queued": sum(t["queued"] for t in by_tenant.values()),
+        "running": sum(t["running"] for t in by_tenant.values()),
+        "done": done,
+        "dead": dead,
+        "oldest_queued_s": round(oldest_queued_s, 1) if oldest_queued_s is not None else None,
+        "avg_run_s": round(avg_run_s, 1) if avg_run_s is not None else None,
+        "by_tenant": {tenant: counts for tenant, counts in by_tenant.items() if counts["queued"] or counts["running"]},
+    }
+
+
+class RedisWorkQueue:
+    """
+    Runnable tasks are members of the sorted set work:queue scored by the time they
+    become claimable (for a leased task, its lease expiry); task data lives in the hash
+    work:task:{id}. Claims and lease changes are WATCH/MULTI transactions. Per-tenant
+    queued/running counts and totals are counter hashes updated in those transactions.
+    """
+
+    QUEUE_KEY = "work:queue"
+    QUEUED_KEY = "work:queued"
+    RUNNING_KEY = "work:running"
+    TOTALS_KEY = "work:totals"
+
+    def __init__(self, url: str, max_attempts: int = WORK_MAX_ATTEMPTS):
+        self.client, self.WatchError = connect_redis(url)
+        self.max_attempts = max_attempts
+
+    @staticmethod
+    def _key(task_id: str) -> str:
+        return f"work:task:{task_id}"
+
+    def enqueue(self, kind: str, payload: dict, delay_s: float = 0, tenant: str = DEFAULT_TENANT, priority: float = 0.0) -> str:
+        task_id = str(uuid.uuid4())
+        now = time.time()
+        with self.client.pipeline() as pipe:
+            pipe.hset(self._key(task_id), mapping={
+                "kind": kind, "payload": json.dumps(payload), "status": "queued", "attempts": 0, "owner": "",
+                "created_at": now, "tenant": tenant, "priority": priority,
+            })
+            pipe.zadd(self.QUEUE_KEY, {task_id: now + delay_s})
+            pipe.hincrby(self.QUEUED_KEY, tenant, 1)
+            pipe.execute()
+        return task_id
+
+    def _candidates(self, task_ids: list) -> list:
+        # Plain reads outside the transaction: they only steer the choice, the claim itself is watched
+        with self.client.pipeline(transaction=False) as reads:
+            for task_id in task_ids:
+                reads.hmget(self._key(task_id), ["tenant", "priority", "created_at"])
+            rows = reads.execute()
+        return [
+            {"task_id": task_id, "tenant": tenant, "priority": float(priority), "created_at": float(created_at)}
+            for task_id, (tenant, priority, created_at) in zip(task_ids, rows) if tenant is not None
+        ]
+
+    def claim(self, worker_id: str, lease_s: float = WORK_LEASE_S):
+        for _ in range(CLAIM_RETRIES):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(self.QUEUE_KEY)
+                    now = time.time()
+                    ready = pipe.zrangebyscore(self.QUEUE_KEY, "-inf", now, start=0, num=CLAIM_SCAN)
+                    if not ready:
+                        return None
+                    running = {tenant: int(n) for tenant, n in self.client.hgetall(self.RUNNING_KEY).items()}
+                    c = pick_task(self._candidates(ready), running, now)
+                    if c is None:
+                        return None
+                    task_id, tenant = c["task_id"], c["tenant"]
+                    data = pipe.hgetall(self._key(task_id))
+                    attempts = int(data.get("attempts", 0))
+                    was_queued = data.get("status") == "queued"
+                    pipe.multi()
+                    # An expired lease was counted as running, a queued task as queued
+                    pipe.hincrby(self.QUEUED_KEY if was_queued else self.RUNNING_KEY, tenant, -1)
+                    if attempts >= self.max_attempts:
+                        pipe.zrem(self.QUEUE_KEY, task_id)
+                        pipe.hset(self._key(task_id), mapping={"status": "dead", "owner": ""})
+                        pipe.hincrby(self.TOTALS_KEY, "dead", 1)
+                        pipe.execute()
+                        return _task(task_id, data["kind"], json.loads(data["payload"]), "dead", attempts, tenant=tenant, priority=c["priority"])
+                    pipe.zadd(self.QUEUE_KEY, {task_id: now + lease_s})
+                    pipe.hset(self._key(task_id), mapping={"status": "leased", "owner": worker_id, "attempts": attempts + 1, "started_at": now})
+                    pipe.hincrby(self.RUNNING_KEY, tenant, 1)
+                    pipe.execute()
+                    return _task(task_id, data["kind"], json.loads(data["payload"]), "leased", attempts + 1, worker_id, tenant=tenant, priority=c["priority"])
+                except self.WatchError:
+                    # Another worker changed the queue meanwhile; look again
+                    continue
+        return None
+
+    def _if_owner(self, task_id: str, worker_id: str, apply) -> bool:
+        """Run apply(pipe, task) in a transaction if worker_id still holds the lease"""
+        for _ in range(CLAIM_RETRIES):
+            with self.client.pipeline() as pipe:
+                try:
+                    pipe.watch(self._key(task_id))
+                    task = pipe.hgetall(self._key(task_id))
+                    if task.get("status") != "leased" or task.get("owner") != worker_id:
+                        return False
+                    pipe.multi()
+                    apply(pipe, task)
+                    pipe.execute()
+                    return True
+                except self.WatchError:
+                    continue
+        return False
+
+    def heartbeat(self, task_id: str, worker_id: str, lease_s: float = WORK_LEASE_S) -> bool:
+        def renew(pipe, task):
+            pipe.zadd(self.QUEUE_KEY, {task_id: time.time() + lease_s})
+            # Written so that a concurrent claim of this task (which also writes the hash) conflicts
+            pipe.hset(self._key(task_id), "owner", worker_id)
+        return self._if_owner(task_id, worker_id, renew)
+
+    def complete(self, task_id: str, worker_id: str) -> bool:
+        def done(pipe, task):
+            pipe.zrem(self.QUEUE_KEY, task_id)
+            pipe.hset(self._key(task_id), mapping={"status": "done", "owner": ""})
+            pipe.hincrby(self.RUNNING_KEY, task["tenant"], -1)
+            pipe.hincrby(self.TOTALS_KEY, "done", 1)
+            pipe.hincrby(self.TOTALS_KEY, "run_ms", int((time.time() - float(task["started_at"])) * 1000))
+        return self._if_owner(task_id, worker_id, done)
+
+    def fail(self, task_id: str, worker_id: str, error: str, retry_delay_s: float = 0):
+        released = {}
+
+        def release(pipe, task):
+            pipe.hincrby(self.RUNNING_KEY, task["tenant"], -1)
+            if int(task["attempts"]) < self.max_attempts:
+                pipe.zadd(self.QUEUE_KEY, {task_id: time.time() + retry_delay_s})
+                pipe.hset(self._key(task_id), mapping={"status": "queued", "owner": "", "error": error[:1000]})
+                pipe.hincrby(self.QUEUED_KEY, task["tenant"], 1)
+                released["status"] = "queued"
+            else:
+                pipe.zrem(self.QUEUE_KEY, task_id)
+                pipe.hset(self._key(task_id), mapping={"status": "dead", "owner": "", "error": error[:1000]})
+                pipe.hincrby(self.TOTALS_KEY, "dead", 1)
+                released["status"] = "dead"
+        return released["status"] if self._if_owner(task_id, worker_id, release) else None
+
+    def get(self, task_id: str):
+        data = self.client.hgetall(self._key(task_id))
+        if not data:
+            return None
+        return _task(
+            task_id, data["kind"], json.loads(data["payload"]), data["status"], int(data["attempts"]), data["owner"],
+            data.get("error"), data["tenant"], float(data["priority"])
+        )
+
+    def stats(self) -> dict:
+        with self.client.pipeline(transaction=False) as reads:
+            reads.hgetall(self.QUEUED_KEY)
+            reads.hgetall(self.RUNNING_KEY)
+            reads.hgetall(self.TOTALS_KEY)
+            reads.zrangebyscore(self.QUEUE_KEY, "-inf", "+inf", start=0, num=1)
+            queued, running, totals, first = reads.execute()
+        by_tenant = {
+            tenant: {"queued": int(queued.get(tenant, 0)), "running": int(running.get(tenant, 0))}
+            for tenant in set(queued) | set(running)
+        }
+        # Approximation: the task that became claimable first
+        oldest = self.client.hget(self._key(first[0]), "created_at") if first else None
+        done = int(totals.get("done", 0))
+        return _stats(
+            by_tenant, time.time() - float(oldest) if oldest else None, done, int(totals.get("dead", 0)),
+            int(totals.get("run_ms", 0)) / 1000 / done if done else None
+        )
+
+
+def open_work_queue(url: str = JOB_STORE_URL):
+    if url.startswith("sqlite:///"):
+        return SQLiteWorkQueue(url[len("sqlite:///"):])
+    if url.startswith(("redis://", "rediss://", "unix://", "memory://")):
+        return RedisWorkQueue(url)
+    raise ValueError(f"Unsupported JOB_STORE_URL: {url}")
+
+
+class Lease:
+    """Handed to task handlers: `lost` turns True once another worker may own the task"""
+
+    def __init__(self, queue, task: dict, worker_id: str, lease_s: float):
+        self.queue = queue
+        self.task = task
+        self.worker_id = worker_id
+        self.lease_s = lease_s
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._renew, name=f"lease-{task['task_id'][:8]}", daemon=True)
+
+    def _renew(self):
+        # Renew well before expiry so a slow heartbeat doesn't lose the lease
+        while not self._stop.wait(self.lease_s / 3):
+            try:
+                if not self.queue.heartbeat(self.task["task_id"], self.worker_id, self.lease_s):
+                    logger.warning(f"Lost the lease on task {self.task['task_id']}")
+                    self.lost = True
+                    return
+            except Exception as e:
+                logger.error(f"Heartbeat failed for task {self.task['task_id']}: {e}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+class Worker:
+    """
+    Claims tasks from the queue and runs handlers[kind](payload, lease) while renewing
+    the lease. on_dead[kind](payload) is called for tasks that ran out of attempts.
+    """
+
+    def __init__(self, queue, handlers: dict, on_dead: dict = None, worker_id: str = None,
+                 lease_s: float = WORK_LEASE_S, poll_s: float = WORK_POLL_S):
+        self.queue = queue
+        self.handlers = handlers
+        self.on_dead = on_dead or {}
+        self.worker_id = worker_id or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.lease_s = lease_s
+        self.poll_s = poll_s
+        self.busy = False
+
+    def run_once(self) -> bool:
+        """Claim and run one task; False if there was nothing to run"""
+        task = self.queue.claim(self.worker_id, self.lease_s)
+        if task is None:
+            return False
+        kind, task_id = task["kind"], task["task_id"]
+        if task["status"] == "dead":
+            self._dead_letter(task)
+            return True
+        handler = self.handlers.get(kind)
+        if handler is None:
+            self._fail(task, f"No handler for task kind {kind}", retry_delay_s=self.lease_s)
+            return True
+
+        logger.info(f"Worker {self.worker_id} running task {task_id} ({kind}, tenant {task['tenant']}), attempt {task['attempts']}")
+        self.busy = True
+        try:
+            with Lease(self.queue, task, self.worker_id, self.lease_s) as lease:
+                handler(task["payload"], lease)
+        except Exception as e:
+            logger.error(f"Task {task_id} ({kind}) failed: {e}")
+            self._fail(task, str(e), retry_delay_s=self.poll_s)
+            return True
+        finally:
+            self.busy = False
+        if not self.queue.complete(task_id, self.worker_id):
+            logger.warning(f"Task {task_id} finished after its lease was lost; another worker owns it now")
+        return True
+
+    def _fail(self, task: dict, error: str, retry_delay_s: float):
+        # The last attempt's failure dead-letters the task here rather than in claim()
+        if self.queue.fail(task["task_id"], self.worker_id, error, retry_delay_s=retry_delay_s) == "dead":
+            self._dead_letter(task)
+
+    def _dead_letter(self, task: dict):
+        """Record the failure of a task that ran out of attempts (on_dead[kind])"""
+        logger.error(f"Task {task['task_id']} ({task['kind']}) dead-lettered after {task['attempts']} attempts")
+        if task["kind"] in self.on_dead:
+            self.on_dead[task["kind"]](task["payload"])
+
+    def run(self, stop: threading.Event):
+        logger.info(f"Worker {self.worker_id} started")
+        while not stop.is_set():
+            try:
+                if not self.run_once():
+                    stop.wait(self.poll_s)
+            except Exception as e:
+                logger.error(f"Worker {self.worker_id} error: {e}")
+                stop.wait(self.poll_s)
+        logger.info(f"Worker {self.worker_id} stopped")
+
+
+class WorkerPool:
+    """A fixed number of Worker threads, separate from the threads serving requests"""
+
+    def __init__(self, queue, handlers: dict, on_dead: dict = None, size: int = 1):
+        self.workers = [Worker(queue, handlers, on_dead) for _ in range(size)]
+        self.stop = threading.Event()
+        self._threads = []
+
+    def start(self):
+        for i, worker in enumerate(self.workers):
+            thread = threading.Thread(target=worker.run, args=(self.stop,), name=f"worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def shutdown(self, wait: bool = False):
+        # A task interrupted here is picked up by another worker once its lease expires
+        self.stop.set()
+        if wait:
+            for thread in self._threads:
+                while thread.is_alive():
+                    thread.join(timeout=1)
+
+    def stats(self) -> dict:
+        return {"size": len(self.workers), "busy": sum(1 for w in self.workers if w.busy)}
+
+
+work_queue = open_work_queue()
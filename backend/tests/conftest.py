@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The backend imports its modules as top-level packages (services.*, models.*)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the module-level job store in memory (no jobs.db next to the tests)
+os.environ.setdefault("JOB_STORE_URL", "memory://")
@@ -0,0 +1,66 @@
+import pytest
+
+from services.answer_cache import AnswerCache, best_match, normalize_question, question_fingerprint
+from services.job_store import open_job_store
+
+
+def _entry(question: str) -> dict:
+    normalized = normalize_question(question)
+    return {"fingerprint": question_fingerprint(normalized), "question": normalized}
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("How did fighter A defend the takedowns?", "How did fighter B defend the takedowns?"),
+    ("What were the main errors in round 1?", "What were the main errors in round 2?"),
+    ("Did A submit B?", "Did B submit A?"),
+    ("Did Silva submit Jones?", "Did Jones submit Silva?"),
+])
+def test_different_questions_do_not_match(cached, asked):
+    entry, score = best_match(normalize_question(asked), [_entry(cached)])
+    assert entry is None and score == 0.0
+
+
+def test_swapped_names_have_different_fingerprints():
+    assert question_fingerprint(normalize_question("Did A submit B?")) != question_fingerprint(normalize_question("Did B submit A?"))
+
+
+def test_single_letters_and_numbers_are_kept():
+    assert normalize_question("¿Qué hizo el peleador A en el round 2?") == "hizo peleador a round 2"
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("What were the main errors?", "main errors?"),
+    ("What were the main errors of fighter A in round 2?", "Main errors of fighter A in round 2, please"),
+    ("Main errors of fighter A in the clinch exchanges?", "Main errors of fighter A in the clinch exchange?"),
+])
+def test_rephrased_questions_match(cached, asked):
+    entry, score = best_match(normalize_question(asked), [_entry(cached)])
+    assert entry is not None and score >= 0.9
+
+
+@pytest.fixture(params=["sqlite", "memory"])
+def store(request, tmp_path):
+    # memory:// stores share one client per process: a fresh URL gives a fresh store
+    url = f"sqlite:///{tmp_path / 'jobs.db'}" if request.param == "sqlite" else f"memory://{tmp_path.name}"
+    store = open_job_store(url)
+    store.create("job", {"status": "completed"})
+    return store
+
+
+def test_lookup_misses_on_other_round(store):
+    cache = AnswerCache(store)
+    cache.store("job", "What happened in round 1?", "v1", "A takedown", 1200)
+    assert cache.lookup("job", "What happened in round 2?", "v1") is None
+    assert cache.lookup("job", "what happened in round 1", "v1")["answer"] == "A takedown"
+    assert cache.get_stats("job")["hits"] == 1
+
+
+def test_entries_and_counters_are_shared_through_the_store(store):
+    AnswerCache(store).store("job", "What happened in round 1?", "v1", "A takedown", 1200)
+    other = AnswerCache(store)
+    assert other.lookup("job", "What happened in round 1?", "v1")["answer"] == "A takedown"
+    assert other.lookup("job", "What happened in round 1?", "v2") is None
+    stats = AnswerCache(store).get_stats("job")
+    assert (stats["hits"], stats["misses"], stats["latency_saved_ms"], stats["cached_answers"]) == (1, 1, 1200, 1)
+    other.invalidate("job")
+    assert AnswerCache(store).get_stats("job")["cached_answers"] == 0
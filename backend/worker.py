@@ -0,0 +1,38 @@
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+import argparse
+import signal
+import logging
+from services.video_service import TASK_ANALYZE_VIDEO, run_analyze_video, fail_analyze_video
+from services.work_queue import WorkerPool, work_queue
+
+logger = logging.getLogger(__name__)
+
+# Video processing workers. The API process runs a pool of API_WORKER_THREADS of
+# them, separate from the threads serving requests; more capacity (on this host or
+# others sharing JOB_STORE_URL and the media directory) comes from running this script:
+#   python worker.py --workers 2
+
+API_WORKER_THREADS = int(os.getenv("API_WORKER_THREADS", "2"))
+
+TASK_HANDLERS = {TASK_ANALYZE_VIDEO: run_analyze_video}
+DEAD_TASK_HANDLERS = {TASK_ANALYZE_VIDEO: fail_analyze_video}
+
+def create_pool(size: int) -> WorkerPool:
+    return WorkerPool(work_queue, TASK_HANDLERS, DEAD_TASK_HANDLERS, size=size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run video processing workers")
+    parser.add_argument("--workers", type=int, default=1, help="Worker threads in this process")
+    args = parser.parse_args()
+
+    pool = create_pool(args.workers)
+    signal.signal(signal.SIGTERM, lambda *_: pool.stop.set())
+    signal.signal(signal.SIGINT, lambda *_: pool.stop.set())
+    pool.start()
+    while not pool.stop.wait(1):
+        pass
+    pool.shutdown(wait=True)
+    logger.info("Workers stopped")
@@ -0,0 +1,63 @@
+import json
+from shared import db_service
+from shared.context_index import build_index, context_index_key
+from shared.context_digest import build_context_digest
+from llm_service import llm_service
+from handler import get_s3, BUCKET_NAME
+
+# Fan-in step: one message per job, sent by the analyzer that saw analyzed_chunks
+# reach total_chunks. Runs from the analyzer image with a different CMD.
+
+def build_context_index(job_id):
+    """BM25 index over the chunk analyses, used by /agent/{job_id} to pick relevant chunks"""
+    index = build_index(db_service.list_chunk_analyses(job_id, consistent=True))
+    get_s3().put_object(
+        Bucket=BUCKET_NAME,
+        Key=context_index_key(job_id),
+        Body=json.dumps(index, ensure_ascii=False).encode("utf-8"),
+        ContentType="application/json"
+    )
+    print(f"Context index for job {job_id}: {len(index['docs'])} chunks, {index['full_tokens']} tokens in full")
+
+def aggregate_job(job_id):
+    job = db_service.get_job_fields(job_id, ["job_id", "analysis_status", "total_chunks", "tactical_summary", "cancelled"])
+    if not job:
+        print(f"Job {job_id} not found, skipping aggregation")
+        return
+    if job.get("cancelled"):
+        print(f"Job {job_id} was cancelled, skipping aggregation")
+        return
+    if "tactical_summary" in job:
+        print(f"Job {job_id} already aggregated, skipping")
+        return
+    
+    # Before the summary: if this fails the message is retried and the index rebuilt
+    build_context_index(job_id)
+    
+    # Strongly consistent so the last chunk's result is always included
+    segments = db_service.get_segment_summaries(job_id, consistent=True)
+    if not segments:
+        print(f"Job {job_id} has no segment summaries, nothing to aggregate")
+        db_service.save_tactical_summary(job_id, error="No segment summaries available")
+        return
+    
+    print(f"Aggregating {len(segments)} segment summaries for job {job_id}")
+    tactical = llm_service.summarize_job(segments)
+    tactical = tactical.model_dump(mode="json") if tactical else None
+    # Default chat context for /agent/{job_id}, stored with the summary in the same update
+    digest = build_context_digest(segments, tactical, job.get("total_chunks"), job.get("analysis_status"))
+    if tactical:
+        db_service.save_tactical_summary(job_id, tactical, context_digest=digest)
+    else:
+        db_service.save_tactical_summary(job_id, error="TacticalCoachSummary could not be parsed", context_digest=digest)
+
+def lambda_handler(event, context):
+    failures = []
+    for record in event['Records']:
+        try:
+            body = json.loads(record['body'])
+            aggregate_job(body['job_id'])
+        except Exception as e:
+            print(f"Error aggregating record {record['messageId']}: {e}")
+            failures.append({"itemIdentifier": record['messageId']})
+    return {"batchItemFailures": failures}
@@ -1,67 +1,231 @@
 import json
 import boto3
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from shared import db_service
-from llm_service import llm_service
+from llm_service import llm_service, AnalysisCancelled
+from prompts import get_prompt_version
+from s3_stream import open_s3_object
+from shared.lazy import lazy_init
 
-# Initialize clients
+# Initialize clients on first use
 aws_endpoint = os.getenv("AWS_ENDPOINT_URL")
-if aws_endpoint:
-    s3 = boto3.client('s3', endpoint_url=aws_endpoint)
-else:
-    s3 = boto3.client('s3')
+
+@lazy_init("s3_client")
+def get_s3():
+    if aws_endpoint:
+        return boto3.client('s3', endpoint_url=aws_endpoint)
+    return boto3.client('s3')
+
+@lazy_init("sqs_client")
+def get_sqs():
+    if aws_endpoint:
+        return boto3.client('sqs', endpoint_url=aws_endpoint)
+    return boto3.client('sqs')
 
 BUCKET_NAME = os.getenv('BUCKET_NAME')
+AGGREGATION_QUEUE_URL = os.getenv('AGGREGATION_QUEUE_URL')
+# Chunk length used by the splitter, for messages that don't carry start_s/end_s
+WINDOW_S = 30
 
-def lambda_handler(event, context):
-    print(f"Received event: {json.dumps(event)}")
-    for record in event['Records']:
+# Message groups of one batch analyzed at the same time (records of a group run in order)
+RECORD_CONCURRENCY = int(os.getenv("ANALYZER_RECORD_CONCURRENCY", "5"))
+# Stop waiting for records this long before the Lambda timeout...
+TIMEOUT_MARGIN_MS = int(os.getenv("ANALYZER_TIMEOUT_MARGIN_MS", "30000"))
+# ...and give cancelled records this long to reach a step boundary
+CANCEL_GRACE_S = 5
+# Running analyses check whether their job was cancelled (DELETE /jobs/{job_id}) this often
+CANCEL_POLL_S = int(os.getenv("ANALYZER_CANCEL_POLL_S", "5"))
+# Must match maxReceiveCount of the AnalysisQueue redrive policy
+MAX_RECEIVE_COUNT = int(os.getenv("ANALYSIS_MAX_RECEIVE_COUNT", "3"))
+# Used when running the handler outside Lambda (no context)
+DEFAULT_REMAINING_MS = 900 * 1000
+
+def request_aggregation(job_id):
+    """Enqueue the job-level TacticalCoachSummary (fan-in) step"""
+    get_sqs().send_message(QueueUrl=AGGREGATION_QUEUE_URL, MessageBody=json.dumps({"job_id": job_id}))
+    print(f"All chunks of job {job_id} analyzed, aggregation requested")
+
+def record_chunk_result(job_id, chunk_result):
+    """Count the chunk and trigger the aggregation when it was the last one"""
+    progress = db_service.update_analysis_progress(job_id, chunk_result)
+    if progress is None:
+        # Already counted by an earlier delivery, which may have died before
+        # enqueueing the aggregation: request it again (the aggregator is idempotent)
+        job = db_service.get_job_fields(job_id, ["job_id", "analysis_status", "tactical_summary"])
+        if job and job.get("analysis_status") in ("completed", "partial", "failed") and "tactical_summary" not in job:
+            request_aggregation(job_id)
+    elif progress["completed"]:
+        request_aggregation(job_id)
+
+def drop_cancelled_chunk(job_id, chunk_index, chunk_s3_key, prompt_version):
+    """Delete what a chunk of a cancelled job left behind: its Gemini upload and S3 object"""
+    upload = db_service.get_chunk_steps(job_id, chunk_index, prompt_version).get("upload")
+    if upload:
+        llm_service.delete_uploaded_file(upload)
+    get_s3().delete_object(Bucket=BUCKET_NAME, Key=chunk_s3_key)
+    print(f"Job {job_id} was cancelled, chunk {chunk_index} dropped")
+
+def record_job_id(record):
+    try:
+        return json.loads(record['body'])['job_id']
+    except (ValueError, KeyError, TypeError):
+        # Malformed body: process_record fails on it and only that record is retried
+        return None
+
+def watch_cancellations(job_events, stop):
+    """Set the cancel event of every job of the batch that gets cancelled while it runs"""
+    while not stop.wait(CANCEL_POLL_S):
+        for job_id, job_event in job_events.items():
+            if job_id is not None and not job_event.is_set() and db_service.is_job_cancelled(job_id):
+                print(f"Job {job_id} cancelled, stopping its analyses")
+                job_event.set()
+
+def process_record(record, cancel_event):
+    body = json.loads(record['body'])
+    job_id = body['job_id']
+    chunk_index = body['chunk_index']
+    chunk_s3_key = body['chunk_s3_key']
+    chunk_filename = body['chunk_filename']
+    start_s = body.get('start_s', chunk_index * WINDOW_S)
+    end_s = body.get('end_s', (chunk_index + 1) * WINDOW_S)
+    receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', 1))
+    
+    print(f"Analyzing job {job_id}, chunk {chunk_index} (receive {receive_count})")
+    
+    prompt_version = get_prompt_version()
+    if db_service.is_job_cancelled(job_id):
+        # Queued before the job was cancelled: consume the message without analyzing
+        drop_cancelled_chunk(job_id, chunk_index, chunk_s3_key, prompt_version)
+        return
+    
+    # Sub-steps already stored by an earlier delivery of this chunk are not rerun
+    completed_steps = db_service.get_chunk_steps(job_id, chunk_index, prompt_version)
+    if completed_steps:
+        print(f"Resuming chunk {chunk_index} with steps {sorted(completed_steps)}")
+    
+    def save_step(step, value):
+        return db_service.save_chunk_step(job_id, chunk_index, prompt_version, step, value)
+    
+    # The chunk is streamed from S3 into the Gemini upload (no /tmp copy); nothing is
+    # fetched until the upload reads it, so resumed analyses that skip it cost nothing
+    chunk_stream = open_s3_object(get_s3(), BUCKET_NAME, chunk_s3_key)
+    try:
+        # Analyze
         try:
-            body = json.loads(record['body'])
-            job_id = body['job_id']
-            chunk_index = body['chunk_index']
-            chunk_s3_key = body['chunk_s3_key']
-            chunk_filename = body['chunk_filename']
-            
-            print(f"Analyzing job {job_id}, chunk {chunk_index}")
-            
-            # Download chunk
-            local_path = f"/tmp/{chunk_filename}"
-            s3.download_file(BUCKET_NAME, chunk_s3_key, local_path)
-            
-            # Analyze
-            try:
-                results = llm_service.analyze_chunk(local_path)
-                
-                chunk_result = {
-                    "chunk_index": chunk_index,
-                    "chunk_filename": chunk_filename,
-                    "status": "completed",
-                    "general_analyst": results.get("general_analyst"),
-                    "striking": results.get("striking"),
-                    "grappling": results.get("grappling"),
-                    "submission": results.get("submission"),
-                    "movement": results.get("movement"),
-                    "head_coach": results.get("head_coach")
-                }
-                
-                db_service.update_analysis_progress(job_id, chunk_result)
-                
-            except Exception as e:
-                print(f"Analysis failed for chunk {chunk_index}: {e}")
+            results = llm_service.analyze_chunk(
+                chunk_stream,
+                cancel_event=cancel_event,
+                completed_steps=completed_steps,
+                save_step=save_step,
+                segment_index=chunk_index,
+                start_s=start_s,
+                end_s=end_s
+            )
+        except AnalysisCancelled:
+            if db_service.is_job_cancelled(job_id):
+                drop_cancelled_chunk(job_id, chunk_index, chunk_s3_key, prompt_version)
+                return
+            # Timeout approaching: the message is retried, nothing is recorded
+            raise
+        except Exception as e:
+            print(f"Analysis failed for chunk {chunk_index}: {e}")
+            # Only the last delivery records the failure; earlier ones are simply retried,
+            # otherwise every retry would count the chunk again
+            if receive_count >= MAX_RECEIVE_COUNT:
                 chunk_result = {
                     "chunk_index": chunk_index,
                     "chunk_filename": chunk_filename,
                     "status": "failed",
                     "error": str(e)
                 }
-                db_service.update_analysis_progress(job_id, chunk_result)
-                raise e
-            
-            # Cleanup
-            if os.path.exists(local_path):
-                os.remove(local_path)
-                
-        except Exception as e:
-            print(f"Error processing record: {e}")
+                record_chunk_result(job_id, chunk_result)
             raise e
+        
+        chunk_result = {
+            "chunk_index": chunk_index,
+            "chunk_filename": chunk_filename,
+            "status": "completed",
+            "general_analyst": results.get("general_analyst"),
+            "striking": results.get("striking"),
+            "grappling": results.get("grappling"),
+            "submission": results.get("submission"),
+            "movement": results.get("movement"),
+            "head_coach": results.get("head_coach"),
+            "segment_summary": results.get("segment_summary")
+        }
+        
+        record_chunk_result(job_id, chunk_result)
+    except db_service.JobCancelled:
+        # Cancelled between the analysis and its progress write
+        drop_cancelled_chunk(job_id, chunk_index, chunk_s3_key, prompt_version)
+    finally:
+        chunk_stream.close()
+
+def message_group(record):
+    """FIFO message group of a record; records without one are groups of their own"""
+    return record.get('attributes', {}).get('MessageGroupId') or record['messageId']
+
+def process_group(records, job_events, stopping, succeeded):
+    """
+    Process the records of one message group in order, one at a time (the FIFO per-group
+    ordering and the per-job concurrency cap depend on it). Stops at the first failure or
+    when the timeout approaches: the rest of the group is reported failed and redelivered
+    after it.
+    """
+    for record in records:
+        if stopping.is_set():
+            return
+        try:
+            process_record(record, job_events[record_job_id(record)])
+        except Exception as e:
+            print(f"Error processing record {record['messageId']}: {e}")
+            return
+        succeeded.add(record['messageId'])
+
+def lambda_handler(event, context):
+    """
+    Analyze the message groups of the batch concurrently (the records of a group one
+    after another) and report only the failed records (ReportBatchItemFailures), so
+    successful chunks are not redelivered.
+    """
+    print(f"Received event: {json.dumps(event)}")
+    records = event['Records']
+    if not records:
+        return {"batchItemFailures": []}
+    
+    groups = {}
+    for record in records:
+        groups.setdefault(message_group(record), []).append(record)
+    
+    # One cancel event per job: set by the watcher when the job is cancelled, or for
+    # every job when the Lambda timeout approaches
+    job_events = {record_job_id(record): threading.Event() for record in records}
+    remaining_ms = context.get_remaining_time_in_millis() if context else DEFAULT_REMAINING_MS
+    stopping = threading.Event()
+    succeeded = set()
+    
+    executor = ThreadPoolExecutor(max_workers=min(len(groups), RECORD_CONCURRENCY))
+    futures = [
+        executor.submit(process_group, group_records, job_events, stopping, succeeded)
+        for group_records in groups.values()
+    ]
+    watcher_stop = threading.Event()
+    threading.Thread(target=watch_cancellations, args=(job_events, watcher_stop), daemon=True).start()
+    
+    _, not_done = wait(futures, timeout=max(remaining_ms - TIMEOUT_MARGIN_MS, 0) / 1000)
+    watcher_stop.set()
+    if not_done:
+        print(f"Lambda timeout approaching, cancelling {len(not_done)} message group(s)")
+        stopping.set()
+        for job_event in job_events.values():
+            job_event.set()
+        for future in not_done:
+            future.cancel()  # groups that never started
+        wait(not_done, timeout=CANCEL_GRACE_S)
+    # Don't block on calls still in flight; those records are reported as failed below
+    executor.shutdown(wait=False, cancel_futures=True)
+    
+    failures = [{"itemIdentifier": record['messageId']} for record in records if record['messageId'] not in succeeded]
+    return {"batchItemFailures": failures}
@@ -1,30 +1,47 @@
 import os
 import time
 import logging
-from typing import Dict
-from google import genai
+import json
+import threading
+from typing import Callable, Dict, Optional
 from dotenv import load_dotenv
 from datetime import datetime
 from prompts import (
     generate_general_analyst_prompt,
     generate_specialist_prompt,
-    generate_head_coach_aggregation_prompt
+    generate_head_coach_aggregation_prompt,
+    generate_structured_segment_prompt,
+    generate_tactical_coach_structured_prompt,
 )
+from schemas import SegmentSummary, TacticalCoachSummary
+from shared.lazy import lazy_init
 
 load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+class AnalysisCancelled(Exception):
+    """Raised at a step boundary when the caller asked the analysis to stop"""
+
+def _pause(seconds: float, cancel_event: Optional[threading.Event]):
+    """Sleep that wakes up (and aborts the analysis) as soon as cancel_event is set"""
+    if cancel_event is None:
+        time.sleep(seconds)
+    elif cancel_event.wait(seconds):
+        raise AnalysisCancelled("Analysis cancelled")
+
+def _check_cancelled(cancel_event: Optional[threading.Event]):
+    if cancel_event is not None and cancel_event.is_set():
+        raise AnalysisCancelled("Analysis cancelled")
+
 class LLMService:
     def __init__(self):
-        print('Initializing LLMService ......')
         self.api_key = os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             logger.warning("GEMINI_API_KEY not found in environment variables")
-            self.client = None
-        else:
-            self.client = genai.Client(api_key=self.api_key)
+        # The genai client (and the google.genai import) is built on first use
+        self._get_client = lazy_init("gemini_client")(self._build_client)
         
         # Use environment variable for model, default to gemini-2.0-flash
         self.model = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
@@ -36,12 +53,48 @@ class LLMService:
             "seed": 42
         }
 
-    def upload_file(self, file_path, max_retries=3):
-        """Upload file to Gemini with retry logic and timeout"""
+    def _build_client(self):
+        from google import genai
+        return genai.Client(api_key=self.api_key)
+
+    @property
+    def client(self):
+        if not self.api_key:
+            return None
+        return self._get_client()
+
+    def _delete_remote_file(self, myfile):
+        """Best-effort removal of a Gemini file that won't be used"""
+        self.delete_uploaded_file(myfile.name)
+
+    def delete_uploaded_file(self, name: str):
+        """Best-effort removal of a stored upload (e.g. the "upload" step of a cancelled job)"""
+        if not self.client:
+            return
+        try:
+            self.client.files.delete(name=name)
+        except Exception as e:
+            logger.warning(f"Could not delete remote file {name}: {e}")
+
+    def upload_file(self, file, max_retries=3, cancel_event: Optional[threading.Event] = None, mime_type: str = "video/mp4"):
+        """
+        Upload file to Gemini with retry logic and timeout.
+
+        file is a local path or a seekable binary file object (e.g. an S3 stream);
+        file objects are rewound on every attempt. A remote file left behind by a
+        failed attempt is deleted.
+        """
+        is_stream = not isinstance(file, (str, os.PathLike))
+        label = getattr(file, "name", "<stream>") if is_stream else file
         for attempt in range(max_retries):
+            myfile = None
             try:
-                logger.info(f"[{datetime.now().isoformat()}] Uploading file (attempt {attempt + 1}/{max_retries}): {file_path}")
-                myfile = self.client.files.upload(file=file_path)
+                logger.info(f"[{datetime.now().isoformat()}] Uploading file (attempt {attempt + 1}/{max_retries}): {label}")
+                if is_stream:
+                    file.seek(0)
+                    myfile = self.client.files.upload(file=file, config={"mime_type": mime_type})
+                else:
+                    myfile = self.client.files.upload(file=file)
                 
                 # Poll for processing completion with 2-minute timeout
                 start_time = time.time()
@@ -53,27 +106,85 @@ class LLMService:
                         raise TimeoutError(f"File processing timeout after {timeout}s")
                     
                     logger.info(f"Processing video... ({int(elapsed)}s elapsed)")
-                    time.sleep(5)
+                    _pause(5, cancel_event)
                     myfile = self.client.files.get(name=myfile.name)
                     
                 if myfile.state.name == "FAILED":
                     raise ValueError(f"File processing failed: {myfile.state.name}")
                     
                 logger.info(f"[{datetime.now().isoformat()}] File uploaded and processed: {myfile.name}. Sleeping 30s...")
-                time.sleep(30)
+                _pause(30, cancel_event)
                 return myfile
                 
+            except AnalysisCancelled:
+                if myfile is not None:
+                    self._delete_remote_file(myfile)
+                raise
             except Exception as e:
                 logger.error(f"Upload attempt {attempt + 1} failed: {e}")
+                if myfile is not None:
+                    self._delete_remote_file(myfile)
                 if attempt < max_retries - 1:
                     # Exponential backoff: 2^attempt seconds
                     wait_time = 2 ** attempt
                     logger.info(f"Retrying in {wait_time}s...")
-                    time.sleep(wait_time)
+                    _pause(wait_time, cancel_event)
                 else:
                     raise e
 
-    def analyze_chunk(self, file_path):
+    def _generate_structured(self, prompt: str, model_cls):
+        """
+        JSON generation validated against model_cls, with one correction retry.
+        Returns (model instance or None, raw text of the last answer).
+        """
+        config = {**self.default_config, "response_mime_type": "application/json", "response_json_schema": model_cls.model_json_schema()}
+        response = self.client.models.generate_content(model=self.model, contents=[prompt], config=config)
+        raw_json = response.text.strip()
+        try:
+            return model_cls.model_validate_json(raw_json), raw_json
+        except Exception as e_json:
+            logger.warning(f"Initial {model_cls.__name__} parse failed: {e_json}; retrying correction")
+            correction_prompt = prompt + f"\nEl JSON anterior fue inválido ({e_json}). Devuelve SOLO JSON corregido."
+            response = self.client.models.generate_content(model=self.model, contents=[correction_prompt], config=config)
+            raw_json = response.text.strip()
+            try:
+                return model_cls.model_validate_json(raw_json), raw_json
+            except Exception as e_json2:
+                logger.error(f"Failed to parse {model_cls.__name__} after correction: {e_json2}")
+                return None, raw_json
+
+    def summarize_segment(self, general_analysis: str, segment_index: int, start_s: int, end_s: int) -> Optional[SegmentSummary]:
+        """Structured SegmentSummary of a chunk from its general analyst table"""
+        structured_prompt = generate_structured_segment_prompt(
+            general_analyst_table=general_analysis,
+            segment_index=segment_index,
+            start_s=start_s,
+            end_s=end_s,
+        )
+        segment_summary, _ = self._generate_structured(structured_prompt, SegmentSummary)
+        return segment_summary
+
+    def summarize_job(self, segment_summaries: list) -> Optional[TacticalCoachSummary]:
+        """TacticalCoachSummary over all the SegmentSummary of a job (fan-in step)"""
+        if not self.client:
+            raise ValueError("GEMINI_API_KEY not set or client initialization failed")
+        prompt = generate_tactical_coach_structured_prompt(segment_summaries=segment_summaries)
+        tactical, _ = self._generate_structured(prompt, TacticalCoachSummary)
+        return tactical
+
+    def _get_uploaded_file(self, name: str):
+        """Reuse a file uploaded by a previous delivery if Gemini still has it"""
+        try:
+            myfile = self.client.files.get(name=name)
+            if myfile.state.name == "ACTIVE":
+                return myfile
+        except Exception as e:
+            logger.warning(f"Stored upload {name} not reusable: {e}")
+        return None
+
+    def analyze_chunk(self, file_path, cancel_event: Optional[threading.Event] = None,
+                      completed_steps: Optional[Dict[str, str]] = None, save_step: Optional[Callable] = None,
+                      segment_index: Optional[int] = None, start_s: int = 0, end_s: int = 0):
         """
         Analyze chunk following the workflow from notebook:
         1. General Analyst creates ground truth from video
@@ -81,7 +192,16 @@ class LLMService:
         3. Head Coach aggregates all specialist analyses
         
         Args:
-            file_path: Path to video file
+            file_path: Path or binary file object of the video (only needed while the
+                general analysis is pending)
+            cancel_event: When set, the analysis stops at the next step boundary
+                raising AnalysisCancelled (an LLM call already in flight is not interrupted)
+            completed_steps: Results of steps finished by a previous delivery
+                ("upload", "general_analyst", each specialist role, "head_coach"); they are not rerun
+            save_step: save_step(step, value) persists a finished step and returns the
+                value to continue with (the first one stored wins)
+            segment_index, start_s, end_s: Absolute position of the chunk; when given,
+                a structured SegmentSummary is returned under "segment_summary"
         
         Returns:
             Dict with analysis results
@@ -89,31 +209,63 @@ class LLMService:
         if not self.client:
             raise ValueError("GEMINI_API_KEY not set or client initialization failed")
 
+        steps = dict(completed_steps or {})
+
+        def finish_step(step, value):
+            if save_step is not None:
+                value = save_step(step, value)
+            steps[step] = value
+            return value
+
         try:
-            myfile = self.upload_file(file_path)
-            
             results = {}
             
             # Step 1: General Analyst
-            logger.info(f"[{datetime.now().isoformat()}] Running General Analyst...")
-            prompt_general = generate_general_analyst_prompt()
-            response_general = self.client.models.generate_content(
-                model=self.model, 
-                contents=[myfile, prompt_general],
-                config=self.default_config
-            )
-            general_analysis = response_general.text
+            _check_cancelled(cancel_event)
+            if "general_analyst" in steps:
+                general_analysis = steps["general_analyst"]
+            else:
+                myfile = self._get_uploaded_file(steps["upload"]) if "upload" in steps else None
+                if myfile is None:
+                    myfile = self.upload_file(file_path, cancel_event=cancel_event)
+                    finish_step("upload", myfile.name)
+                
+                logger.info(f"[{datetime.now().isoformat()}] Running General Analyst...")
+                prompt_general = generate_general_analyst_prompt()
+                response_general = self.client.models.generate_content(
+                    model=self.model, 
+                    contents=[myfile, prompt_general],
+                    config=self.default_config
+                )
+                general_analysis = finish_step("general_analyst", response_general.text)
+                logger.info(f"[{datetime.now().isoformat()}] General Analyst completed")
+                
+                # Delay between LLM calls to avoid rate limits
+                _pause(5, cancel_event)
             results["general_analyst"] = general_analysis
-            logger.info(f"[{datetime.now().isoformat()}] General Analyst completed")
-            
-            # Delay between LLM calls to avoid rate limits
-            time.sleep(5)
+
+            # Structured SegmentSummary (stored as JSON text; "" when it could not be parsed).
+            # A failed call (API error) fails the chunk like any other step: the message is
+            # redelivered and resumes here, and the last delivery records the chunk as failed
+            if segment_index is not None:
+                if "segment_summary" in steps:
+                    segment_json = steps["segment_summary"]
+                else:
+                    _check_cancelled(cancel_event)
+                    segment_summary = self.summarize_segment(general_analysis, segment_index, start_s, end_s)
+                    segment_json = finish_step("segment_summary", segment_summary.model_dump_json() if segment_summary else "")
+                if segment_json:
+                    results["segment_summary"] = json.loads(segment_json)
             
             # Step 2: Specialist Roles
             specialist_roles = ["striking", "grappling", "submission", "movement"]
             specialist_analyses = {}
             
             for role in specialist_roles:
+                if role in steps:
+                    specialist_analyses[role] = results[role] = steps[role]
+                    continue
+                _check_cancelled(cancel_event)
                 logger.info(f"[{datetime.now().isoformat()}] Running {role} specialist analysis...")
                 prompt_specialist = generate_specialist_prompt(
                     role=role,
@@ -124,27 +276,34 @@ class LLMService:
                     contents=[prompt_specialist],
                     config=self.default_config
                 )
-                specialist_analysis = response_specialist.text
+                specialist_analysis = finish_step(role, response_specialist.text)
                 specialist_analyses[role] = specialist_analysis
                 results[role] = specialist_analysis
                 logger.info(f"[{datetime.now().isoformat()}] {role} specialist analysis completed")
                 
                 # Delay between specialist analyses
-                time.sleep(5)
+                _pause(5, cancel_event)
             
             # Step 3: Head Coach aggregation
-            logger.info(f"[{datetime.now().isoformat()}] Running Head Coach aggregation...")
-            prompt_head_coach = generate_head_coach_aggregation_prompt(specialist_analyses)
-            response_coach = self.client.models.generate_content(
-                model=self.model,
-                contents=[prompt_head_coach],
-                config=self.default_config
-            )
-            results["head_coach"] = response_coach.text
-            logger.info(f"[{datetime.now().isoformat()}] Head Coach aggregation completed")
+            if "head_coach" in steps:
+                results["head_coach"] = steps["head_coach"]
+            else:
+                _check_cancelled(cancel_event)
+                logger.info(f"[{datetime.now().isoformat()}] Running Head Coach aggregation...")
+                prompt_head_coach = generate_head_coach_aggregation_prompt(specialist_analyses)
+                response_coach = self.client.models.generate_content(
+                    model=self.model,
+                    contents=[prompt_head_coach],
+                    config=self.default_config
+                )
+                results["head_coach"] = finish_step("head_coach", response_coach.text)
+                logger.info(f"[{datetime.now().isoformat()}] Head Coach aggregation completed")
                 
             return results
             
+        except AnalysisCancelled:
+            logger.warning(f"[{datetime.now().isoformat()}] analyze_chunk cancelled: {file_path}")
+            raise
         except Exception as e:
             logger.error(f"[{datetime.now().isoformat()}] Error in analyze_chunk: {e}")
             raise e
@@ -1,11 +1,38 @@
 from .loader import (
     generate_general_analyst_prompt, 
     generate_specialist_prompt,
-    generate_head_coach_aggregation_prompt
+    generate_head_coach_aggregation_prompt,
+    get_prompt_version,
+    load_template
 )
 
+# -------------------------------------------------------------
+# Helpers para pedir salida estructurada JSON al LLM.
+# Los templates (con el ejemplo del esquema minimalista para el dashboard)
+# van en el bundle, así que cambiarlos cambia get_prompt_version().
+# -------------------------------------------------------------
+
+
+def generate_structured_segment_prompt(general_analyst_table: str, segment_index: int, start_s: int, end_s: int) -> str:
+    """Prompt para pedir al LLM un JSON SegmentSummary + highlights.
+
+    Ajustado para forzar salida JSON pura (sin prefijos, sin 'SegmentSummary =', sin markdown).
+    """
+    template = load_template("structured_segment")
+    prompt = template.replace("{duration_s}", str(end_s - start_s)).replace("{segment_index}", str(segment_index))
+    # La tabla al final: su contenido no se interpreta como placeholder
+    return prompt.replace("{general_analyst_table}", general_analyst_table)
+
+
+def generate_tactical_coach_structured_prompt(segment_summaries: list) -> str:
+    """Prompt para síntesis táctica global en formato TacticalCoachSummary JSON."""
+    return load_template("tactical_coach_structured").replace("{segment_summaries}", str(segment_summaries))
+
 __all__ = [
     'generate_general_analyst_prompt', 
     'generate_specialist_prompt',
-    'generate_head_coach_aggregation_prompt'
+    'generate_head_coach_aggregation_prompt',
+    'get_prompt_version',
+    'generate_structured_segment_prompt',
+    'generate_tactical_coach_structured_prompt'
 ]
\ No newline at end of file
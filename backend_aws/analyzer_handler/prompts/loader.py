@@ -1,13 +1,47 @@
 import os
+import json
+import time
+import hashlib
+import threading
 import boto3
 import logging
+from pathlib import Path
 from botocore.exceptions import ClientError
 from typing import Dict
+from shared.lazy import lazy_init
 
 logger = logging.getLogger(__name__)
 
-# Cache for templates to avoid repeated S3 calls
-_TEMPLATE_CACHE = {}
+# Prompt bundle: every template in one manifest, versioned by a hash of the contents.
+# The bundle is baked into the image (built by upload_prompts.py); an S3 copy, if
+# configured, overrides it and is re-checked with If-None-Match once per TTL.
+BAKED_BUNDLE_PATH = Path(__file__).parent / "bundle.json"
+PROMPT_BUNDLE_S3_KEY = os.getenv("PROMPT_BUNDLE_S3_KEY", "")
+PROMPT_BUNDLE_TTL_S = int(os.getenv("PROMPT_BUNDLE_TTL_S", "300"))
+aws_endpoint = os.getenv("AWS_ENDPOINT_URL")
+
+_bundle_lock = threading.Lock()
+_bundle_state = {"bundle": None, "etag": None, "checked_at": 0.0}
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def build_bundle(templates: Dict[str, str]) -> dict:
+    """Manifest for a set of templates ({name: content}); the version changes with any template"""
+    hashes = {name: _sha256(content) for name, content in sorted(templates.items())}
+    version = _sha256("\n".join(f"{name}:{digest}" for name, digest in hashes.items()))[:16]
+    return {"version": version, "hashes": hashes, "templates": dict(sorted(templates.items()))}
+
+def _validated(bundle: dict, source: str) -> dict:
+    if build_bundle(bundle["templates"])["version"] != bundle["version"]:
+        raise ValueError(f"Prompt bundle from {source} does not match its version hash")
+    return bundle
+
+@lazy_init("prompts_s3_client")
+def _get_s3():
+    if aws_endpoint:
+        return boto3.client("s3", endpoint_url=aws_endpoint)
+    return boto3.client("s3")
 
 def _get_bucket_name() -> str:
     """Get the bucket name from environment variables"""
@@ -16,9 +50,45 @@ def _get_bucket_name() -> str:
         raise ValueError("BUCKET_NAME environment variable is not set")
     return bucket
 
+def _refresh_override():
+    """Conditional GET of the S3 bundle; keeps the current one on 304 or any error"""
+    try:
+        request = {"Bucket": _get_bucket_name(), "Key": PROMPT_BUNDLE_S3_KEY}
+        if _bundle_state["etag"]:
+            request["IfNoneMatch"] = _bundle_state["etag"]
+        response = _get_s3().get_object(**request)
+        bundle = _validated(json.loads(response["Body"].read()), f"s3://{request['Bucket']}/{PROMPT_BUNDLE_S3_KEY}")
+    except ClientError as e:
+        code = e.response["Error"]["Code"]
+        if code not in ("304", "NotModified", "NoSuchKey"):
+            logger.warning(f"Could not refresh prompt bundle from S3: {e}")
+        return
+    except ValueError as e:
+        logger.error(str(e))
+        return
+    if bundle["version"] != _bundle_state["bundle"]["version"]:
+        logger.info(f"Prompt bundle {bundle['version']} loaded from S3")
+    _bundle_state["bundle"] = bundle
+    _bundle_state["etag"] = response["ETag"]
+
+def get_bundle() -> dict:
+    """Current prompt bundle (baked, or the S3 override when configured)"""
+    with _bundle_lock:
+        if _bundle_state["bundle"] is None:
+            _bundle_state["bundle"] = _validated(json.loads(BAKED_BUNDLE_PATH.read_text(encoding="utf-8")), str(BAKED_BUNDLE_PATH))
+        now = time.monotonic()
+        if PROMPT_BUNDLE_S3_KEY and now - _bundle_state["checked_at"] >= PROMPT_BUNDLE_TTL_S:
+            _bundle_state["checked_at"] = now
+            _refresh_override()
+        return _bundle_state["bundle"]
+
+def get_prompt_version() -> str:
+    """Version of the prompt bundle, used to key stored LLM results"""
+    return get_bundle()["version"]
+
 def load_template(template_name: str) -> str:
     """
-    Load a template from S3.
+    Load a template from the prompt bundle.
     
     Args:
         template_name: Name of the template (without extension)
@@ -26,23 +96,10 @@ def load_template(template_name: str) -> str:
     Returns:
         The content of the template
     """
-    if template_name in _TEMPLATE_CACHE:
-        return _TEMPLATE_CACHE[template_name]
-
-    bucket_name = _get_bucket_name()
-    key = f"prompts/{template_name}.txt"
-    
-    s3 = boto3.client("s3")
-    
     try:
-        logger.info(f"Loading template from s3://{bucket_name}/{key}")
-        response = s3.get_object(Bucket=bucket_name, Key=key)
-        content = response["Body"].read().decode("utf-8")
-        _TEMPLATE_CACHE[template_name] = content
-        return content
-    except ClientError as e:
-        logger.error(f"Error loading template {template_name} from s3://{bucket_name}/{key}: {e}")
-        raise FileNotFoundError(f"Template {template_name} not found in S3") from e
+        return get_bundle()["templates"][template_name]
+    except KeyError:
+        raise FileNotFoundError(f"Template {template_name} not found in prompt bundle")
 
 def generate_general_analyst_prompt() -> str:
     """Genera el prompt del analista general"""
@@ -0,0 +1,82 @@
+import io
+
+# Read buffer between the S3 GetObject stream and the consumer (Gemini resumable upload)
+DEFAULT_BUFFER_SIZE = 1024 * 1024
+
+class S3ObjectReader(io.RawIOBase):
+    """
+    Seekable, read-only file object over an S3 object.
+
+    Reads stream from a single GetObject; a seek to another position reopens the
+    stream with a Range request. Nothing is written to disk and memory stays
+    bounded by the buffer of the wrapping BufferedReader, whatever the object size.
+    """
+    mode = "rb"
+
+    def __init__(self, s3, bucket: str, key: str):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.name = key
+        self._size = None
+        self._pos = 0
+        self._body = None
+        self._body_pos = None
+
+    @property
+    def size(self) -> int:
+        if self._size is None:
+            self._size = self.s3.head_object(Bucket=self.bucket, Key=self.key)["ContentLength"]
+        return self._size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self._pos + offset
+        elif whence == io.SEEK_END:
+            pos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if pos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = pos
+        return pos
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+        self._body = None
+        self._body_pos = None
+
+    def readinto(self, buffer):
+        if self._size is not None and self._pos >= self._size:
+            return 0
+        if self._body is None or self._body_pos != self._pos:
+            self._close_body()
+            response = self.s3.get_object(Bucket=self.bucket, Key=self.key, Range=f"bytes={self._pos}-")
+            self._body = response["Body"]
+            self._body_pos = self._pos
+        data = self._body.read(len(buffer))
+        n = len(data)
+        buffer[:n] = data
+        self._pos += n
+        self._body_pos += n
+        return n
+
+    def close(self):
+        self._close_body()
+        super().close()
+
+def open_s3_object(s3, bucket: str, key: str, buffer_size: int = DEFAULT_BUFFER_SIZE) -> io.BufferedReader:
+    """Buffered binary file object streaming an S3 object (see S3ObjectReader)"""
+    return io.BufferedReader(S3ObjectReader(s3, bucket, key), buffer_size=buffer_size)
@@ -0,0 +1,55 @@
+from pydantic import BaseModel, Field
+from typing import List, Optional
+from enum import Enum
+
+# Structured output models (same as backend/models/schemas.py)
+
+class Disciplina(str, Enum):
+    STRIKING = "Striking"
+    GRAPPLING = "Grappling"
+    SUBMISSION = "Submission"
+    MOVEMENT = "Movement"
+
+class MomentType(str, Enum):
+    OFFENSE = "offense"
+    DEFENSE = "defense"
+    OPORTUNIDAD = "oportunidad"
+    RIESGO = "riesgo"
+
+class MomentHighlight(BaseModel):
+    """Momento clave compacto para tarjeta de UI"""
+    timestamp: str = Field(..., description="Marca MM:SS del momento")
+    titulo: str = Field(..., description="Título corto (<=30c)")
+    descripcion: str = Field(..., description="Descripción breve (<=90c)")
+    tipo: MomentType = Field(..., description="Tipo para iconografía")
+    disciplina: Disciplina = Field(..., description="Disciplina asociada")
+    impacto: int = Field(..., ge=1, le=5, description="Impacto ordinal 1–5")
+
+class SegmentSummary(BaseModel):
+    """Resumen numérico y momentos de un segmento (30s)."""
+    segment_index: int = Field(..., description="Índice del segmento (0-based)")
+    start_s: int = Field(..., description="Segundo inicial absoluto del segmento")
+    end_s: int = Field(..., description="Segundo final absoluto del segmento")
+    acciones_total: int = Field(..., description="Acciones registradas en el segmento")
+    acciones_min: float = Field(..., description="Ritmo (acciones por minuto)")
+    intentos: int = Field(..., description="Intentos ofensivos totales")
+    exitos: int = Field(..., description="Intentos con éxito")
+    success_rate: float = Field(..., description="exitos / intentos (0-1)")
+    striking_s: int = Field(0, description="Segundos con Striking predominante")
+    grappling_s: int = Field(0, description="Segundos con Grappling predominante")
+    submission_s: int = Field(0, description="Segundos con Submission activa")
+    movement_s: int = Field(0, description="Segundos con Movement predominante")
+    movement_ratio: float = Field(0, description="movement_s / duración segmento")
+    clinch_control_s: int = Field(0, description="Segundos de control en clinch")
+    submission_threat_s: int = Field(0, description="Segundos con amenaza de sumisión")
+    highlights: List[MomentHighlight] = Field(default_factory=list, description="Momentos clave (máx 5)")
+
+class TacticalCoachSummary(BaseModel):
+    """Síntesis táctica global tras procesar todos los segmentos."""
+    fortalezas_top3: List[str] = Field(default_factory=list, description="Fortalezas principales")
+    debilidades_top3: List[str] = Field(default_factory=list, description="Debilidades principales")
+    ajustes_top3: List[str] = Field(default_factory=list, description="Ajustes recomendados inmediatos")
+    recomendacion_tactica: str = Field("", description="Recomendación táctica única y concreta")
+    foco_disciplina: Optional[Disciplina] = Field(None, description="Disciplina de mayor relevancia competitiva")
+    riesgo_principal: Optional[str] = Field(None, description="Riesgo más crítico identificado")
+    oportunidad_principal: Optional[str] = Field(None, description="Mayor oportunidad explotable")
\ No newline at end of file
@@ -1,12 +1,16 @@
-from fastapi import FastAPI, HTTPException, Body
+from fastapi import FastAPI, HTTPException, Body, Request, Response, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
 import uuid
 import json
 import os
+import hashlib
+import time
 import boto3
-from schemas import UploadResponse, SplitProgress, AnalysisProgress
-from shared import db_service
-from services.chat_service import call_agent as chat_agent
+from schemas import UploadResponse, SplitProgress, AnalysisProgress, JobProgress, ChunkAnalysisPage, StructuredAnalysisResponse
+from shared import db_service, answer_cache, job_media
+from shared.lazy import lazy_init
 
 app = FastAPI()
 
@@ -18,15 +22,37 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Initialize SQS client
-# Use endpoint_url if provided (for local testing)
-sqs_endpoint = os.getenv("AWS_ENDPOINT_URL") # Generic endpoint or specific SQS one?
-if sqs_endpoint:
-    sqs = boto3.client("sqs", endpoint_url=sqs_endpoint)
-else:
-    sqs = boto3.client("sqs")
+@lazy_init("sqs_client")
+def get_sqs():
+    # Initialize SQS client on first use (only /upload needs it)
+    # Use endpoint_url if provided (for local testing)
+    sqs_endpoint = os.getenv("AWS_ENDPOINT_URL") # Generic endpoint or specific SQS one?
+    if sqs_endpoint:
+        return boto3.client("sqs", endpoint_url=sqs_endpoint)
+    return boto3.client("sqs")
+
+@lazy_init("s3_client")
+def get_s3():
+    # Only DELETE /jobs/{job_id} needs it (to drop the split chunks)
+    endpoint = os.getenv("AWS_ENDPOINT_URL")
+    if endpoint:
+        return boto3.client("s3", endpoint_url=endpoint)
+    return boto3.client("s3")
 
 SPLIT_QUEUE_URL = os.getenv("SPLIT_QUEUE_URL")
+BUCKET_NAME = os.getenv("BUCKET_NAME")
+
+def _etag_response(request: Request, payload: dict) -> Response:
+    """JSON response with a strong ETag; answers If-None-Match with 304"""
+    body = json.dumps(payload, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match", "")
+    candidates = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    if "*" in candidates or etag in candidates:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(content=payload, headers=headers)
 
 @app.post("/upload", response_model=UploadResponse)
 async def upload_video(s3_key: str = Body(..., embed=True)):
@@ -34,7 +60,7 @@ async def upload_video(s3_key: str = Body(..., embed=True)):
     
     # Create job in DynamoDB
     try:
-        db_service.create_job(job_id, s3_key)
+        await run_in_threadpool(db_service.create_job, job_id, s3_key)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     
@@ -45,7 +71,8 @@ async def upload_video(s3_key: str = Body(..., embed=True)):
     }
     
     try:
-        sqs.send_message(
+        await run_in_threadpool(
+            get_sqs().send_message,
             QueueUrl=SPLIT_QUEUE_URL,
             MessageBody=json.dumps(message_body),
             MessageGroupId=job_id,
@@ -58,25 +85,133 @@ async def upload_video(s3_key: str = Body(..., embed=True)):
     
     return UploadResponse(job_id=job_id, message="Processing started", status="processing")
 
+@app.delete("/jobs/{job_id}", status_code=202)
+async def delete_job(job_id: str):
+    """
+    Stop a job. Chunk messages still queued are skipped by the analyzer, running analyses
+    stop at their next step and the split chunks are deleted (the source video is kept).
+    """
+    cancelled = await run_in_threadpool(db_service.cancel_job, job_id)
+    if cancelled is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if cancelled is False:
+        raise HTTPException(status_code=409, detail="Job already finished")
+    # The splitter may still upload a few chunks; it deletes them itself once it notices
+    deleted = await run_in_threadpool(job_media.delete_split_chunks, get_s3(), BUCKET_NAME, job_id)
+    return {"job_id": job_id, "status": "cancelled", "deleted_chunks": deleted}
+
 @app.get("/agent/{job_id}")
 async def call_agent(job_id: str, question: str):
-    job = db_service.get_job(job_id)
-    videos = job.get("chunk_analyses", []) if job else []
-    if not job:
+    context, context_stats = await _agent_context(job_id, question)
+    version = _answer_cache_version(context, context_stats)
+    cached = await _cached_answer(job_id, question, version)
+    if cached:
+        return {"response": cached["answer"], "context": context_stats, "cache": _cache_info(cached)}
+
+    # Imported here: langchain/langgraph are only loaded by containers that serve the agent
+    from services.chat_service import acall_agent
+    start = time.perf_counter()
+    response = await acall_agent(question, context, job_id=job_id)
+    await _store_answer(job_id, question, version, response, start)
+    return {"response": response, "context": context_stats, "cache": _cache_info(None)}
+
+@app.get("/agent/{job_id}/stream")
+async def stream_agent(job_id: str, question: str):
+    """
+    Server-Sent Events version of /agent/{job_id}. Note that behind API Gateway + Mangum
+    the response is still delivered in one piece; it streams when served by uvicorn.
+    """
+    context, context_stats = await _agent_context(job_id, question)
+    version = _answer_cache_version(context, context_stats)
+    cached = await _cached_answer(job_id, question, version)
+    from services.chat_service import astream_agent
+
+    def sse(event: dict) -> str:
+        return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+    async def body():
+        yield sse({"type": "context", **context_stats, "cache": _cache_info(cached)})
+        if cached:
+            yield sse({"type": "token", "text": cached["answer"]})
+            yield sse({"type": "done", "response": cached["answer"]})
+            return
+        start = time.perf_counter()
+        async for event in astream_agent(question, context, job_id=job_id):
+            if event["type"] == "done":
+                await _store_answer(job_id, question, version, event["response"], start)
+            yield sse(event)
+    return StreamingResponse(body(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.get("/agent/{job_id}/cache")
+async def get_answer_cache_stats(job_id: str):
+    """Hit rate and latency saved by the answer cache of a job"""
+    stats = await run_in_threadpool(answer_cache.get_stats, job_id)
+    if stats is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return stats
+
+async def _agent_context(job_id: str, question: str):
+    # Only the chunks relevant to the question go into the prompt (BM25 over the job's analyses).
+    # DynamoDB/S3 reads are blocking, so they run off the event loop
+    from services.context_service import get_agent_context
+    result = await run_in_threadpool(get_agent_context, job_id, question)
+    if result is None:
         raise HTTPException(status_code=404, detail="Job not found")
-    response = chat_agent(question, videos)
-    return {"response": response}
+    return result
+
+def _answer_cache_version(context: str, context_stats: dict):
+    # Only answers over the final digest are cached: per-question chunk contexts are not reusable
+    return answer_cache.context_version(context) if context_stats["source"] == "digest" else None
+
+async def _cached_answer(job_id: str, question: str, version):
+    if version is None:
+        return None
+    return await run_in_threadpool(answer_cache.lookup, job_id, question, version)
+
+async def _store_answer(job_id: str, question: str, version, answer: str, start: float):
+    if version is not None and answer:
+        latency_ms = int((time.perf_counter() - start) * 1000)
+        await run_in_threadpool(answer_cache.store, job_id, question, version, answer, latency_ms)
+
+def _cache_info(cached) -> dict:
+    if not cached:
+        return {"hit": False}
+    return {"hit": True, "similarity": cached["similarity"], "latency_saved_ms": cached["latency_ms"]}
 
 @app.get("/split/{job_id}", response_model=SplitProgress)
-async def get_split_progress(job_id: str):
-    job = db_service.get_job(job_id)
+async def get_split_progress(job_id: str, request: Request):
+    job = await run_in_threadpool(db_service.get_job_fields, job_id, SplitProgress.model_fields)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    return SplitProgress(**job)
+    return _etag_response(request, SplitProgress(**job).model_dump(mode="json"))
 
 @app.get("/analysis/{job_id}", response_model=AnalysisProgress)
 async def get_analysis_progress(job_id: str):
-    job = db_service.get_job(job_id)
+    job = await run_in_threadpool(db_service.get_job, job_id)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
     return AnalysisProgress(**job)
+
+@app.get("/analysis/{job_id}/progress", response_model=JobProgress)
+async def get_job_progress(job_id: str, request: Request):
+    """Counters and status only, without the chunk analysis texts"""
+    job = await run_in_threadpool(db_service.get_job_fields, job_id, JobProgress.model_fields)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _etag_response(request, JobProgress(**job).model_dump(mode="json"))
+
+@app.get("/analysis/{job_id}/chunks", response_model=ChunkAnalysisPage)
+async def get_chunk_analyses_page(job_id: str, request: Request, since_chunk: int = -1, limit: int = Query(20, ge=1, le=100)):
+    result = await run_in_threadpool(db_service.get_chunk_analyses, job_id, since_chunk=since_chunk, limit=limit)
+    if result is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    analyses, next_since_chunk = result
+    page = ChunkAnalysisPage(job_id=job_id, chunk_analyses=analyses, next_since_chunk=next_since_chunk)
+    return _etag_response(request, page.model_dump(mode="json"))
+
+@app.get("/analysis/{job_id}/structured", response_model=StructuredAnalysisResponse)
+async def get_structured_analysis(job_id: str, request: Request):
+    structured = await run_in_threadpool(db_service.get_structured_analysis, job_id)
+    if not structured:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return _etag_response(request, StructuredAnalysisResponse(**structured).model_dump(mode="json"))
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import List, Optional
+from typing import List, Optional, Dict, Any
 from enum import Enum
 
 class UploadResponse(BaseModel):
@@ -29,12 +29,35 @@ class ChunkAnalysis(BaseModel):
 class AnalysisProgress(BaseModel):
     job_id: str
     split_status: str
-    analysis_status: str  # "pending", "processing", "completed", "partial", "failed"
+    analysis_status: str  # "pending", "processing", "completed", "partial", "failed", "cancelled"
     total_chunks: int
     analyzed_chunks: int
     analysis_pct: float
     chunk_analyses: List[ChunkAnalysis] = []
 
+class JobProgress(BaseModel):
+    """Contadores y estados del job, sin textos de análisis (polling liviano)"""
+    job_id: str
+    split_status: str
+    analysis_status: str
+    total_chunks: int
+    completed_chunks: int
+    analyzed_chunks: int
+    split_pct: float
+    analysis_pct: float
+
+class ChunkAnalysisPage(BaseModel):
+    """Página de análisis por chunk con chunk_index > since_chunk"""
+    job_id: str
+    chunk_analyses: List[ChunkAnalysis] = []
+    next_since_chunk: Optional[int] = None  # None cuando no quedan más resultados
+
+class StructuredAnalysisResponse(BaseModel):
+    job_id: str
+    segments: List[Dict[str, Any]]
+    tactical_summary: Optional[Dict[str, Any]] = None
+    status: str
+
 # Coach Response - To be Used Later
 
 class Disciplina(str, Enum):
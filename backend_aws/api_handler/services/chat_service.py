@@ -1,76 +1,119 @@
 from langchain_aws import ChatBedrockConverse
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
     ToolMessage,
 )
 from langchain_core.tools import tool
+from langchain_core.runnables import RunnableConfig
 from langgraph.prebuilt import create_react_agent
 from langchain_core.prompts import ChatPromptTemplate
 from datetime import datetime
 import os, uuid, re
 import boto3
 import random
+import threading
+import time
+from shared.lazy import lazy_init
 
-# Initialize S3 client
-s3_client = boto3.client("s3")
 BUCKET_NAME = os.getenv("BUCKET_NAME")
 PROMPTS_PREFIX = "prompts/templates/"
+SPECIALIST_EXTENSIONS = (".txt", ".md")
+# How long a listing is trusted before re-listing the prefix; unchanged ETags keep their cached content
+SPECIALIST_CATALOG_TTL_S = int(os.getenv("SPECIALIST_CATALOG_TTL_S", "300"))
 
-# Initialize Bedrock models
+# Clients, models and the agent are built on first use, not at import
+
+@lazy_init("s3_client")
+def get_s3_client():
+    return boto3.client("s3")
+
+# Bedrock models
 # We assume the Lambda execution role has permissions to invoke these models
-llm_orchestrator = ChatBedrockConverse(
-    model="us.amazon.nova-pro-v1:0",
-    region_name="us-east-1", 
-)
+@lazy_init("llm_orchestrator")
+def get_llm_orchestrator():
+    return ChatBedrockConverse(
+        model="us.amazon.nova-pro-v1:0",
+        region_name="us-east-1", 
+    )
+
+@lazy_init("llm_light")
+def get_llm_light():
+    return ChatBedrockConverse(
+        model="us.meta.llama3-1-70b-instruct-v1:0",
+        region_name="us-east-1",
+    )
 
-llm_light = ChatBedrockConverse(
-    model="us.meta.llama3-1-70b-instruct-v1:0",
-    region_name="us-east-1",
-)
+# -----------------------------------------------------------------------------
+# Specialist catalog (S3 prompts cached in memory across warm invocations)
+# -----------------------------------------------------------------------------
 
-# Helper to read from S3
-def _read_prompt_from_s3(key: str) -> str:
-    try:
-        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=key)
-        return response["Body"].read().decode("utf-8")
-    except Exception as e:
-        print(f"Error reading {key} from S3: {e}")
-        return ""
+_catalog_lock = threading.Lock()
+_catalog = {"specialists": None, "listed_at": 0.0}  # specialists: name -> {"key", "etag"}
+_prompt_contents = {}  # key -> (etag, content)
 
-# Helper to list prompts from S3
-def _list_prompts_from_s3() -> list[str]:
+def _list_prompts_from_s3():
+    """name -> {"key", "etag"} for every prompt under PROMPTS_PREFIX, or None if S3 failed"""
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME, Prefix=PROMPTS_PREFIX)
-        if "Contents" not in response:
-            return []
-        
-        prompts = []
-        for obj in response["Contents"]:
-            key = obj["Key"]
-            if key.endswith(".txt") or key.endswith(".md"):
+        specialists = {}
+        paginator = get_s3_client().get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=BUCKET_NAME, Prefix=PROMPTS_PREFIX):
+            for obj in page.get("Contents", []):
                 # Extract filename without extension
-                filename = key.split("/")[-1]
-                name = filename.rsplit(".", 1)[0]
-                prompts.append(name)
-        return prompts
+                name, dot, ext = obj["Key"].split("/")[-1].rpartition(".")
+                if not dot or f".{ext}" not in SPECIALIST_EXTENSIONS:
+                    continue
+                current = specialists.get(name)
+                # .txt wins over .md for the same name
+                if current is None or obj["Key"].endswith(".txt"):
+                    specialists[name] = {"key": obj["Key"], "etag": obj["ETag"]}
+        return specialists
     except Exception as e:
         print(f"Error listing prompts from S3: {e}")
-        return []
-
-# Helper to find specific prompt key
-def _find_specialist_key(specialist_name: str) -> str:
-    # Try .txt and .md
-    for ext in [".txt", ".md"]:
-        key = f"{PROMPTS_PREFIX}{specialist_name}{ext}"
-        try:
-            s3_client.head_object(Bucket=BUCKET_NAME, Key=key)
-            return key
-        except:
-            continue
-    return None
+        return None
+
+def get_specialist_catalog() -> dict:
+    """name -> {"key", "etag"}; re-listed from S3 at most once per SPECIALIST_CATALOG_TTL_S"""
+    with _catalog_lock:
+        expired = time.monotonic() - _catalog["listed_at"] >= SPECIALIST_CATALOG_TTL_S
+        if _catalog["specialists"] is None or expired:
+            specialists = _list_prompts_from_s3()
+            if specialists is not None:
+                _catalog["specialists"] = specialists
+                _catalog["listed_at"] = time.monotonic()
+                # Forget contents whose object changed or disappeared
+                live = {(entry["key"], entry["etag"]) for entry in specialists.values()}
+                for key, (etag, _) in list(_prompt_contents.items()):
+                    if (key, etag) not in live:
+                        del _prompt_contents[key]
+        return dict(_catalog["specialists"] or {})
+
+def get_specialist_prompt(specialist_name: str):
+    """Prompt content for a specialist, fetched from S3 only when its ETag isn't cached; None if unknown"""
+    entry = get_specialist_catalog().get(specialist_name)
+    if entry is None:
+        return None
+    cached = _prompt_contents.get(entry["key"])
+    if cached is not None and cached[0] == entry["etag"]:
+        return cached[1]
+    try:
+        response = get_s3_client().get_object(Bucket=BUCKET_NAME, Key=entry["key"])
+        content = response["Body"].read().decode("utf-8")
+    except Exception as e:
+        print(f"Error reading {entry['key']} from S3: {e}")
+        return ""
+    _prompt_contents[entry["key"]] = (response.get("ETag", entry["etag"]), content)
+    return content
+
+def _store_specialist(specialist_name: str, key: str, etag: str, content: str):
+    """Write-through after save_specialist_prompt so the next lookup doesn't go back to S3"""
+    with _catalog_lock:
+        if _catalog["specialists"] is not None:
+            _catalog["specialists"][specialist_name] = {"key": key, "etag": etag}
+        _prompt_contents[key] = (etag, content)
 
 # -----------------------------------------------------------------------------
 # Specialists exploration
@@ -79,23 +122,21 @@ def _find_specialist_key(specialist_name: str) -> str:
 @tool
 def get_availables_specialists() -> str:
     """List all the available specialists for video analysis."""
-    specialists = _list_prompts_from_s3()
+    specialists = get_specialist_catalog()
     
     if not specialists:
         return "No specialists available. Prompts folder not found or empty."
     
-    return f"Available specialists: {', '.join(sorted(set(specialists)))}"
+    return f"Available specialists: {', '.join(sorted(specialists))}"
 
 
 @tool
 def explain_specialist_analysis(specialist_name: str, video_context: str) -> str:
     """Explain the analysis made by the specialist based on the video context."""
-    key = _find_specialist_key(specialist_name)
-    if not key:
+    specialist_prompt = get_specialist_prompt(specialist_name)
+    if specialist_prompt is None:
         return f"Specialist '{specialist_name}' not found."
     
-    specialist_prompt = _read_prompt_from_s3(key)
-    
     explanation_prompt = f"""Based on this specialist prompt:
 {specialist_prompt}
 
@@ -104,19 +145,17 @@ And this video context:
 
 Explain what kind of analysis this specialist would provide and what insights they would focus on."""
     
-    response = llm_light.invoke(explanation_prompt)
+    response = get_llm_light().invoke(explanation_prompt)
     return response.content
 
 
 @tool
 def consult_specialist(specialist_name: str, question: str, video_context: str) -> str:
     """Consult the specialist with the question provided."""
-    key = _find_specialist_key(specialist_name)
-    if not key:
+    specialist_prompt = get_specialist_prompt(specialist_name)
+    if specialist_prompt is None:
         return f"Specialist '{specialist_name}' not found."
     
-    specialist_prompt = _read_prompt_from_s3(key)
-    
     full_prompt = f"""{specialist_prompt}
 
 Video Context: {video_context}
@@ -124,10 +163,39 @@ Question: {question}
 
 Provide a detailed analysis based on your expertise."""
     
-    response = llm_light.invoke(full_prompt)
+    response = get_llm_light().invoke(full_prompt)
     return response.content
 
 
+# -----------------------------------------------------------------------------
+# Drill-down into the current video (job_id comes from the run config)
+# -----------------------------------------------------------------------------
+
+@tool
+def get_chunk_analysis(chunk_index: int, config: RunnableConfig) -> str:
+    """Get the full analysis (every specialist) of one chunk of the current video, by chunk index."""
+    job_id = config.get("configurable", {}).get("job_id")
+    if not job_id:
+        return "No video is selected in this conversation."
+    from shared import db_service
+    from shared.context_index import chunk_document
+    result = db_service.get_chunk_analyses(job_id, since_chunk=chunk_index - 1, limit=1)
+    analyses = result[0] if result else []
+    if not analyses or int(analyses[0]["chunk_index"]) != chunk_index:
+        return f"Chunk {chunk_index} not found."
+    return chunk_document(analyses[0]) or f"Chunk {chunk_index} has no analysis ({analyses[0].get('status')})."
+
+
+@tool
+def search_video_chunks(query: str, config: RunnableConfig) -> str:
+    """Search the chunk analyses of the current video and return the most relevant chunks in full."""
+    job_id = config.get("configurable", {}).get("job_id")
+    if not job_id:
+        return "No video is selected in this conversation."
+    from services.context_service import search_chunks
+    return search_chunks(job_id, query) or f"No chunks match '{query}'."
+
+
 # -----------------------------------------------------------------------------
 # New prompt creation
 # -----------------------------------------------------------------------------
@@ -144,21 +212,18 @@ Generate a comprehensive prompt that defines:
 3. Common errors to identify
 4. Recommendations format"""
     
-    response = llm_light.invoke(creation_prompt)
+    response = get_llm_light().invoke(creation_prompt)
     return response.content
 
 
 @tool
 def create_specialist_prompt(specialist_name: str, question: str, video_context: str = "") -> str:
     """Create a prompt for a specific specialist using a random existing prompt as template."""
-    specialists = _list_prompts_from_s3()
+    specialists = list(get_specialist_catalog())
     template_content = ""
     
     if specialists:
-        random_specialist = random.choice(specialists)
-        key = _find_specialist_key(random_specialist)
-        if key:
-            template_content = _read_prompt_from_s3(key)
+        template_content = get_specialist_prompt(random.choice(specialists)) or ""
     
     creation_prompt = f"""Create a specialist prompt for: {specialist_name}
 
@@ -170,7 +235,7 @@ Question to address: {question}
 
 Generate a prompt with: expertise definition, analysis points, output format, and technical knowledge."""
     
-    response = llm_light.invoke(creation_prompt)
+    response = get_llm_light().invoke(creation_prompt)
     return response.content
 
 
@@ -179,7 +244,8 @@ def save_specialist_prompt(specialist_name: str, prompt_content: str) -> str:
     """Save the specialist prompt to the S3 bucket."""
     key = f"{PROMPTS_PREFIX}{specialist_name}.txt"
     try:
-        s3_client.put_object(Bucket=BUCKET_NAME, Key=key, Body=prompt_content.encode("utf-8"))
+        response = get_s3_client().put_object(Bucket=BUCKET_NAME, Key=key, Body=prompt_content.encode("utf-8"))
+        _store_specialist(specialist_name, key, response["ETag"], prompt_content)
         return f"Specialist prompt '{specialist_name}' saved successfully to S3."
     except Exception as e:
         return f"Error saving specialist prompt: {str(e)}"
@@ -212,26 +278,151 @@ prompt_template = ChatPromptTemplate.from_messages(
 )
 
 # No checkpointer or store as requested
-react_agent = create_react_agent(
-    model=llm_orchestrator,
-    tools=[
-        get_availables_specialists, 
-        consult_specialist, 
-        explain_specialist_analysis,
-        create_prompt_for_other_topic, 
-        create_specialist_prompt, 
-        save_specialist_prompt
-    ],
-    debug=False,
-)
+@lazy_init("react_agent")
+def get_react_agent():
+    return create_react_agent(
+        model=get_llm_orchestrator(),
+        tools=[
+            get_availables_specialists, 
+            consult_specialist, 
+            explain_specialist_analysis,
+            create_prompt_for_other_topic, 
+            create_specialist_prompt, 
+            save_specialist_prompt,
+            get_chunk_analysis,
+            search_video_chunks
+        ],
+        debug=False,
+    )
+
+
+THINKING_RE = re.compile(r'<thinking>.*?</thinking>', flags=re.DOTALL)
 
 
-def call_agent(user_query: str, video_context_analysis: str = ""):
+def _run_config(job_id: str) -> dict:
+    # Read by the drill-down tools
+    return {"configurable": {"job_id": job_id}}
+
+
+def call_agent(user_query: str, video_context_analysis: str = "", job_id: str = ""):
     # Stateless execution
-    ai_response = react_agent.invoke(input=prompt_template.invoke({
+    ai_response = get_react_agent().invoke(input=prompt_template.invoke({
         "video_context_analysis": video_context_analysis, "user_query": user_query
-    }))['messages'][-1].content
+    }), config=_run_config(job_id))['messages'][-1].content
 
-    ai_response = re.sub(r'<thinking>.*?</thinking>', '', ai_response, flags=re.DOTALL).strip()
-    
-    return ai_response
+    return THINKING_RE.sub('', ai_response).strip()
+
+
+async def acall_agent(user_query: str, video_context_analysis: str = "", job_id: str = ""):
+    """Same as call_agent without blocking the event loop (sync tools run in a thread pool)"""
+    result = await get_react_agent().ainvoke(input=prompt_template.invoke({
+        "video_context_analysis": video_context_analysis, "user_query": user_query
+    }), config=_run_config(job_id))
+
+    return THINKING_RE.sub('', result['messages'][-1].content).strip()
+
+
+class ThinkingStripper:
+    """
+    Incremental THINKING_RE.sub('', text).strip() for streamed text: feed() returns the
+    part that is safe to emit, holding back partial tags, thinking blocks and trailing spaces.
+    """
+    OPEN, CLOSE = "<thinking>", "</thinking>"
+
+    def __init__(self):
+        self._buffer = ""
+        self._inside = False
+        self._started = False
+        self._pending_space = ""
+
+    def feed(self, text: str) -> str:
+        self._buffer += text
+        out = []
+        while self._buffer:
+            if self._inside:
+                end = self._buffer.find(self.CLOSE)
+                if end < 0:
+                    break
+                self._buffer = self._buffer[end + len(self.CLOSE):]
+                self._inside = False
+            else:
+                start = self._buffer.find(self.OPEN)
+                if start >= 0:
+                    out.append(self._buffer[:start])
+                    self._buffer = self._buffer[start + len(self.OPEN):]
+                    self._inside = True
+                    continue
+                # Keep a suffix that could be the beginning of "<thinking>"
+                keep = next((n for n in range(len(self.OPEN) - 1, 0, -1) if self._buffer.endswith(self.OPEN[:n])), 0)
+                out.append(self._buffer[:len(self._buffer) - keep])
+                self._buffer = self._buffer[len(self._buffer) - keep:]
+                break
+        return self._emit("".join(out))
+
+    def flush(self) -> str:
+        # An unterminated block is not a match for the regex, so it is kept
+        rest = (self.OPEN if self._inside else "") + self._buffer
+        self._buffer, self._inside = "", False
+        return self._emit(rest, final=True)
+
+    def _emit(self, text: str, final: bool = False) -> str:
+        if not self._started:
+            text = text.lstrip()
+            self._started = bool(text)
+        text = self._pending_space + text
+        stripped = text.rstrip()
+        self._pending_space = "" if final else text[len(stripped):]
+        return stripped
+
+
+def _message_text(content) -> str:
+    """Text of a message chunk (Bedrock Converse sends a list of content blocks)"""
+    if isinstance(content, str):
+        return content
+    return "".join(block.get("text", "") for block in content if isinstance(block, dict) and block.get("type") == "text")
+
+
+async def astream_agent(user_query: str, video_context_analysis: str = "", job_id: str = ""):
+    """
+    Run the agent and yield events as they happen:
+      {"type": "token", "text"}                 orchestrator tokens, <thinking> blocks removed
+      {"type": "tool_call", "name", "args"}     when the orchestrator decides to call a tool
+      {"type": "tool_result", "name", "content"}
+      {"type": "done", "response"}              final answer, same as acall_agent
+    """
+    agent_input = prompt_template.invoke({
+        "video_context_analysis": video_context_analysis, "user_query": user_query
+    })
+    strippers = {}
+    final_content = ""
+
+    async for mode, payload in get_react_agent().astream(agent_input, config=_run_config(job_id), stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            chunk, metadata = payload
+            # Tokens of the LLMs used inside tools are not part of the answer
+            if metadata.get("langgraph_node") != "agent" or not isinstance(chunk, AIMessageChunk):
+                continue
+            stripper = strippers.setdefault(chunk.id, ThinkingStripper())
+            text = stripper.feed(_message_text(chunk.content))
+            if text:
+                yield {"type": "token", "text": text}
+            continue
+
+        for node, update in payload.items():
+            for message in (update or {}).get("messages", []):
+                if isinstance(message, AIMessage):
+                    stripper = strippers.pop(message.id, None)
+                    text = stripper.flush() if stripper else ""
+                    if text:
+                        yield {"type": "token", "text": text}
+                    for tool_call in message.tool_calls:
+                        yield {"type": "tool_call", "name": tool_call["name"], "args": tool_call["args"]}
+                    final_content = _message_text(message.content)
+                elif isinstance(message, ToolMessage):
+                    yield {"type": "tool_result", "name": message.name, "content": _message_text(message.content)}
+
+    for stripper in strippers.values():
+        text = stripper.flush()
+        if text:
+            yield {"type": "token", "text": text}
+    yield {"type": "done", "response": THINKING_RE.sub('', final_content).strip()}
@@ -0,0 +1,80 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+import boto3
+from botocore.exceptions import ClientError
+from shared import db_service
+from shared.context_index import build_index, build_context, context_index_key, context_stats, format_docs, search
+from shared.lazy import lazy_init
+
+BUCKET_NAME = os.getenv("BUCKET_NAME")
+aws_endpoint = os.getenv("AWS_ENDPOINT_URL")
+# Chunks passed to the agent per question
+AGENT_CONTEXT_TOP_K = int(os.getenv("AGENT_CONTEXT_TOP_K", "4"))
+# Indexes of finished jobs kept in memory across warm invocations
+INDEX_CACHE_SIZE = int(os.getenv("AGENT_CONTEXT_INDEX_CACHE", "32"))
+
+_index_cache = OrderedDict()
+_index_lock = threading.Lock()
+
+@lazy_init("context_s3_client")
+def _get_s3():
+    if aws_endpoint:
+        return boto3.client("s3", endpoint_url=aws_endpoint)
+    return boto3.client("s3")
+
+def _load_stored_index(job_id: str):
+    """Index written by the aggregator, or None if the job hasn't been aggregated yet"""
+    try:
+        response = _get_s3().get_object(Bucket=BUCKET_NAME, Key=context_index_key(job_id))
+        return json.loads(response["Body"].read())
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            print(f"Error reading context index for job {job_id}: {e}")
+        return None
+
+def _get_index(job_id: str):
+    with _index_lock:
+        if job_id in _index_cache:
+            _index_cache.move_to_end(job_id)
+            return _index_cache[job_id]
+
+    index = _load_stored_index(job_id)
+    if index is None:
+        # Analysis still running (or aggregated before indexes existed): index what
+        # is there now, without caching it since more chunks may arrive
+        return build_index(db_service.list_chunk_analyses(job_id))
+
+    # Stored indexes never change once the job is aggregated
+    with _index_lock:
+        _index_cache[job_id] = index
+        while len(_index_cache) > INDEX_CACHE_SIZE:
+            _index_cache.popitem(last=False)
+    return index
+
+def get_agent_context(job_id: str, question: str, k: int = AGENT_CONTEXT_TOP_K):
+    """
+    (context, stats) for a question, or None if the job doesn't exist. Once the job is
+    aggregated the context is its precomputed digest (the agent drills into chunks with
+    its tools); before that, the top-k chunks for the question.
+    """
+    job = db_service.get_job_fields(job_id, ["job_id", "context_digest"])
+    if not job:
+        return None
+    index = _get_index(job_id)
+    if job.get("context_digest"):
+        context = job["context_digest"]
+        stats = {"source": "digest", **context_stats(index, context, [])}
+    else:
+        context, stats = build_context(index, question, k)
+        stats = {"source": "chunks", **stats}
+    print(
+        f"Agent context for job {job_id} ({stats['source']}): chunks {stats['chunks']} of {stats['total_chunks']}, "
+        f"{stats['context_tokens']} tokens instead of {stats['full_tokens']} ({stats['saved_pct']}% saved)"
+    )
+    return context, stats
+
+def search_chunks(job_id: str, query: str, k: int = AGENT_CONTEXT_TOP_K) -> str:
+    """Full text of the chunks most relevant to `query` (for the agent's search tool)"""
+    return format_docs(search(_get_index(job_id), query, k))
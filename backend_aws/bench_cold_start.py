@@ -0,0 +1,88 @@
+"""
+Cold-start import benchmark for the Lambda handlers.
+
+Imports each handler module in a fresh interpreter (like a new Lambda container)
+and reports the import wall time plus the heaviest top-level imports
+(python -X importtime). With --max-ms it exits non-zero when a handler goes over
+budget, so import-time regressions can be caught in CI.
+
+Usage: python3 bench_cold_start.py [--runs 5] [--top 8] [--max-ms 1500]
+"""
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BASE_DIR = Path(__file__).parent
+
+# (label, handler directory, module to import)
+HANDLERS = [
+    ("api", "api_handler", "handler"),
+    ("splitter", "splitter_handler", "handler"),
+    ("analyzer", "analyzer_handler", "handler"),
+    ("aggregator", "analyzer_handler", "aggregator"),
+]
+
+# Enough configuration for the modules to import without touching AWS
+STUB_ENV = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "bench",
+    "AWS_SECRET_ACCESS_KEY": "bench",
+    "BUCKET_NAME": "bench-bucket",
+    "TABLE_NAME": "bench-table",
+    "GEMINI_API_KEY": "bench",
+}
+
+IMPORTTIME_RE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+def measure(handler_dir: str, module: str):
+    """Import the module once in a new interpreter; returns (wall ms, {top-level import: cumulative ms})"""
+    env = {**os.environ, **STUB_ENV, "PYTHONPATH": str(BASE_DIR)}
+    code = (
+        "import time; start = time.perf_counter(); "
+        f"import {module}; "
+        "print((time.perf_counter() - start) * 1000)"
+    )
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=BASE_DIR / handler_dir, env=env, capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {handler_dir}/{module} failed:\n{result.stderr[-2000:]}")
+
+    top_level = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_RE.match(line)
+        # Only direct imports (one space of indentation) are reported
+        if match and len(match.group(3)) == 1:
+            top_level[match.group(4)] = int(match.group(2)) / 1000
+    return float(result.stdout.strip().splitlines()[-1]), top_level
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="Fresh interpreters per handler (median is reported)")
+    parser.add_argument("--top", type=int, default=8, help="Heaviest top-level imports to show")
+    parser.add_argument("--max-ms", type=float, default=None, help="Fail if a handler's median import time is above this")
+    args = parser.parse_args()
+
+    over_budget = []
+    for label, handler_dir, module in HANDLERS:
+        runs = [measure(handler_dir, module) for _ in range(args.runs)]
+        median_ms = statistics.median(wall for wall, _ in runs)
+        print(f"\n{label:<11} {handler_dir}/{module}.py  median {median_ms:8.1f} ms  "
+              f"(min {min(w for w, _ in runs):.1f}, max {max(w for w, _ in runs):.1f}, runs {args.runs})")
+        _, top_level = runs[-1]
+        for name, ms in sorted(top_level.items(), key=lambda kv: -kv[1])[:args.top]:
+            print(f"    {ms:8.1f} ms  {name}")
+        if args.max_ms is not None and median_ms > args.max_ms:
+            over_budget.append(label)
+
+    if over_budget:
+        print(f"\nOver the {args.max_ms:.0f} ms budget: {', '.join(over_budget)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
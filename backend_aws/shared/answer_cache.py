@@ -0,0 +1,114 @@
+import hashlib
+import os
+import re
+import time
+import unicodedata
+
+from shared import db_service
+
+# Per-job cache of agent answers. Questions are normalized (case, accents,
+# punctuation, filler words) and fingerprinted (word order included) for exact hits;
+# near-duplicates ("what were the main errors?" / "main errors?") match by
+# character-trigram Jaccard similarity, but only when their numbers and single-letter
+# names are the same and their shared words keep the same order ("round 1" is not
+# "round 2", "did A submit B" is not "did B submit A"). An entry is only valid for the
+# context version it was answered with, so a re-aggregated job never serves old answers.
+# Entries live in DynamoDB (sk = "ANSWER#<fingerprint>") so every Lambda container
+# shares them; hit/miss counters are kept on the job header item.
+
+ANSWER_CACHE_TTL_S = int(os.getenv("ANSWER_CACHE_TTL_S", str(24 * 3600)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0.9"))
+
+FILLER_WORDS = {
+    # es
+    "el", "la", "los", "las", "un", "una", "de", "del", "en", "que", "me", "por", "favor", "puedes",
+    "podrias", "dime", "cual", "cuales", "fue", "fueron", "es", "son", "hay", "al", "lo", "se", "su", "sus",
+    # en
+    "the", "an", "of", "in", "and", "please", "can", "could", "you", "tell", "me", "what", "which",
+    "was", "were", "is", "are", "there", "to", "his", "her", "their",
+}
+
+def normalize_question(question: str) -> str:
+    text = unicodedata.normalize("NFKD", question.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    words = [w for w in re.findall(r"[a-z0-9]+", text) if w not in FILLER_WORDS]
+    return " ".join(words)
+
+def question_fingerprint(normalized: str) -> str:
+    # Word order matters: "did a submit b" is not "did b submit a"
+    return hashlib.sha1(normalized.encode("utf-8")).hexdigest()[:16]
+
+def context_version(context: str) -> str:
+    return hashlib.sha1(context.encode("utf-8")).hexdigest()[:16]
+
+def _trigrams(normalized: str) -> set:
+    padded = f" {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def similarity(a: str, b: str) -> float:
+    """Jaccard similarity of the character trigrams of two normalized questions"""
+    ta, tb = _trigrams(a), _trigrams(b)
+    return len(ta & tb) / len(ta | tb) if ta and tb else 0.0
+
+def key_tokens(normalized: str) -> list:
+    """Numbers and single letters (round 2, fighter B), in order: they must match exactly"""
+    return [w for w in normalized.split() if w.isdigit() or len(w) == 1]
+
+def same_order(a: str, b: str) -> bool:
+    """Whether the words two questions share appear in the same order in both (names not swapped)"""
+    words_a, words_b = a.split(), b.split()
+    shared = set(words_a) & set(words_b)
+    return [w for w in words_a if w in shared] == [w for w in words_b if w in shared]
+
+def best_match(normalized: str, entries: list, threshold: float = ANSWER_CACHE_SIMILARITY):
+    """(entry, score) of the most similar cached question at or above the threshold, else (None, 0)"""
+    fingerprint = question_fingerprint(normalized)
+    keys = key_tokens(normalized)
+    best, best_score = None, 0.0
+    for entry in entries:
+        if entry["fingerprint"] == fingerprint:
+            score = 1.0
+        elif key_tokens(entry["question"]) != keys or not same_order(normalized, entry["question"]):
+            continue
+        else:
+            score = similarity(normalized, entry["question"])
+        if score > best_score:
+            best, best_score = entry, score
+    return (best, best_score) if best_score >= threshold else (None, 0.0)
+
+def lookup(job_id: str, question: str, version: str):
+    """Cached answer entry for a question (exact or near-duplicate), or None. Counts the hit/miss."""
+    now = int(time.time())
+    entries = [
+        entry for entry in db_service.get_cached_answers(job_id)
+        if entry["version"] == version and entry["expires_at"] > now
+    ]
+    entry, score = best_match(normalize_question(question), entries)
+    db_service.record_answer_cache(job_id, hit=entry is not None, saved_ms=entry["latency_ms"] if entry else 0)
+    if entry:
+        print(f"Answer cache hit for job {job_id} (similarity {score:.2f}): '{question}' ~ '{entry['question']}'")
+        return {**entry, "similarity": round(score, 3)}
+    return None
+
+def store(job_id: str, question: str, version: str, answer: str, latency_ms: int):
+    normalized = normalize_question(question)
+    if not normalized:
+        return
+    db_service.put_cached_answer(
+        job_id, question_fingerprint(normalized), normalized, answer, version, latency_ms,
+        expires_at=int(time.time()) + ANSWER_CACHE_TTL_S
+    )
+
+def get_stats(job_id: str):
+    counters = db_service.get_job_fields(job_id, ["job_id", "answer_cache_hits", "answer_cache_misses", "answer_cache_saved_ms"])
+    if counters is None:
+        return None
+    hits = int(counters.get("answer_cache_hits", 0))
+    misses = int(counters.get("answer_cache_misses", 0))
+    return {
+        "job_id": job_id,
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits / (hits + misses), 3) if hits + misses else 0.0,
+        "latency_saved_ms": int(counters.get("answer_cache_saved_ms", 0)),
+    }
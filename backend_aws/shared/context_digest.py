@@ -0,0 +1,80 @@
+import json
+
+# Compact, precomputed view of a finished job for the chat agent: tactical summary,
+# per-discipline totals and key moments from the SegmentSummary list, one line per
+# chunk with its index (so the agent can drill into it with get_chunk_analysis).
+# Same builder as backend/services/context_digest.py.
+
+DIGEST_KEY_MOMENTS = 8
+DISCIPLINES = (("Striking", "striking_s"), ("Grappling", "grappling_s"), ("Submission", "submission_s"), ("Movement", "movement_s"))
+
+def _mmss(seconds) -> str:
+    seconds = int(seconds or 0)
+    return f"{seconds // 60:02d}:{seconds % 60:02d}"
+
+def _label(value) -> str:
+    # Enum members (models dumped without mode="json") are shown by value
+    return str(getattr(value, "value", value) if value is not None else "")
+
+def _absolute_timestamp(segment: dict, timestamp: str) -> str:
+    """Highlight timestamps are relative to the segment; the digest uses video time"""
+    try:
+        minutes, seconds = timestamp.split(":")
+        return _mmss(int(segment.get("start_s", 0)) + int(minutes) * 60 + int(seconds))
+    except (AttributeError, ValueError):
+        return timestamp or "--:--"
+
+def build_context_digest(segments: list, tactical_summary: dict = None, total_chunks: int = None, analysis_status: str = None) -> str:
+    segments = sorted(
+        (json.loads(s) if isinstance(s, str) else s for s in segments if s),
+        key=lambda s: int(s.get("segment_index", 0))
+    )
+    total_chunks = total_chunks or len(segments)
+    lines = [f"RESUMEN DEL VIDEO ({len(segments)}/{total_chunks} chunks analizados, estado: {analysis_status or 'desconocido'})"]
+
+    if tactical_summary:
+        lines.append("\nSíntesis táctica:")
+        for label, key in (("Recomendación", "recomendacion_tactica"), ("Foco", "foco_disciplina"),
+                           ("Riesgo principal", "riesgo_principal"), ("Oportunidad principal", "oportunidad_principal")):
+            if tactical_summary.get(key):
+                lines.append(f"- {label}: {_label(tactical_summary[key])}")
+        for label, key in (("Fortalezas", "fortalezas_top3"), ("Debilidades", "debilidades_top3"), ("Ajustes", "ajustes_top3")):
+            if tactical_summary.get(key):
+                lines.append(f"- {label}: {'; '.join(tactical_summary[key])}")
+
+    if segments:
+        intentos = sum(int(s.get("intentos", 0)) for s in segments)
+        exitos = sum(int(s.get("exitos", 0)) for s in segments)
+        discipline_s = {name: sum(int(s.get(key, 0)) for s in segments) for name, key in DISCIPLINES}
+        lines.append("\nEstadísticas globales:")
+        lines.append(
+            f"- Acciones: {sum(int(s.get('acciones_total', 0)) for s in segments)}, intentos: {intentos}, "
+            f"éxitos: {exitos}, efectividad: {(exitos / intentos if intentos else 0):.0%}"
+        )
+        lines.append("- Segundos por disciplina: " + ", ".join(f"{name} {secs}s" for name, secs in discipline_s.items()))
+        lines.append(
+            f"- Control en clinch: {sum(int(s.get('clinch_control_s', 0)) for s in segments)}s, "
+            f"amenaza de sumisión: {sum(int(s.get('submission_threat_s', 0)) for s in segments)}s"
+        )
+
+        moments = [(h, s) for s in segments for h in s.get("highlights", [])]
+        moments.sort(key=lambda pair: -int(pair[0].get("impacto", 0)))
+        if moments:
+            lines.append("\nMomentos clave:")
+            for highlight, segment in moments[:DIGEST_KEY_MOMENTS]:
+                lines.append(
+                    f"- {_absolute_timestamp(segment, highlight.get('timestamp'))} [chunk {segment.get('segment_index')}] "
+                    f"{_label(highlight.get('disciplina'))} {_label(highlight.get('tipo'))} (impacto {highlight.get('impacto', '?')}): "
+                    f"{highlight.get('titulo', '')} - {highlight.get('descripcion', '')}"
+                )
+
+        lines.append("\nChunks (usa get_chunk_analysis(chunk_index) para ver el análisis completo de uno):")
+        for s in segments:
+            dominant = max(DISCIPLINES, key=lambda d: int(s.get(d[1], 0)))[0]
+            lines.append(
+                f"- chunk {s.get('segment_index')} {_mmss(s.get('start_s'))}-{_mmss(s.get('end_s'))}: "
+                f"{s.get('acciones_total', 0)} acciones, {float(s.get('success_rate', 0)):.0%} éxito, {dominant}"
+                + (f", {len(s['highlights'])} momentos" if s.get("highlights") else "")
+            )
+
+    return "\n".join(lines)
@@ -0,0 +1,130 @@
+import json
+import math
+import re
+import unicodedata
+from collections import Counter
+
+# BM25 index over the chunk analyses of a job, so the chat agent gets only the
+# chunks relevant to the question instead of the whole stringified analysis.
+# The index is plain JSON: built by the aggregator when the analysis completes
+# and stored in S3 (context_index_key). A job has at most a few hundred chunks,
+# so scoring in pure Python is cheap.
+
+INDEX_VERSION = 1
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Chunk fields with analysis text, in the order they are shown to the agent
+TEXT_FIELDS = ("head_coach", "general_analyst", "striking", "grappling", "submission", "movement")
+
+STOPWORDS = {
+    # es
+    "de", "la", "el", "en", "y", "a", "los", "las", "del", "se", "un", "una", "por", "con", "para",
+    "es", "al", "lo", "que", "su", "sus", "como", "mas", "pero", "o", "si", "no", "le", "les", "este",
+    "esta", "hay", "fue", "son", "muy", "sin", "sobre", "entre", "cuando", "donde", "cual", "qué",
+    # en
+    "the", "of", "and", "to", "in", "is", "it", "on", "for", "with", "as", "at", "by", "an", "be",
+    "this", "that", "are", "was", "what", "how", "which", "did", "does", "do", "his", "her", "my",
+}
+
+def context_index_key(job_id: str) -> str:
+    return f"context/{job_id}/index.json"
+
+def estimate_tokens(text: str) -> int:
+    """~4 characters per token, enough to compare prompt sizes"""
+    return (len(text) + 3) // 4
+
+def tokenize(text: str) -> list:
+    # Accents are dropped so "sumisión" and "sumision" match
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return [t for t in re.findall(r"[a-z0-9]+", text) if len(t) > 1 and t not in STOPWORDS]
+
+def chunk_document(chunk: dict) -> str:
+    """Searchable text of a chunk analysis: specialist texts plus segment highlights"""
+    parts = [f"{field}: {chunk[field]}" for field in TEXT_FIELDS if chunk.get(field)]
+    summary = chunk.get("segment_summary")
+    if isinstance(summary, str):
+        try:
+            summary = json.loads(summary)
+        except ValueError:
+            summary = None
+    for highlight in (summary or {}).get("highlights", []):
+        parts.append(
+            f"highlight {highlight.get('timestamp', '')} [{highlight.get('disciplina', '')}] "
+            f"{highlight.get('titulo', '')}: {highlight.get('descripcion', '')}"
+        )
+    return "\n".join(parts)
+
+def build_index(chunk_analyses: list) -> dict:
+    docs = []
+    df = Counter()
+    for chunk in sorted(chunk_analyses, key=lambda c: int(c["chunk_index"])):
+        text = chunk_document(chunk)
+        if not text:
+            continue
+        tf = Counter(tokenize(text))
+        docs.append({"chunk_index": int(chunk["chunk_index"]), "text": text, "tf": dict(tf), "length": sum(tf.values())})
+        df.update(tf.keys())
+    return {
+        "version": INDEX_VERSION,
+        "docs": docs,
+        "df": dict(df),
+        "avg_length": (sum(d["length"] for d in docs) / len(docs)) if docs else 0.0,
+        # What the agent used to receive: the whole chunk_analyses list, stringified
+        "full_tokens": estimate_tokens(str(chunk_analyses)),
+    }
+
+def search(index: dict, question: str, k: int) -> list:
+    """Top-k docs by BM25 score (only docs sharing at least one term with the question)"""
+    docs = index["docs"]
+    n = len(docs)
+    terms = set(tokenize(question))
+    scored = []
+    for doc in docs:
+        score = 0.0
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * doc["length"] / (index["avg_length"] or 1))
+        for term in terms:
+            tf = doc["tf"].get(term)
+            if not tf:
+                continue
+            df = index["df"][term]
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        if score > 0:
+            scored.append((score, doc))
+    scored.sort(key=lambda pair: (-pair[0], pair[1]["chunk_index"]))
+    return [doc for _, doc in scored[:k]]
+
+def _spread(docs: list, k: int) -> list:
+    """k chunks evenly spaced over the fight, for questions with no matching terms ("resume la pelea")"""
+    if len(docs) <= k:
+        return list(docs)
+    step = len(docs) / k
+    return [docs[int(i * step)] for i in range(k)]
+
+def build_context(index: dict, question: str, k: int):
+    """
+    (context, stats): the selected chunks in chronological order, formatted for the
+    agent prompt, and how many tokens that saves against the full analysis.
+    """
+    selected = search(index, question, k) or _spread(index["docs"], k)
+    context = format_docs(selected)
+    return context, context_stats(index, context, [doc["chunk_index"] for doc in selected])
+
+def format_docs(docs: list) -> str:
+    """Chunks in chronological order, as shown to the agent"""
+    return "\n\n".join(f"[Chunk {doc['chunk_index']}]\n{doc['text']}" for doc in sorted(docs, key=lambda d: d["chunk_index"]))
+
+def context_stats(index: dict, context: str, chunks: list) -> dict:
+    """Token savings of `context` against the full stringified analysis"""
+    context_tokens = estimate_tokens(context)
+    full_tokens = index["full_tokens"]
+    return {
+        "chunks": chunks,
+        "total_chunks": len(index["docs"]),
+        "context_tokens": context_tokens,
+        "full_tokens": full_tokens,
+        "saved_tokens": max(full_tokens - context_tokens, 0),
+        "saved_pct": round(100 * max(full_tokens - context_tokens, 0) / full_tokens, 1) if full_tokens else 0.0,
+    }
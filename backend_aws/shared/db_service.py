@@ -3,18 +3,56 @@ import os
 import json
 from datetime import datetime, timedelta
 from decimal import Decimal
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
 
-# Initialize DynamoDB resource
-# Use endpoint_url if provided (for local testing)
-dynamodb_endpoint = os.getenv("DYNAMODB_ENDPOINT")
-if dynamodb_endpoint:
-    dynamodb = boto3.resource('dynamodb', endpoint_url=dynamodb_endpoint)
-else:
-    dynamodb = boto3.resource('dynamodb')
+from shared.lazy import lazy_init
 
-TABLE_NAME = os.getenv("TABLE_NAME", "pvhack-jobs")
-table = dynamodb.Table(TABLE_NAME)
+TABLE_NAME = os.getenv("TABLE_NAME", "pvhack-jobs-v2")
+
+@lazy_init("dynamodb_table")
+def _get_table():
+    # Initialize DynamoDB resource on first use
+    # Use endpoint_url if provided (for local testing)
+    dynamodb_endpoint = os.getenv("DYNAMODB_ENDPOINT")
+    if dynamodb_endpoint:
+        dynamodb = boto3.resource('dynamodb', endpoint_url=dynamodb_endpoint)
+    else:
+        dynamodb = boto3.resource('dynamodb')
+    return dynamodb.Table(TABLE_NAME)
+
+# Table layout: one header item per job (sk = "JOB") with status and counters,
+# plus one item per chunk analysis (sk = "CHUNK#00007") so the header never grows.
+JOB_SK = "JOB"
+CHUNK_SK_PREFIX = "CHUNK#"
+# Completed sub-steps of a chunk analysis, for resuming on SQS redelivery:
+# sk = "STEP#00007#<prompt_version>#<step>"
+STEP_SK_PREFIX = "STEP#"
+# Cached chat answers of the job: sk = "ANSWER#<question fingerprint>"
+ANSWER_SK_PREFIX = "ANSWER#"
+# Attributes added by the layout that are not part of a chunk analysis
+_CHUNK_ITEM_KEYS = ("job_id", "sk", "expires_at")
+
+def _job_key(job_id: str) -> dict:
+    return {"job_id": job_id, "sk": JOB_SK}
+
+def _chunk_sk(chunk_index: int) -> str:
+    # Zero-padded so the lexical sort key order matches chunk_index order
+    return f"{CHUNK_SK_PREFIX}{int(chunk_index):05d}"
+
+def _expires_at() -> int:
+    return int((datetime.now() + timedelta(days=30)).timestamp())
+
+def _to_dynamo(value):
+    """DynamoDB rejects floats: round-trip through JSON turning them into Decimal"""
+    return json.loads(json.dumps(value), parse_float=Decimal)
+
+def _from_dynamo(value):
+    """Decimal -> int/float, for values returned as free-form JSON"""
+    return json.loads(json.dumps(value, default=lambda d: int(d) if d == d.to_integral_value() else float(d)))
+
+def _chunk_from_item(item: dict) -> dict:
+    return {k: v for k, v in item.items() if k not in _CHUNK_ITEM_KEYS}
 
 def create_job(job_id: str, s3_key: str):
     """Create a new job in DynamoDB"""
@@ -24,37 +62,243 @@ def create_job(job_id: str, s3_key: str):
         
         item = {
             "job_id": job_id,
+            "sk": JOB_SK,
             "s3_key": s3_key,
             "split_status": "pending",
             "analysis_status": "pending",
             "total_chunks": 0,
             "completed_chunks": 0,
             "analyzed_chunks": 0,
+            "failed_chunks": 0,
             "split_pct": Decimal(0),
             "analysis_pct": Decimal(0),
             "chunks": [],
-            "chunk_analyses": [],
             "created_at": now.isoformat(),
             "expires_at": expires_at
         }
         
-        table.put_item(Item=item)
-        return item
+        _get_table().put_item(Item=item)
+        return {**item, "chunk_analyses": []}
     except ClientError as e:
         print(f"Error creating job: {e}")
         raise e
 
+def _analysis_pct(analyzed_chunks: int, total_chunks: int) -> Decimal:
+    if not total_chunks:
+        return Decimal(0)
+    return Decimal(str(min(analyzed_chunks / total_chunks, 1) * 100))
+
+def _with_analysis_pct(item):
+    """analysis_pct is derived from the atomic counters instead of being stored"""
+    if item and "analyzed_chunks" in item and "total_chunks" in item:
+        item["analysis_pct"] = _analysis_pct(int(item["analyzed_chunks"]), int(item["total_chunks"]))
+    return item
+
 def get_job(job_id: str):
-    """Get job details from DynamoDB"""
+    """Get job details from DynamoDB, with chunk_analyses assembled from the chunk items"""
     try:
-        response = table.get_item(Key={"job_id": job_id})
-        return response.get("Item")
+        response = _get_table().get_item(Key=_job_key(job_id))
+        job = response.get("Item")
+        if not job:
+            return None
+        job["chunk_analyses"] = list(_query_chunk_items(job_id))
+        return _with_analysis_pct(job)
     except ClientError as e:
         print(f"Error getting job: {e}")
         raise e
 
+def get_job_fields(job_id: str, fields):
+    """Get only the given top-level attributes of a job (ProjectionExpression)"""
+    fields = list(fields)
+    if "analysis_pct" in fields:
+        fields += ["analyzed_chunks", "total_chunks"]
+    try:
+        names = {f"#f{i}": field for i, field in enumerate(dict.fromkeys(fields))}
+        response = _get_table().get_item(
+            Key=_job_key(job_id),
+            ProjectionExpression=", ".join(names),
+            ExpressionAttributeNames=names
+        )
+        return _with_analysis_pct(response.get("Item"))
+    except ClientError as e:
+        print(f"Error getting job fields: {e}")
+        raise e
+
+def _query_chunk_items(job_id: str, since_chunk: int = -1, limit: int = None, fields=None, consistent: bool = False):
+    """Yield chunk analyses with chunk_index > since_chunk in order, following Query pagination"""
+    query_kwargs = {
+        "KeyConditionExpression": Key("job_id").eq(job_id) & Key("sk").between(
+            _chunk_sk(since_chunk + 1), f"{CHUNK_SK_PREFIX}99999"
+        ),
+        "ConsistentRead": consistent,
+    }
+    if fields:
+        names = {f"#f{i}": field for i, field in enumerate(fields)}
+        query_kwargs["ProjectionExpression"] = ", ".join(names)
+        query_kwargs["ExpressionAttributeNames"] = names
+    returned = 0
+    while True:
+        if limit is not None:
+            query_kwargs["Limit"] = limit - returned
+        response = _get_table().query(**query_kwargs)
+        for item in response.get("Items", []):
+            yield _chunk_from_item(item)
+            returned += 1
+        if "LastEvaluatedKey" not in response or (limit is not None and returned >= limit):
+            return
+        query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+
+def get_chunk_analyses(job_id: str, since_chunk: int = -1, limit: int = 20):
+    """
+    Return (analyses, next_since_chunk) for chunks with chunk_index > since_chunk,
+    ordered by chunk_index, or None if the job doesn't exist.
+    """
+    if not get_job_fields(job_id, ["job_id"]):
+        return None
+    try:
+        # One extra item tells whether there is a next page
+        analyses = list(_query_chunk_items(job_id, since_chunk=since_chunk, limit=limit + 1))
+    except ClientError as e:
+        print(f"Error querying chunk analyses: {e}")
+        raise e
+    page = analyses[:limit]
+    next_since_chunk = int(page[-1]["chunk_index"]) if len(analyses) > limit else None
+    return page, next_since_chunk
+
+def list_chunk_analyses(job_id: str, consistent: bool = False) -> list:
+    """All chunk analyses of a job, in chunk order"""
+    try:
+        return list(_query_chunk_items(job_id, consistent=consistent))
+    except ClientError as e:
+        print(f"Error querying chunk analyses: {e}")
+        raise e
+
+def put_chunk_analyses(job_id: str, chunk_results: list):
+    """Store chunk analyses as their own items (BatchWriteItem, 25 per request)"""
+    expires_at = _expires_at()
+    try:
+        # overwrite_by_pkeys drops duplicates of the same chunk inside one batch
+        with _get_table().batch_writer(overwrite_by_pkeys=["job_id", "sk"]) as batch:
+            for chunk_result in chunk_results:
+                batch.put_item(Item={
+                    **chunk_result,
+                    "job_id": job_id,
+                    "sk": _chunk_sk(chunk_result["chunk_index"]),
+                    "expires_at": expires_at
+                })
+    except ClientError as e:
+        print(f"Error writing chunk analyses: {e}")
+        raise e
+
+def _step_sk_prefix(chunk_index: int, prompt_version: str) -> str:
+    return f"{STEP_SK_PREFIX}{int(chunk_index):05d}#{prompt_version}#"
+
+def get_chunk_steps(job_id: str, chunk_index: int, prompt_version: str) -> dict:
+    """Completed sub-steps of a chunk analysis as {step: value}"""
+    prefix = _step_sk_prefix(chunk_index, prompt_version)
+    steps = {}
+    query_kwargs = {
+        "KeyConditionExpression": Key("job_id").eq(job_id) & Key("sk").begins_with(prefix),
+        "ConsistentRead": True
+    }
+    try:
+        while True:
+            response = _get_table().query(**query_kwargs)
+            for item in response.get("Items", []):
+                steps[item["sk"][len(prefix):]] = item["value"]
+            if "LastEvaluatedKey" not in response:
+                return steps
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except ClientError as e:
+        print(f"Error reading chunk steps: {e}")
+        raise e
+
+def save_chunk_step(job_id: str, chunk_index: int, prompt_version: str, step: str, value):
+    """
+    Persist a completed sub-step once. If another delivery already stored it,
+    the stored value wins and is returned, so every delivery continues from the same result.
+    """
+    sk = _step_sk_prefix(chunk_index, prompt_version) + step
+    try:
+        _get_table().put_item(
+            Item={"job_id": job_id, "sk": sk, "value": value, "expires_at": _expires_at()},
+            ConditionExpression="attribute_not_exists(sk)"
+        )
+        return value
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            print(f"Error saving chunk step {step}: {e}")
+            raise e
+    response = _get_table().get_item(Key={"job_id": job_id, "sk": sk}, ConsistentRead=True)
+    return response["Item"]["value"]
+
+def _put_chunk_result(job_id: str, chunk_result: dict):
+    """Store a chunk result, never replacing one that already completed"""
+    try:
+        _get_table().put_item(
+            Item={
+                **_to_dynamo(chunk_result),
+                "job_id": job_id,
+                "sk": _chunk_sk(chunk_result["chunk_index"]),
+                "expires_at": _expires_at()
+            },
+            ConditionExpression="attribute_not_exists(sk) OR #st <> :completed",
+            ExpressionAttributeNames={"#st": "status"},
+            ExpressionAttributeValues={":completed": "completed"}
+        )
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+            print(f"Error writing chunk result: {e}")
+            raise e
+
+class JobCancelled(Exception):
+    """The job was cancelled (DELETE /jobs/{job_id}); its remaining work must be dropped"""
+
+def cancel_job(job_id: str):
+    """
+    Mark a job cancelled. Returns the job's attributes before the change (for cleanup),
+    None if the job doesn't exist, or False if it already finished.
+    Progress writes made after this raise JobCancelled, so workers stop at their next one.
+    """
+    try:
+        response = _get_table().update_item(
+            Key=_job_key(job_id),
+            UpdateExpression="SET #cancelled = :true, #ss = :cancelled, #as = :cancelled, #ca = :now",
+            ConditionExpression="attribute_exists(job_id) AND NOT #as IN (:completed, :partial, :failed, :cancelled)",
+            ExpressionAttributeNames={
+                "#cancelled": "cancelled",
+                "#ss": "split_status",
+                "#as": "analysis_status",
+                "#ca": "cancelled_at"
+            },
+            ExpressionAttributeValues={
+                ":true": True,
+                ":cancelled": "cancelled",
+                ":now": datetime.now().isoformat(),
+                ":completed": "completed",
+                ":partial": "partial",
+                ":failed": "failed"
+            },
+            ReturnValues="ALL_OLD"
+        )
+        return response.get("Attributes", {})
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return None if not get_job_fields(job_id, ["job_id"]) else False
+        print(f"Error cancelling job: {e}")
+        raise e
+
+def is_job_cancelled(job_id: str) -> bool:
+    item = _get_table().get_item(
+        Key=_job_key(job_id),
+        ProjectionExpression="#cancelled",
+        ExpressionAttributeNames={"#cancelled": "cancelled"},
+        ConsistentRead=True
+    ).get("Item")
+    return bool(item and item.get("cancelled"))
+
 def update_split_progress(job_id: str, total_chunks=None, completed_chunks=None, split_pct=None, split_status=None, chunks_append=None):
-    """Update split progress atomically"""
+    """Update split progress atomically. Raises JobCancelled once the job was cancelled."""
     try:
         update_expression = "SET"
         expression_attribute_values = {}
@@ -84,66 +328,218 @@ def update_split_progress(job_id: str, total_chunks=None, completed_chunks=None,
         if chunks_append is not None:
             # Append to list if it exists, or create new list if not (using list_append)
             # Note: chunks must be initialized as empty list in create_job
+            # Accepts a single filename or a list of them (coalesced writes)
             updates.append("#c = list_append(#c, :ca)")
             expression_attribute_names["#c"] = "chunks"
-            expression_attribute_values[":ca"] = [chunks_append]
+            expression_attribute_values[":ca"] = chunks_append if isinstance(chunks_append, list) else [chunks_append]
 
         if not updates:
             return
 
         update_expression += " " + ", ".join(updates)
         
-        table.update_item(
-            Key={"job_id": job_id},
+        expression_attribute_names["#cancelled"] = "cancelled"
+        _get_table().update_item(
+            Key=_job_key(job_id),
             UpdateExpression=update_expression,
+            ConditionExpression="attribute_not_exists(#cancelled)",
             ExpressionAttributeNames=expression_attribute_names,
             ExpressionAttributeValues=expression_attribute_values
         )
     except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise JobCancelled(job_id) from e
         print(f"Error updating split progress: {e}")
         raise e
 
+def _final_analysis_status(total_chunks: int, failed_chunks: int) -> str:
+    """Same rule as the local backend: any failure -> partial, more than half -> failed"""
+    if failed_chunks == 0:
+        return "completed"
+    if failed_chunks > total_chunks / 2:
+        return "failed"
+    return "partial"
+
 def update_analysis_progress(job_id: str, chunk_result: dict):
-    """Update analysis progress and append result"""
+    """
+    Store a chunk result as its own item and bump the header counters.
+
+    ADD is atomic on the server, so concurrent analyzer Lambdas never lose an
+    increment. ReturnValues=UPDATED_NEW gives back the counters as left by this
+    write; whoever sees analyzed_chunks reach total_chunks is the only caller
+    that closes the job. Returns the new counters.
+
+    Each chunk_index is counted once (tracked in the counted_chunks number set),
+    so a redelivered message returns None instead of counting the chunk again.
+    Raises JobCancelled if the job was cancelled.
+    """
+    _put_chunk_result(job_id, chunk_result)
+
+    failed = 1 if chunk_result.get("status") == "failed" else 0
     try:
-        # First get current state to calculate percentage
-        # In a real high-concurrency scenario, we might want to use atomic counters, 
-        # but for this use case, reading first is acceptable or we can trust the caller to provide counts.
-        # However, to be safe and atomic, we can increment analyzed_chunks.
-        
-        # We need to fetch total_chunks to calculate percentage
-        job = get_job(job_id)
-        if not job:
-            raise ValueError(f"Job {job_id} not found")
-            
-        total_chunks = job.get("total_chunks", 1) # Avoid division by zero
-        analyzed_chunks = job.get("analyzed_chunks", 0) + 1
-        analysis_pct = Decimal(str((analyzed_chunks / total_chunks) * 100))
-        
-        analysis_status = "processing"
-        if analyzed_chunks >= total_chunks:
-            analysis_status = "completed"
-            
-        update_expression = "SET #ac = :ac, #ap = :ap, #as = :as, #ca = list_append(#ca, :cr)"
-        expression_attribute_names = {
-            "#ac": "analyzed_chunks",
-            "#ap": "analysis_pct",
-            "#as": "analysis_status",
-            "#ca": "chunk_analyses"
-        }
-        expression_attribute_values = {
-            ":ac": analyzed_chunks,
-            ":ap": analysis_pct,
-            ":as": analysis_status,
-            ":cr": [chunk_result]
-        }
-        
-        table.update_item(
-            Key={"job_id": job_id},
-            UpdateExpression=update_expression,
-            ExpressionAttributeNames=expression_attribute_names,
-            ExpressionAttributeValues=expression_attribute_values
+        response = _get_table().update_item(
+            Key=_job_key(job_id),
+            # total_chunks is "touched" with if_not_exists only so it comes back in UPDATED_NEW
+            UpdateExpression=(
+                "ADD #ac :one, #fc :failed, #counted :chunk_set "
+                "SET #tc = if_not_exists(#tc, :zero), #as = :processing"
+            ),
+            ConditionExpression=(
+                "attribute_exists(job_id) AND attribute_not_exists(#cancelled) "
+                "AND NOT contains(#counted, :chunk_index)"
+            ),
+            ExpressionAttributeNames={
+                "#cancelled": "cancelled",
+                "#ac": "analyzed_chunks",
+                "#fc": "failed_chunks",
+                "#counted": "counted_chunks",
+                "#tc": "total_chunks",
+                "#as": "analysis_status"
+            },
+            ExpressionAttributeValues={
+                ":one": 1,
+                ":failed": failed,
+                ":chunk_set": {int(chunk_result["chunk_index"])},
+                ":chunk_index": int(chunk_result["chunk_index"]),
+                ":zero": 0,
+                ":processing": "processing"
+            },
+            ReturnValues="UPDATED_NEW"
         )
     except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            job = get_job_fields(job_id, ["job_id", "cancelled"])
+            if not job:
+                raise ValueError(f"Job {job_id} not found") from e
+            if job.get("cancelled"):
+                raise JobCancelled(job_id) from e
+            print(f"Chunk {chunk_result['chunk_index']} of job {job_id} already counted, skipping")
+            return None
         print(f"Error updating analysis progress: {e}")
         raise e
+
+    attributes = response["Attributes"]
+    progress = {
+        "analyzed_chunks": int(attributes["analyzed_chunks"]),
+        "failed_chunks": int(attributes["failed_chunks"]),
+        "total_chunks": int(attributes["total_chunks"]),
+    }
+    progress["analysis_pct"] = _analysis_pct(progress["analyzed_chunks"], progress["total_chunks"])
+    progress["completed"] = progress["total_chunks"] > 0 and progress["analyzed_chunks"] == progress["total_chunks"]
+
+    if progress["completed"]:
+        # Only one writer observes the counter hitting total_chunks
+        status = _final_analysis_status(progress["total_chunks"], progress["failed_chunks"])
+        try:
+            _get_table().update_item(
+                Key=_job_key(job_id),
+                UpdateExpression="SET #as = :status",
+                ConditionExpression="attribute_not_exists(#cancelled)",
+                ExpressionAttributeNames={"#as": "analysis_status", "#cancelled": "cancelled"},
+                ExpressionAttributeValues={":status": status}
+            )
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+                raise JobCancelled(job_id) from e
+            raise e
+        progress["analysis_status"] = status
+    else:
+        progress["analysis_status"] = "processing"
+    return progress
+
+def get_segment_summaries(job_id: str, consistent: bool = False) -> list:
+    """SegmentSummary dicts of the analyzed chunks, in chunk order"""
+    try:
+        return [
+            _from_dynamo(item["segment_summary"])
+            for item in _query_chunk_items(job_id, fields=["chunk_index", "segment_summary"], consistent=consistent)
+            if item.get("segment_summary")
+        ]
+    except ClientError as e:
+        print(f"Error reading segment summaries: {e}")
+        raise e
+
+def save_tactical_summary(job_id: str, tactical_summary=None, error: str = None, context_digest: str = None) -> bool:
+    """
+    Store the job-level TacticalCoachSummary (or the aggregation error) once, together
+    with the chat context digest built from it.
+    Returns False if an aggregation result was already stored or the job was cancelled.
+    """
+    try:
+        _get_table().update_item(
+            Key=_job_key(job_id),
+            UpdateExpression="SET #ts = :ts, #te = :te, #cd = :cd",
+            ConditionExpression="attribute_exists(job_id) AND attribute_not_exists(#ts) AND attribute_not_exists(#cancelled)",
+            ExpressionAttributeNames={
+                "#ts": "tactical_summary", "#te": "tactical_summary_error", "#cd": "context_digest", "#cancelled": "cancelled"
+            },
+            ExpressionAttributeValues={":ts": _to_dynamo(tactical_summary), ":te": error, ":cd": context_digest}
+        )
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            return False
+        print(f"Error saving tactical summary: {e}")
+        raise e
+
+def get_structured_analysis(job_id: str):
+    """Segment summaries + tactical summary of a job, or None if it doesn't exist"""
+    job = get_job_fields(job_id, ["job_id", "analysis_status", "tactical_summary"])
+    if not job:
+        return None
+    return {
+        "job_id": job_id,
+        "segments": get_segment_summaries(job_id),
+        "tactical_summary": _from_dynamo(job.get("tactical_summary")),
+        "status": job.get("analysis_status", "pending")
+    }
+
+def get_cached_answers(job_id: str) -> list:
+    """Cached chat answers of a job (expired ones may still be returned until DynamoDB TTL removes them)"""
+    query_kwargs = {"KeyConditionExpression": Key("job_id").eq(job_id) & Key("sk").begins_with(ANSWER_SK_PREFIX)}
+    answers = []
+    try:
+        while True:
+            response = _get_table().query(**query_kwargs)
+            answers += [
+                {**_from_dynamo(item), "fingerprint": item["sk"][len(ANSWER_SK_PREFIX):]}
+                for item in response.get("Items", [])
+            ]
+            if "LastEvaluatedKey" not in response:
+                return answers
+            query_kwargs["ExclusiveStartKey"] = response["LastEvaluatedKey"]
+    except ClientError as e:
+        print(f"Error reading cached answers: {e}")
+        raise e
+
+def put_cached_answer(job_id: str, fingerprint: str, question: str, answer: str, version: str, latency_ms: int, expires_at: int):
+    try:
+        _get_table().put_item(Item={
+            "job_id": job_id,
+            "sk": f"{ANSWER_SK_PREFIX}{fingerprint}",
+            "question": question,
+            "answer": answer,
+            "version": version,
+            "latency_ms": int(latency_ms),
+            "expires_at": expires_at
+        })
+    except ClientError as e:
+        print(f"Error caching answer: {e}")
+        raise e
+
+def record_answer_cache(job_id: str, hit: bool, saved_ms: int = 0):
+    """Answer cache hit/miss counters on the job header item"""
+    try:
+        _get_table().update_item(
+            Key=_job_key(job_id),
+            UpdateExpression="ADD #c :one, #saved :saved",
+            ConditionExpression="attribute_exists(job_id)",
+            ExpressionAttributeNames={
+                "#c": "answer_cache_hits" if hit else "answer_cache_misses",
+                "#saved": "answer_cache_saved_ms"
+            },
+            ExpressionAttributeValues={":one": 1, ":saved": int(saved_ms)}
+        )
+    except ClientError as e:
+        # Metrics only: never fail the question because of them
+        print(f"Error recording answer cache metrics: {e}")
@@ -0,0 +1,23 @@
+# S3 layout of a job's derived media. The splitter writes the chunks; the API and the
+# workers delete them when the job is cancelled.
+
+# DeleteObjects accepts at most 1000 keys
+DELETE_BATCH_SIZE = 1000
+
+def split_prefix(job_id: str) -> str:
+    return f"splits/{job_id}/"
+
+def chunk_s3_key(job_id: str, chunk_filename: str) -> str:
+    return split_prefix(job_id) + chunk_filename
+
+def delete_split_chunks(s3, bucket: str, job_id: str) -> int:
+    """Delete every split chunk of a job; returns how many objects were deleted"""
+    keys = []
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket, Prefix=split_prefix(job_id)):
+        keys += [obj["Key"] for obj in page.get("Contents", [])]
+    for start in range(0, len(keys), DELETE_BATCH_SIZE):
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": key} for key in keys[start:start + DELETE_BATCH_SIZE]], "Quiet": True}
+        )
+    return len(keys)
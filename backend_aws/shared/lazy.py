@@ -0,0 +1,31 @@
+import functools
+import threading
+import time
+
+# name -> milliseconds spent building it on first use (cold start cost moved out of import)
+INIT_TIMINGS = {}
+
+def lazy_init(name: str):
+    """
+    Turn a zero-argument factory into a thread-safe getter that builds the object
+    on first call, caches it and records how long building it took.
+    """
+    def decorator(factory):
+        lock = threading.Lock()
+        instance = []
+
+        @functools.wraps(factory)
+        def get():
+            if instance:
+                return instance[0]
+            with lock:
+                if not instance:
+                    start = time.perf_counter()
+                    instance.append(factory())
+                    elapsed_ms = (time.perf_counter() - start) * 1000
+                    INIT_TIMINGS[name] = elapsed_ms
+                    print(f"[cold-start] {name} initialized in {elapsed_ms:.1f} ms")
+            return instance[0]
+
+        return get
+    return decorator
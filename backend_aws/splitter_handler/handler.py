@@ -4,10 +4,16 @@ import os
 import subprocess
 import math
 import re
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import imageio_ffmpeg
-from shared import db_service
+from boto3.s3.transfer import TransferConfig
+from shared import db_service, job_media
 
 # Initialize clients
+# AWS_ENDPOINT_URL points everything at a local stand-in (moto_server, MinIO, LocalStack);
+# presigned URLs are generated against that endpoint too, so ffmpeg reads from it directly.
 aws_endpoint = os.getenv("AWS_ENDPOINT_URL")
 if aws_endpoint:
     s3 = boto3.client('s3', endpoint_url=aws_endpoint)
@@ -19,8 +25,28 @@ else:
 BUCKET_NAME = os.getenv('BUCKET_NAME')
 ANALYSIS_QUEUE_URL = os.getenv('ANALYSIS_QUEUE_URL')
 
+# Chunks being uploaded while the next one is cut; also bounds how many sit in /tmp
+UPLOAD_CONCURRENCY = int(os.getenv("SPLIT_UPLOAD_CONCURRENCY", "4"))
+# Multipart upload of each chunk (parts go up in parallel)
+TRANSFER_CONFIG = TransferConfig(
+    multipart_threshold=8 * 1024 * 1024,
+    multipart_chunksize=8 * 1024 * 1024,
+    max_concurrency=4
+)
+# The presigned URL must outlive the whole split (Lambda timeout is 10 min)
+SOURCE_URL_EXPIRES_IN = 3600
+# SendMessageBatch accepts at most 10 entries
+SQS_BATCH_SIZE = 10
+# Progress + fan-out are flushed every N uploaded chunks or every T ms, whichever comes first
+PROGRESS_FLUSH_CHUNKS = int(os.getenv("SPLIT_PROGRESS_FLUSH_CHUNKS", "10"))
+PROGRESS_FLUSH_MS = int(os.getenv("SPLIT_PROGRESS_FLUSH_MS", "2000"))
+# FIFO queues deliver one message group at a time, so a job's chunks are spread over
+# this many groups: that is how many of its chunks can be analyzed in parallel.
+# Chunk order is restored from chunk_index when results are read back.
+ANALYSIS_JOB_CONCURRENCY = max(1, int(os.getenv("ANALYSIS_JOB_CONCURRENCY", "4")))
+
 def get_duration(ffmpeg_exe, file_path):
-    """Get duration using ffmpeg -i"""
+    """Get duration using ffmpeg -i (works on a local path or an http(s) URL)"""
     cmd = [ffmpeg_exe, "-i", file_path]
     result = subprocess.run(cmd, capture_output=True, text=True)
     # ffmpeg outputs to stderr
@@ -31,6 +57,82 @@ def get_duration(ffmpeg_exe, file_path):
         return float(hours) * 3600 + float(minutes) * 60 + float(seconds)
     raise ValueError(f"Could not determine duration from output: {output}")
 
+def upload_chunk(chunk_path, chunk_s3_key):
+    """Multipart upload of a chunk, removing the local file afterwards"""
+    try:
+        s3.upload_file(chunk_path, BUCKET_NAME, chunk_s3_key, Config=TRANSFER_CONFIG)
+    finally:
+        if os.path.exists(chunk_path):
+            os.remove(chunk_path)
+
+def analysis_message_group(job_id, chunk_index):
+    """FIFO message group for a chunk: job_id sharded by chunk_index"""
+    return f"{job_id}#{chunk_index % ANALYSIS_JOB_CONCURRENCY}"
+
+def send_analysis_messages(job_id, messages):
+    """Send chunk messages to the analysis queue in SendMessageBatch groups, retrying failed entries once"""
+    for start in range(0, len(messages), SQS_BATCH_SIZE):
+        entries = [
+            {
+                "Id": str(message["chunk_index"]),
+                "MessageBody": json.dumps(message),
+                "MessageGroupId": analysis_message_group(job_id, message["chunk_index"])
+            }
+            for message in messages[start:start + SQS_BATCH_SIZE]
+        ]
+        for attempt in range(2):
+            response = sqs.send_message_batch(QueueUrl=ANALYSIS_QUEUE_URL, Entries=entries)
+            failed_ids = {failure["Id"] for failure in response.get("Failed", [])}
+            if not failed_ids:
+                break
+            print(f"SendMessageBatch failed for chunks {sorted(failed_ids)} (attempt {attempt + 1})")
+            entries = [entry for entry in entries if entry["Id"] in failed_ids]
+        else:
+            raise RuntimeError(f"Could not enqueue chunks {sorted(failed_ids)} for job {job_id}")
+
+class ChunkFanout:
+    """Coalesces progress writes and analysis messages for uploaded chunks"""
+
+    def __init__(self, job_id, total_chunks):
+        self.job_id = job_id
+        self.total_chunks = total_chunks
+        self.completed_chunks = 0
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def add(self, i, chunk_filename, chunk_s3_key, start_s, end_s):
+        self.buffer.append({
+            "job_id": self.job_id,
+            "chunk_index": i,
+            "chunk_s3_key": chunk_s3_key,
+            "chunk_filename": chunk_filename,
+            "start_s": int(start_s),
+            "end_s": int(end_s)
+        })
+        elapsed_ms = (time.monotonic() - self.last_flush) * 1000
+        if len(self.buffer) >= PROGRESS_FLUSH_CHUNKS or elapsed_ms >= PROGRESS_FLUSH_MS:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        self.completed_chunks += len(self.buffer)
+        # Update DB once for the whole group
+        db_service.update_split_progress(
+            self.job_id,
+            completed_chunks=self.completed_chunks,
+            split_pct=(self.completed_chunks / self.total_chunks) * 100,
+            chunks_append=[message["chunk_filename"] for message in self.buffer]
+        )
+        # Send to Analysis Queue
+        send_analysis_messages(self.job_id, self.buffer)
+        self.buffer = []
+        self.last_flush = time.monotonic()
+
+def delete_cancelled_splits(job_id):
+    deleted = job_media.delete_split_chunks(s3, BUCKET_NAME, job_id)
+    print(f"Deleted {deleted} split chunks of cancelled job {job_id}")
+
 def lambda_handler(event, context):
     ffmpeg_exe = imageio_ffmpeg.get_ffmpeg_exe()
     
@@ -42,13 +144,17 @@ def lambda_handler(event, context):
             
             print(f"Processing job {job_id}, key {s3_key}")
             
-            # Download video
-            local_path = f"/tmp/{job_id}.mp4"
-            s3.download_file(BUCKET_NAME, s3_key, local_path)
+            # ffmpeg reads the source straight from S3: probing and -ss seeking turn
+            # into HTTP range requests, so the video is never fully downloaded to /tmp
+            source_url = s3.generate_presigned_url(
+                "get_object",
+                Params={"Bucket": BUCKET_NAME, "Key": s3_key},
+                ExpiresIn=SOURCE_URL_EXPIRES_IN
+            )
             
             # Get duration
             try:
-                duration = get_duration(ffmpeg_exe, local_path)
+                duration = get_duration(ffmpeg_exe, source_url)
             except ValueError as e:
                 print(f"Error getting duration: {e}")
                 raise e
@@ -58,59 +164,60 @@ def lambda_handler(event, context):
             
             db_service.update_split_progress(job_id, total_chunks=total_chunks, split_status="processing")
             
-            for i in range(total_chunks):
-                start_time = i * window
-                end_time = min((i + 1) * window, duration)
-                
-                chunk_filename = f"chunk_{i}.mp4"
-                chunk_path = f"/tmp/{chunk_filename}"
-                chunk_s3_key = f"splits/{job_id}/{chunk_filename}"
-                
-                # Split
-                split_cmd = [
-                    ffmpeg_exe, "-y",
-                    "-ss", str(start_time),
-                    "-to", str(end_time),
-                    "-i", local_path,
-                    "-c", "copy",
-                    chunk_path
-                ]
-                subprocess.run(split_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-                
-                # Upload
-                s3.upload_file(chunk_path, BUCKET_NAME, chunk_s3_key)
-                
-                # Update DB
-                db_service.update_split_progress(
-                    job_id, 
-                    completed_chunks=i+1, 
-                    split_pct=((i+1)/total_chunks)*100, 
-                    chunks_append=chunk_filename
-                )
-                
-                # Send to Analysis Queue
-                sqs.send_message(
-                    QueueUrl=ANALYSIS_QUEUE_URL,
-                    MessageBody=json.dumps({
-                        "job_id": job_id,
-                        "chunk_index": i,
-                        "chunk_s3_key": chunk_s3_key,
-                        "chunk_filename": chunk_filename
-                    }),
-                    MessageGroupId=job_id
-                )
-                
-                # Cleanup chunk
-                if os.path.exists(chunk_path):
-                    os.remove(chunk_path)
+            fanout = ChunkFanout(job_id, total_chunks)
+            
+            # Uploads in flight, oldest first; finished ones are reported in chunk order
+            pending = deque()
+            with ThreadPoolExecutor(max_workers=UPLOAD_CONCURRENCY) as uploader:
+                for i in range(total_chunks):
+                    start_time = i * window
+                    end_time = min((i + 1) * window, duration)
+                    
+                    chunk_filename = f"chunk_{i}.mp4"
+                    chunk_path = f"/tmp/{job_id}_{chunk_filename}"
+                    chunk_s3_key = job_media.chunk_s3_key(job_id, chunk_filename)
+                    
+                    # Split
+                    split_cmd = [
+                        ffmpeg_exe, "-y",
+                        "-ss", str(start_time),
+                        "-to", str(end_time),
+                        "-i", source_url,
+                        "-c", "copy",
+                        chunk_path
+                    ]
+                    subprocess.run(split_cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+                    
+                    # Upload in the background while the next segment is cut
+                    future = uploader.submit(upload_chunk, chunk_path, chunk_s3_key)
+                    pending.append((future, i, chunk_filename, chunk_s3_key, start_time, end_time))
+                    
+                    # Report finished uploads; block on the oldest one when the pool is full
+                    while pending and (pending[0][0].done() or len(pending) >= UPLOAD_CONCURRENCY):
+                        future, *chunk = pending.popleft()
+                        future.result()
+                        fanout.add(*chunk)
                 
-            db_service.update_split_progress(job_id, split_status="completed")
+                while pending:
+                    future, *chunk = pending.popleft()
+                    future.result()
+                    fanout.add(*chunk)
             
-            # Cleanup video
-            if os.path.exists(local_path):
-                os.remove(local_path)
+            fanout.flush()
+            db_service.update_split_progress(job_id, split_status="completed")
+        
+        except db_service.JobCancelled:
+            # Raised by the first progress write after DELETE /jobs/{job_id}. Chunks
+            # already queued are skipped by the analyzer; drop the ones uploaded so far.
+            print(f"Job {job_id} was cancelled, stopping the split")
+            delete_cancelled_splits(job_id)
                 
         except Exception as e:
+            if 'job_id' in locals() and db_service.is_job_cancelled(job_id):
+                # e.g. the source went away with the cancellation: nothing to retry
+                print(f"Job {job_id} was cancelled, dropping split error: {e}")
+                delete_cancelled_splits(job_id)
+                continue
             print(f"Error processing record: {e}")
             # If we fail, the message will go back to queue (or DLQ eventually)
             # We might want to update DB status to failed?
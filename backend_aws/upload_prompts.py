@@ -1,25 +1,54 @@
-import boto3
+import json
 import os
 import sys
 from pathlib import Path
 
-def upload_prompts(bucket_name):
-    """Uploads prompts from local templates folder to S3"""
-    
-    # Path to templates directory
+# build_bundle lives with the loader that reads the bundle, so both agree on the version hash
+sys.path.insert(0, str(Path(__file__).parent / "analyzer_handler"))
+from prompts.loader import build_bundle, BAKED_BUNDLE_PATH
+
+# Structured-output (JSON) prompts of the analyzer: bundled, but not chat agent specialists
+STRUCTURED_TEMPLATES_DIR = BAKED_BUNDLE_PATH.parent / "structured"
+
+BUNDLE_S3_KEY = "prompts/bundle.json"
+
+def _templates_dir() -> Path:
     # Assuming this script is in backend_aws/
     base_dir = Path(__file__).parent.parent
-    templates_dir = base_dir / "backend" / "prompts" / "templates"
-    
+    return base_dir / "backend" / "prompts" / "templates"
+
+def write_bundle() -> dict:
+    """Builds the prompt bundle from the local templates and bakes it into the analyzer image sources"""
+    templates_dir = _templates_dir()
     if not templates_dir.exists():
-        print(f"Error: Templates directory not found at {templates_dir}")
-        return
+        raise FileNotFoundError(f"Templates directory not found at {templates_dir}")
+    
+    templates = {path.stem: path.read_text(encoding="utf-8") for path in templates_dir.glob("*.txt")}
+    # Part of the version hash too, so changing them changes the prompt version
+    templates.update({path.stem: path.read_text(encoding="utf-8") for path in STRUCTURED_TEMPLATES_DIR.glob("*.txt")})
+    bundle = build_bundle(templates)
+    BAKED_BUNDLE_PATH.write_text(json.dumps(bundle, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+    print(f"Prompt bundle {bundle['version']} ({len(templates)} templates) written to {BAKED_BUNDLE_PATH}")
+    return bundle
 
+def upload_prompts(bucket_name):
+    """Uploads the prompt bundle (analyzer override) and the individual templates (chat agent specialists) to S3"""
+    bundle = write_bundle()
+    
+    import boto3
     s3 = boto3.client('s3')
     
+    print(f"Uploading prompt bundle to s3://{bucket_name}/{BUNDLE_S3_KEY} ...")
+    s3.put_object(
+        Bucket=bucket_name,
+        Key=BUNDLE_S3_KEY,
+        Body=json.dumps(bundle, ensure_ascii=False).encode("utf-8"),
+        ContentType="application/json"
+    )
+    
     print(f"Uploading prompts to s3://{bucket_name}/prompts/templates/ ...")
     
-    for file_path in templates_dir.glob("*.txt"):
+    for file_path in _templates_dir().glob("*.txt"):
         key = f"prompts/templates/{file_path.name}"
         try:
             print(f"Uploading {file_path.name} -> {key}")
@@ -29,8 +58,11 @@ def upload_prompts(bucket_name):
             print(f"Failed to upload {file_path.name}: {e}")
 
 if __name__ == "__main__":
+    if len(sys.argv) == 2 and sys.argv[1] == "--bundle-only":
+        write_bundle()
+        sys.exit(0)
     if len(sys.argv) != 2:
-        print("Usage: python upload_prompts.py <bucket_name>")
+        print("Usage: python upload_prompts.py <bucket_name> | --bundle-only")
         sys.exit(1)
     
     bucket_name = sys.argv[1]
@@ -81,6 +81,10 @@ export async function uploadFullVideo(file) {
 }
 
 
+// Estados en los que el job ya no avanza: se deja de consultar
+const SPLIT_TERMINAL_STATUSES = ["completed", "failed", "cancelled"];
+const ANALYSIS_TERMINAL_STATUSES = ["completed", "partial", "failed", "cancelled"];
+
 export async function pollSplitProgress(jobId, onProgress) {
   if (typeof onProgress !== "function") {
     console.error("pollSplitProgress: onProgress NO es función");
@@ -102,7 +106,8 @@ export async function pollSplitProgress(jobId, onProgress) {
         onProgress(Math.floor(data.split_pct));
       }
 
-      if (data.split_status === "completed") {
+      // un split fallido o cancelado también termina: el estado del análisis lo refleja
+      if (SPLIT_TERMINAL_STATUSES.includes(data.split_status)) {
         return data;
       }
     } catch (error) {
@@ -131,7 +136,8 @@ export async function getAnalysis(jobId) {
 export async function pollAnalysisProgress(jobId, onProgress) {
   async function loop() {
     try {
-      const res = await fetch(`${import.meta.env.VITE_API_URL}/analysis/${jobId}`);
+      // solo contadores/estado; el análisis completo se pide al terminar
+      const res = await fetch(`${import.meta.env.VITE_API_URL}/analysis/${jobId}/progress`);
       if (!res.ok) {
         console.warn(`pollAnalysisProgress: Server returned ${res.status}`);
         await new Promise((r) => setTimeout(r, 2000));
@@ -144,9 +150,9 @@ export async function pollAnalysisProgress(jobId, onProgress) {
         onProgress(Math.floor(data.analysis_pct));
       }
 
-      // si el análisis terminó
-      if (data.analysis_status === "completed") {
-        return data;
+      // si el análisis terminó (bien, en parte, con error o cancelado)
+      if (ANALYSIS_TERMINAL_STATUSES.includes(data.analysis_status)) {
+        return getAnalysis(jobId);
       }
     } catch (error) {
       console.error("pollAnalysisProgress error:", error);